@@ -1,22 +1,32 @@
 """
-Script 00: Database Status Inspector (Health Check)
----------------------------------------------------
+Script 00 (V2.0): Database Status Inspector (Health Dashboard)
+--------------------------------------------------------------
 功能:
-1. 扫描 Script 01 定义的所有数据库和集合。
-2. 统计各表的数据量 (Count)。
-3. 标识哪些是 "✅ 就绪"，哪些是 "⬜ 空置"。
-4. 帮助决策下一步的数据获取优先级。
+1. 扫描 Script 01 定义的所有数据库和集合 (SCHEMA_CHECKLIST)。
+2. [极速] 数据量使用 estimated_document_count (读取元数据，不扫表)。
+3. [容量] 通过 collStats 获取 size / storageSize / 索引大小。
+4. [日期] 每个集合的最早/最新日期走索引 (DISTINCT_SCAN)，不做全表排序。
+5. [并发] 所有库表的查询并发执行，十亿级 bar 表也能在 1 秒左右出结果。
+6. [趋势] 每次体检写入快照 (vnpy_master.db_status_snapshot)，展示存储与索引的增长。
 """
 
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
 import pandas as pd
-from pymongo import MongoClient
+from bson.son import SON
+from pymongo import DESCENDING
 from tabulate import tabulate
 
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+from utils import mongo_client
+
 # ==========================================
 # 配置: 定义我们需要检查的架构 (Sync with Script 01)
 # ==========================================
-MONGO_HOST = "localhost"
-MONGO_PORT = 27017
 
 SCHEMA_CHECKLIST = {
     "vnpy_stock": [
@@ -27,12 +37,15 @@ SCHEMA_CHECKLIST = {
         "finance_balance",  # 资产负债表 (进行中)
         "finance_income",  # 利润表 (进行中)
         "finance_cashflow",  # 现金流量表 (进行中)
+        "finance_std",  # 三表规范化列式快照 (21)
         "valuation_daily",  # 每日估值 (待生成)
         "index_daily",  # 指数行情 (Script 05)
-        "index_components",  # 指数成分股 (待定)
+        "index_components",  # 指数成分股 (旧: 每日全量快照)
+        "index_membership_events",  # 成分股调入/调出事件 (PIT)
+        "index_membership_checkpoints",  # 成分股定期快照 (PIT)
         "industry_history",  # 行业分类历史 (待定)
-        "analysis_limit_up",  # 涨停分析 (待定)
-        "analysis_limit_down"  # 跌停分析 (待定)
+        "analysis_limit_up",  # 涨停分析 (19)
+        "analysis_limit_down"  # 跌停分析 (19)
     ],
     "vnpy_master": [
         "trading_calendar",  # 交易日历 (重要!)
@@ -48,74 +61,236 @@ SCHEMA_CHECKLIST = {
     ]
 }
 
+# 可识别的日期字段 (按优先级)
+DATE_KEYS = ["date", "datetime", "report_date", "ex_date", "list_date"]
+
+# 并发线程数 (每个集合一个任务)
+MAX_WORKERS = 16
+
+# 快照: 存储体检结果，用于展示增长趋势
+SNAPSHOT_DB = "vnpy_master"
+SNAPSHOT_COL = "db_status_snapshot"
+SAVE_SNAPSHOT = True
+HISTORY_LIMIT = 7  # 趋势表展示最近 N 次快照
+
+MB = 1024 * 1024
+
 
 def get_client():
-    return MongoClient(MONGO_HOST, MONGO_PORT)
+    return mongo_client.get_client(maxPoolSize=MAX_WORKERS + 4)
+
+
+def find_date_index(col):
+    """
+    找到一个包含日期字段的索引，返回 (日期字段, 日期字段之前及自身的索引键, 索引名)。
+    例: bar_daily 的 (symbol, exchange, interval, datetime) -> ("datetime", [...4 keys], "symbol_1_...")
+    """
+    for name, info in col.index_information().items():
+        keys = list(info["key"])
+        for pos, (field, _) in enumerate(keys):
+            if field in DATE_KEYS:
+                return field, keys[:pos + 1], name
+    return None, [], None
+
+
+def get_date_bounds(col, date_field, index_keys, index_name):
+    """
+    借助索引求最早/最新日期。
+    - 日期是索引首键: 直接 sort + limit(1)。
+    - 日期在复合索引中间 (如 symbol+date): 按索引顺序 $sort 后按首键 $group 取 $first，
+      MongoDB 会走 DISTINCT_SCAN，每个首键只跳读一次索引，代价与 symbol 数成正比而非行数。
+      _id 必须是单个首键: 多字段 _id (symbol/exchange/interval) 不能用 DISTINCT_SCAN，会退化为整个索引扫描。
+      首键与日期之间还有键时 (bar_daily 的 exchange / interval)，取的是每个 symbol 在索引中第一个组合的日期，
+      对每只代码只有一个交易所 / 周期的行情表是精确的。
+    """
+    prefix = index_keys[:-1]
+    if not prefix:
+        lo = col.find_one({}, {date_field: 1, "_id": 0}, sort=[(date_field, 1)], hint=index_name)
+        hi = col.find_one({}, {date_field: 1, "_id": 0}, sort=[(date_field, -1)], hint=index_name)
+        return (lo or {}).get(date_field), (hi or {}).get(date_field)
+
+    group_id = f"${prefix[0][0]}"
+    values = []
+    for flip in (1, -1):
+        sort = SON([(field, direction * flip) for field, direction in index_keys])
+        pipeline = [
+            {"$sort": sort},
+            {"$group": {"_id": group_id, "v": {"$first": f"${date_field}"}}},
+            {"$group": {"_id": None, "lo": {"$min": "$v"}, "hi": {"$max": "$v"}}},
+        ]
+        res = list(col.aggregate(pipeline, hint=index_name))
+        if res:
+            values.extend([res[0]["lo"], res[0]["hi"]])
+
+    values = [v for v in values if v is not None]
+    if not values:
+        return None, None
+    # 同一字段在不同集合里可能是 str / datetime，统一按字符串比较展示
+    return min(values, key=str), max(values, key=str)
+
+
+def get_coll_stats(db, col_name):
+    """collStats: 数据量、数据大小、磁盘占用、索引大小 (全部来自元数据)"""
+    try:
+        stats = db.command("collStats", col_name)
+    except Exception:
+        return {}
+    return {
+        "size": stats.get("size", 0),
+        "storage_size": stats.get("storageSize", 0),
+        "index_size": stats.get("totalIndexSize", 0),
+        "index_sizes": stats.get("indexSizes", {}),
+        "avg_obj_size": stats.get("avgObjSize", 0),
+    }
+
+
+def inspect_collection(client, db_name, col_name):
+    """单个集合的体检任务 (在线程池中执行)"""
+    db = client[db_name]
+    col = db[col_name]
+    row = {"db": db_name, "collection": col_name}
+    try:
+        count = col.estimated_document_count()
+        row["count"] = count
+        row.update(get_coll_stats(db, col_name))
+
+        row["date_field"], row["min_date"], row["max_date"] = None, None, None
+        if count > 0:
+            date_field, index_keys, index_name = find_date_index(col)
+            if date_field:
+                lo, hi = get_date_bounds(col, date_field, index_keys, index_name)
+                row.update({"date_field": date_field, "min_date": lo, "max_date": hi})
+    except Exception as e:
+        row["error"] = str(e)
+    return row
+
+
+def status_label(row):
+    if "error" in row:
+        return f"❌ {row['error'][:40]}"
+    count = row.get("count", 0)
+    if count > 100000:
+        return "✅ 充裕"
+    elif count > 0:
+        return "⚠️ 部分"
+    return "⬜ 空置"
+
+
+def fmt_date(val):
+    return str(val).split()[0] if val is not None else "-"
+
+
+def fmt_mb(val):
+    return f"{val / MB:,.1f}" if val else "0.0"
+
+
+def fmt_delta(cur, prev):
+    if prev is None:
+        return "-"
+    diff = cur - prev
+    return f"{diff / MB:+,.1f}" if diff else "0"
+
+
+def load_snapshots(client, limit):
+    col = client[SNAPSHOT_DB][SNAPSHOT_COL]
+    return list(col.find({}, {"_id": 0}).sort("ts", DESCENDING).limit(limit))
+
+
+def save_snapshot(client, rows, elapsed):
+    doc = {
+        "ts": datetime.now(),
+        "elapsed": elapsed,
+        "stats": [
+            {
+                "db": r["db"], "collection": r["collection"],
+                "count": r.get("count", 0), "size": r.get("size", 0),
+                "storage_size": r.get("storage_size", 0), "index_size": r.get("index_size", 0),
+            }
+            for r in rows if "error" not in r
+        ],
+    }
+    client[SNAPSHOT_DB][SNAPSHOT_COL].insert_one(doc)
+
+
+def print_trend(snapshots):
+    """按快照时间展示各库 数据/磁盘/索引 的变化"""
+    if len(snapshots) < 2:
+        return
+    print("\n📈 存储增长趋势 (MB, 最近 {} 次快照)".format(len(snapshots)))
+    trend = []
+    for snap in reversed(snapshots):
+        df = pd.DataFrame(snap["stats"])
+        if df.empty:
+            continue
+        agg = df.groupby("db")[["count", "storage_size", "index_size"]].sum()
+        row = {"Snapshot": snap["ts"].strftime("%Y-%m-%d %H:%M")}
+        for db_name, vals in agg.iterrows():
+            row[f"{db_name} 存储"] = fmt_mb(vals["storage_size"])
+            row[f"{db_name} 索引"] = fmt_mb(vals["index_size"])
+        trend.append(row)
+    print(tabulate(pd.DataFrame(trend).fillna("-"), headers="keys", tablefmt="simple_grid", showindex=False))
 
 
 def inspect_db():
-    print("🚀 启动 [全资产数据库体检程序]...")
+    print("🚀 启动 [全资产数据库体检程序 V2.0]...")
     client = get_client()
+    t0 = time.perf_counter()
 
-    report_data = []
+    tasks = [(db_name, col_name) for db_name, cols in SCHEMA_CHECKLIST.items() for col_name in cols]
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as pool:
+        rows = list(pool.map(lambda t: inspect_collection(client, *t), tasks))
+
+    elapsed = time.perf_counter() - t0
 
-    for db_name, collections in SCHEMA_CHECKLIST.items():
-        db = client[db_name]
-
-        for col_name in collections:
-            try:
-                count = db[col_name].count_documents({})
-
-                # 状态判定
-                if count > 100000:
-                    status = "✅ 充裕"
-                elif count > 0:
-                    status = "⚠️ 部分"
-                else:
-                    status = "⬜ 空置"
-
-                # 抽样时间 (如果有 date 字段)
-                latest_date = "-"
-                if count > 0:
-                    sample = db[col_name].find_one(sort=[("date", -1)]) or \
-                             db[col_name].find_one(sort=[("datetime", -1)]) or \
-                             db[col_name].find_one(sort=[("report_date", -1)])
-
-                    if sample:
-                        for date_key in ["date", "datetime", "report_date", "list_date"]:
-                            if date_key in sample:
-                                val = sample[date_key]
-                                latest_date = str(val).split()[0]
-                                break
-
-                report_data.append({
-                    "Database": db_name,
-                    "Collection": col_name,
-                    "Count": count,
-                    "Status": status,
-                    "Latest Date": latest_date
-                })
-
-            except Exception as e:
-                report_data.append({
-                    "Database": db_name,
-                    "Collection": col_name,
-                    "Count": "Error",
-                    "Status": f"❌ {str(e)}",
-                    "Latest Date": "-"
-                })
+    # 上一次快照 (用于增长对比)
+    history = load_snapshots(client, HISTORY_LIMIT)
+    prev_map = {}
+    if history:
+        prev_map = {(s["db"], s["collection"]): s for s in history[0]["stats"]}
+
+    report_data = []
+    for r in rows:
+        prev = prev_map.get((r["db"], r["collection"]))
+        report_data.append({
+            "Database": r["db"],
+            "Collection": r["collection"],
+            "Count": r.get("count", "Error"),
+            "Status": status_label(r),
+            "First Date": fmt_date(r.get("min_date")),
+            "Latest Date": fmt_date(r.get("max_date")),
+            "Data(MB)": fmt_mb(r.get("size", 0)),
+            "Disk(MB)": fmt_mb(r.get("storage_size", 0)),
+            "Index(MB)": fmt_mb(r.get("index_size", 0)),
+            "ΔDisk": fmt_delta(r.get("storage_size", 0), prev["storage_size"] if prev else None),
+            "ΔIndex": fmt_delta(r.get("index_size", 0), prev["index_size"] if prev else None),
+        })
 
     print("\n" + "=" * 80)
-    print("🏥 数据库体检报告 (Database Health Report)")
+    print(f"🏥 数据库体检报告 (Database Health Report) - 耗时 {elapsed:.2f}s")
     print("=" * 80)
 
     df = pd.DataFrame(report_data)
     print(tabulate(df, headers='keys', tablefmt='simple_grid', showindex=False))
 
+    # 索引明细: 只列出有数据的集合，方便发现异常膨胀的索引
+    index_rows = []
+    for r in rows:
+        for idx_name, idx_size in (r.get("index_sizes") or {}).items():
+            index_rows.append({"Database": r["db"], "Collection": r["collection"],
+                               "Index": idx_name, "Size(MB)": fmt_mb(idx_size)})
+    if index_rows:
+        print("\n🗂  索引明细")
+        print(tabulate(pd.DataFrame(index_rows), headers='keys', tablefmt='simple_grid', showindex=False))
+
+    if SAVE_SNAPSHOT:
+        save_snapshot(client, rows, elapsed)
+        history = load_snapshots(client, HISTORY_LIMIT)
+    print_trend(history)
+
     print("\n💡 下一步建议:")
     empty_cols = df[df["Count"] == 0]["Collection"].tolist()
     print(f"   发现 {len(empty_cols)} 个空表，建议优先补充基础元数据表 (如 trading_calendar, industry_history)。")
 
 
 if __name__ == "__main__":
-    inspect_db()
\ No newline at end of file
+    inspect_db()
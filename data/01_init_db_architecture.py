@@ -53,6 +53,15 @@ SCHEMA_MAP = {
             ("index_symbol", ASCENDING), ("date", ASCENDING)
         ],
 
+        # --- 1.3b [广义指数] 成分股 PIT 增量存储 (utils/pit_membership) ---
+        # [字段]: index_symbol, symbol, date, action (ADD/REMOVE), weight
+        # [作用]: 只记录调入/调出事件，配合定期 checkpoint 还原任意日期的成分股。
+        "index_membership_events": [
+            ("index_symbol", ASCENDING), ("date", ASCENDING), ("symbol", ASCENDING), ("action", ASCENDING)
+        ],
+        "index_membership_checkpoints": [("index_symbol", ASCENDING), ("date", ASCENDING)],
+        "index_membership_state": [("index_symbol", ASCENDING)],
+
         # --- 1.4 [广义指数] 基础信息 ---
         # [字段]: symbol, name, category (类别), source (来源: SINA/SW/EM)
         "index_info": [("symbol", ASCENDING)],
@@ -79,6 +88,8 @@ SCHEMA_MAP = {
         "finance_cashflow": [  # 现金流量表
             ("symbol", ASCENDING), ("report_date", DESCENDING), ("publish_date", DESCENDING)
         ],
+        # 三表规范化快照: 每只股票一个列式文档 (Script 21 / utils/financial_schema.py)
+        "finance_std": [("symbol", ASCENDING)],
 
         # --- 1.7 股本变动 (Capital Structure) [NEW] ---
         # [字段]: total_shares (总股本), float_shares (流通股本), change_reason (变动原因)
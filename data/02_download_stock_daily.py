@@ -5,18 +5,35 @@
 - [FEAT] 切换为增量模式：查询 bar_daily 最新日期，只下载新数据。
 - [FEAT] 股票列表源切换：优先从本地 stock_info 表中获取股票列表。
 - [FIX] 修复代码前缀逻辑。
+- [PERF] 变更检测写入 (utils/hashed_upsert): 与库中内容相同的 K 线跳过，不再重复 upsert。
+- [PERF] 快照快速路径: 一次聚合取回全市场水位；收盘后只差一个交易日的股票用东财全市场快照
+         (stock_zh_a_spot_em，几次分页请求) 向量化生成当日 K 线，只有断档 / 新股才逐只请求新浪历史。
+- [FIX] 下载截止到最近一个已收盘交易日 (09 交易日历)；原先水位为昨天时 "起始日 == 今天" 会跳过当日 K 线。
+- [FIX] 快照只在它就是 session 收盘时使用 (当日收盘后 / 非交易日)；交易日盘前、盘中的快照是今天的
+        空值或盘中价，不能记为昨天的 K 线，此时全部走逐只下载。
+- [FEAT] 历史缺口精确补数: 领取 25 (utils/completeness) 审计出的 bar_daily 缺失区间，每只股票只请求缺口跨度，
+         不再整段重下。
 """
 import os
+import sys
 import time
 import random
 from datetime import datetime, timedelta # ✅ 新增导入 timedelta
 from tqdm import tqdm
-from pymongo import UpdateOne, MongoClient
-from vnpy.trader.constant import Exchange, Interval
+from vnpy.trader.constant import Interval
 import akshare as ak
+import numpy as np
 import pandas as pd
 import requests
 
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+from utils.stage_profiler import StageProfiler
+from utils.mongo_client import get_client
+from utils.hashed_upsert import HashedUpsert
+from utils import completeness, symbol_master
+
+PROF = StageProfiler(__file__)
+
 # --- 🛡️ 直连补丁 ---
 os.environ['http_proxy'] = ''
 os.environ['https_proxy'] = ''
@@ -26,10 +43,19 @@ os.environ['NO_PROXY'] = '*'
 # --- 配置 ---
 START_DATE = "20050101" # 首次下载的起始日期
 ADJUST = "" # Raw Data
+SNAPSHOT_FAST_PATH = True  # 收盘后用全市场行情快照补当日 K 线，只对断档股票逐只下载
+SNAPSHOT_AFTER = "15:30"   # 早于此时刻视为未收盘: 当日不入库
+SNAPSHOT_GATEWAY = "AKSHARE_EM_SPOT"
+REPAIR_GAPS = True  # 按 25 的工作清单补下载历史缺口
+REPAIR_MAX_RUNS = 500  # 每次最多领取的缺口段数
 
-CLIENT = MongoClient("localhost", 27017)
+CLIENT = get_client()
 col_bar = CLIENT["vnpy_stock"]["bar_daily"]
 col_info = CLIENT["vnpy_stock"]["stock_info"] # 本地股票元数据表
+col_calendar = CLIENT["vnpy_master"]["trading_calendar"]
+# 变更检测写入: 与库中内容相同的 K 线 (重叠下载、重跑) 不再重复 upsert；
+# 写入的 K 线打 updated_at，补数 / 更正这类原地更新也能被下游 (run_pipeline 的输入指纹) 感知
+BAR_WRITER = HashedUpsert(col_bar, keys=("symbol", "exchange", "interval", "datetime"), stamp="updated_at")
 
 def get_local_stock_list():
     """
@@ -52,34 +78,65 @@ def get_local_stock_list():
 
     return tasks
 
-def get_incremental_start_date(symbol: str) -> str:
+def load_watermarks():
     """
-    [NEW] 查询 bar_daily 表中某个股票的最新日期，返回 YYYYMMDD 格式的下一天。
+    水位索引: 一次聚合取回每只股票 bar_daily 的最新日期 {symbol: datetime}，
+    取代逐只 find_one (5000 次往返)。按 bar_daily 唯一索引 (symbol, exchange, interval, datetime) 的完整键序倒序，
+    由索引给出顺序后 $group $first，不做内存 / 落盘排序。
     """
-    doc = col_bar.find_one(
-        {"symbol": symbol},
-        sort=[("datetime", -1)],
-        projection={"datetime": 1}
-    )
-
-    if doc and 'datetime' in doc:
-        # 获取最新日期并加 1 天
-        latest_dt = doc['datetime']
+    pipeline = [
+        {"$match": {"interval": Interval.DAILY.value}},
+        {"$sort": {"symbol": -1, "exchange": -1, "interval": -1, "datetime": -1}},
+        {"$group": {"_id": "$symbol", "last": {"$first": "$datetime"}}},
+    ]
+    marks = {}
+    for doc in col_bar.aggregate(pipeline, allowDiskUse=True):
+        latest_dt = doc["last"]
         if isinstance(latest_dt, str):
-             # 确保能处理 MongoDB 存储的 ISODate 字符串
-             latest_dt = datetime.fromisoformat(latest_dt.replace('Z', '+00:00'))
+            # 确保能处理 MongoDB 存储的 ISODate 字符串
+            latest_dt = datetime.fromisoformat(latest_dt.replace('Z', '+00:00'))
+        if latest_dt is not None:
+            marks[doc["_id"]] = latest_dt.replace(tzinfo=None)
+    return marks
 
-        # 排除时区信息，并加一天
-        latest_dt = latest_dt.replace(tzinfo=None) + timedelta(days=1)
-        return latest_dt.strftime("%Y%m%d")
+def get_incremental_start_date(symbol: str, watermarks: dict) -> str:
+    """
+    根据水位索引返回 YYYYMMDD 格式的下一天；没有任何记录时返回全局 START_DATE。
+    """
+    latest_dt = watermarks.get(symbol)
+    if latest_dt is None:
+        return START_DATE
+    return (latest_dt + timedelta(days=1)).strftime("%Y%m%d")
 
-    # 如果没有找到任何记录，返回全局 START_DATE
-    return START_DATE
+def last_sessions(now: datetime):
+    """
+    (最近一个已收盘交易日, 它的前一个交易日)，来自 vnpy_master.trading_calendar (09)。
+    收盘 (SNAPSHOT_AFTER) 之前，今天不算已收盘。日历缺失时返回 (None, None)。
+    """
+    cutoff = now.strftime("%Y-%m-%d")
+    if now.strftime("%H:%M") < SNAPSHOT_AFTER:
+        cutoff = (now - timedelta(days=1)).strftime("%Y-%m-%d")
+    docs = list(col_calendar.find({"exchange": "SSE", "date": {"$lte": cutoff}}, {"date": 1})
+                .sort("date", -1).limit(2))
+    if len(docs) < 2:
+        return None, None
+    return tuple(datetime.strptime(d["date"], "%Y-%m-%d") for d in docs)
+
+def snapshot_is_close(session: datetime, now: datetime) -> bool:
+    """
+    全市场快照只反映 "现在" 的行情，只有它恰好是 session 的收盘时才能当作 session 的 K 线:
+    今天就是 session 且已过 SNAPSHOT_AFTER，或今天不是交易日 (快照停在上一交易日收盘)。
+    交易日盘前 / 盘中 (session 为昨天) 快照是今天的开盘前空值或盘中价，不能用。
+    """
+    today = now.strftime("%Y-%m-%d")
+    if session.date() == now.date():
+        return now.strftime("%H:%M") >= SNAPSHOT_AFTER
+    return col_calendar.count_documents({"exchange": "SSE", "date": today}, limit=1) == 0
 
 def save_bars_sina_full(symbol, exchange, df):
     # ... (此函数内容保持不变)
     if df.empty: return
-    updates = []
+    docs = []
     for _, row in df.iterrows():
         try:
             # 数据清洗与计算
@@ -104,47 +161,143 @@ def save_bars_sina_full(symbol, exchange, df):
                 "outstanding_share": outstanding,
                 "gateway_name": "AKSHARE_SINA"
             }
-            # 过滤器确保唯一性
-            filter_doc = {"symbol": symbol, "exchange": exchange, "interval": Interval.DAILY.value, "datetime": dt}
-
-            # Upsert=True: 存在则更新(补全字段)，不存在则插入
-            updates.append(UpdateOne(filter_doc, {"$set": doc}, upsert=True))
+            docs.append(doc)
         except: continue
 
-    if updates:
-        col_bar.bulk_write(updates)
-        return len(updates)
-    return 0
+    # 按 (symbol, exchange, interval, datetime) upsert: 新增插入，内容变化才更新
+    stats = BAR_WRITER.upsert(docs)
+    return stats["new"] + stats["changed"]
+
+
+def snapshot_to_docs(df, exchanges: dict, session: datetime):
+    """
+    全市场行情快照 (东财 stock_zh_a_spot_em) -> bar_daily 文档，向量化计算。
+    exchanges: {symbol: exchange value}，只转换其中的股票。
+    单位与新浪日线对齐: 成交量 手 -> 股；流通股本 = 流通市值 / 最新价 (取整到股)。
+    返回 (docs, 快照中出现的股票集合)；当日无成交 (停牌) 的股票不生成 K 线，与新浪历史接口一致。
+    """
+    snap = pd.DataFrame({
+        "symbol": df["代码"].astype(str).str.zfill(6),
+        "open_price": pd.to_numeric(df["今开"], errors="coerce"),
+        "high_price": pd.to_numeric(df["最高"], errors="coerce"),
+        "low_price": pd.to_numeric(df["最低"], errors="coerce"),
+        "close_price": pd.to_numeric(df["最新价"], errors="coerce"),
+        "volume": pd.to_numeric(df["成交量"], errors="coerce") * 100.0,
+        "turnover": pd.to_numeric(df["成交额"], errors="coerce"),
+        "circ_mv": pd.to_numeric(df["流通市值"], errors="coerce"),
+    })
+    snap = snap[snap["symbol"].isin(list(exchanges))].drop_duplicates("symbol")
+    seen = set(snap["symbol"])
+
+    snap = snap[(snap["close_price"] > 0) & (snap["volume"] > 0)].dropna(subset=["open_price", "high_price", "low_price"])
+    snap["outstanding_share"] = (snap["circ_mv"] / snap["close_price"]).round().fillna(0.0)
+    snap["turnover_rate"] = np.where(snap["outstanding_share"] > 0,
+                                     snap["volume"] / snap["outstanding_share"] * 100, 0.0)
+    snap["turnover"] = snap["turnover"].fillna(0.0)
+    snap["exchange"] = snap["symbol"].map(exchanges)
+    snap = snap.drop(columns="circ_mv").assign(interval=Interval.DAILY.value, datetime=session,
+                                               gateway_name=SNAPSHOT_GATEWAY)
+    return snap.to_dict("records"), seen
 
+def snapshot_fast_path(tasks, watermarks, session: datetime, prev_session: datetime):
+    """
+    只落后一个交易日的股票 (水位 = 前一交易日) 从全市场快照一次性补齐 session 当日 K 线。
+    返回已处理的股票集合 (含快照中停牌的股票)；快照失败时返回空集，全部回退逐只下载。
+    """
+    candidates = {symbol: exchange_value for symbol, _, exchange_value in tasks
+                  if watermarks.get(symbol) is not None and watermarks[symbol].date() == prev_session.date()}
+    if not candidates:
+        return set()
+    try:
+        with PROF.stage("snapshot_download"):
+            df = ak.stock_zh_a_spot_em()
+    except Exception as e:
+        print(f"⚠️ 全市场快照下载失败 ({e.__class__.__name__})，回退逐只下载。")
+        return set()
+
+    with PROF.stage("snapshot_save"):
+        docs, seen = snapshot_to_docs(df, candidates, session)
+        stats = BAR_WRITER.upsert(docs)
+        PROF.add_rows(len(docs))
+    print(f"⚡ 快照补齐 {session:%Y-%m-%d}: {len(docs)} 根 K 线 (停牌 {len(seen) - len(docs)}) | "
+          f"新增 {stats['new']} / 变更 {stats['changed']} | 未覆盖 {len(candidates) - len(seen)} 只回退逐只下载")
+    return seen
+
+def repair_gaps(tasks):
+    """
+    领取 repair_worklist 中 bar_daily 的缺失区间 (25 审计产出)，每只股票按缺口跨度 [最早起点, 最晚终点] 请求一次。
+    跨度内已有的 K 线由 BAR_WRITER 摘要比对跳过；数据源确实没有的缺口领取 MAX_ATTEMPTS 次后不再请求。
+    """
+    exchanges = {symbol: exchange_value for symbol, _, exchange_value in tasks}
+    gaps = completeness.claim(col_bar.database, "bar_daily", symbols=list(exchanges), limit=REPAIR_MAX_RUNS)
+    if gaps.empty:
+        return 0
+    spans = gaps.groupby("symbol").agg(start=("start", "min"), end=("end", "max"), days=("days", "sum"))
+    print(f"🩹 缺口补数: {len(spans)} 只股票 / {len(gaps)} 段 / {int(spans['days'].sum())} 个交易日")
+
+    total = 0
+    pbar = tqdm(spans.itertuples(), total=len(spans), unit="stock")
+    for row in pbar:
+        symbol = row.Index
+        pbar.set_description(f"Repairing {symbol} ({row.start:%Y%m%d}~{row.end:%Y%m%d})")
+        try:
+            with PROF.stage("repair"):
+                df = ak.stock_zh_a_daily(
+                    symbol=get_sina_symbol(symbol, exchanges[symbol]),
+                    start_date=row.start.strftime("%Y%m%d"),
+                    end_date=row.end.strftime("%Y%m%d"),
+                    adjust=ADJUST
+                )
+                total += save_bars_sina_full(symbol, exchanges[symbol], df) or 0
+        except requests.exceptions.ConnectionError:
+            pbar.write(f"\n🛑 网络中断 {symbol}，缺口留待下次。")
+            time.sleep(5)
+        except Exception as e:
+            pbar.write(f"❌ 缺口补数失败 {symbol}: {e}")
+        time.sleep(0.05)
+    return total
 
 def get_sina_symbol(symbol, exchange_value):
-    """根据交易所推断新浪查询前缀"""
-    # 注意：这里接收的是 exchange.value (如 'SZSE')
-    if exchange_value == Exchange.SSE.value: return f"sh{symbol}"
-    if exchange_value == Exchange.SZSE.value: return f"sz{symbol}"
-    if exchange_value == Exchange.BSE.value: return f"bj{symbol}" # 北交所修正为 bj 前缀
-    return f"sz{symbol}"
+    """根据交易所 (exchange.value，如 'SZSE') 生成新浪查询代码；交易所缺失时按号段推断"""
+    return symbol_master.to_sina([symbol], [exchange_value])[0]
 
 def run():
     print("🚀 启动 [全市场日线] 增量下载任务 (V3.0)...")
 
     # 1. 获取本地股票列表
-    tasks = get_local_stock_list()
+    with PROF.stage("load_tasks"):
+        tasks = get_local_stock_list()
     if not tasks: return
 
     print(f"📊 待处理任务: {len(tasks)} 只")
 
-    pbar = tqdm(tasks, unit="stock")
+    # 2. 水位索引 + 最近已收盘交易日
+    with PROF.stage("watermark"):
+        watermarks = load_watermarks()
+        now = datetime.now()
+        session, prev_session = last_sessions(now)
+    # 日历缺失时沿用旧逻辑: 只下载到昨天，避免盘中的不完整 K 线
+    end_ymd = session.strftime("%Y%m%d") if session else (now - timedelta(days=1)).strftime("%Y%m%d")
+
+    # 3. 快速路径: 只差一个交易日的股票从全市场快照一次补齐 (几次分页请求代替几千次逐只请求)
+    done = set()
+    if SNAPSHOT_FAST_PATH and session is not None:
+        if snapshot_is_close(session, now):
+            done = snapshot_fast_path(tasks, watermarks, session, prev_session)
+        else:
+            print(f"⏭️ 当前快照不是 {session:%Y-%m-%d} 的收盘行情 (交易日盘前 / 盘中)，全部逐只下载。")
+
+    # 4. 其余 (新股、断档、快照未覆盖) 逐只下载历史
+    pending = [t for t in tasks
+               if t[0] not in done and get_incremental_start_date(t[0], watermarks) <= end_ymd]
+    print(f"📊 逐只下载: {len(pending)} 只")
+
+    pbar = tqdm(pending, unit="stock")
     total_new_bars = 0
-    today_ymd = datetime.now().strftime("%Y%m%d")
 
     for symbol, name, exchange_value in pbar:
         # 1. 确定下载的起始日期 (增量逻辑核心)
-        adjusted_start_date = get_incremental_start_date(symbol)
-
-        # 如果最新日期已经到今天，跳过
-        if adjusted_start_date == today_ymd:
-             continue
+        adjusted_start_date = get_incremental_start_date(symbol, watermarks)
 
         pbar.set_description(f"Processing {name} (Start: {adjusted_start_date})")
 
@@ -153,15 +306,18 @@ def run():
 
         try:
             # 3. 下载数据
-            df = ak.stock_zh_a_daily(
-                symbol=sina_symbol,
-                start_date=adjusted_start_date, # 使用增量起始日期
-                end_date=today_ymd,
-                adjust=ADJUST
-            )
+            with PROF.stage("download"):
+                df = ak.stock_zh_a_daily(
+                    symbol=sina_symbol,
+                    start_date=adjusted_start_date, # 使用增量起始日期
+                    end_date=end_ymd,
+                    adjust=ADJUST
+                )
 
             # 4. 入库
-            new_bars = save_bars_sina_full(symbol, exchange_value, df)
+            with PROF.stage("save"):
+                new_bars = save_bars_sina_full(symbol, exchange_value, df) or 0
+                PROF.add_rows(new_bars)
             total_new_bars += new_bars
 
         except requests.exceptions.ConnectionError:
@@ -174,7 +330,13 @@ def run():
         # 适当休眠
         time.sleep(0.05)
 
+    # 5. 历史缺口 (25 审计的工作清单)
+    if REPAIR_GAPS:
+        total_new_bars += repair_gaps(tasks)
+
     print(f"\n✨ 增量下载完成！共新增/更新 {total_new_bars} 条 K 线数据。")
+    print(f"📝 {BAR_WRITER.summary()}")
 
 if __name__ == "__main__":
-    run()
\ No newline at end of file
+    with PROF:
+        run()
\ No newline at end of file
@@ -1,34 +1,54 @@
 """
-脚本 03 (V2.0): 复权因子下载器 (增量修复版) 需要每天运行
+脚本 03 (V3.0): 复权因子 (本地公司行为引擎 + 抽样对账) 需要每天运行
 ===========================================
-目标: 每日增量更新所有股票的前复权因子（qfq-factor）。
-策略:
-  1. 优先从本地 stock_info 读取列表。
-  2. 查询 adjust_factor 表中的最新日期。
-  3. 从最新日期安全回溯两年（避免遗漏因子变动），并增量下载到今天。
+目标: 每日更新所有股票的前复权因子（qfq-factor）。
+策略 (LOCAL_ENGINE=True):
+  1. 因子由本地计算 (utils/corporate_actions): 17 入库的除权除息事件 (每股派现 / 送转) + 除权前收盘价，
+     向量化推导 qfq / hfq 阶梯因子，不再逐只回溯两年下载。
+  2. 只重算需要的股票: finance_dividend 有变更 (utils/change_tracker 水位)、除权日刚刚生效、
+     adjust_factor 中还没有记录 (新股)，或 25 审计出覆盖缺口 (utils/completeness 工作清单)。新的除权事件会改写整段历史的前复权因子，因此按股票整体替换。
+  3. 对账: 每次抽样 RECONCILE_SAMPLE 只 (优先本次重算的) 下载新浪因子比对；误差超过 RECONCILE_TOL
+     (如配股、数据源缺失) 的股票改用下载因子，并记入 adjust_factor_state，之后每次走网络，直到对账再次一致。
+  4. 写入前与库中内容摘要比对 (utils/hashed_upsert)，未变的因子不再重写。
+LOCAL_ENGINE=False 时回到 V2.0 行为: 逐只下载，从最新日期回溯两年。
 -------------------------------------------
 """
 import time
 import random
 from datetime import datetime, timedelta # ✅ 新增导入 timedelta
 from tqdm import tqdm
-from pymongo import UpdateOne, MongoClient
-from vnpy.trader.constant import Exchange
 import akshare as ak
 import pandas as pd
 import requests
 import re
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+from utils.mongo_client import get_client
+from utils.hashed_upsert import HashedUpsert
+from utils.change_tracker import ChangeTracker
+from utils import completeness, corporate_actions, symbol_master
 
 
 # --- 配置 ---
 ADJUST = "qfq-factor" # 核心参数：请求前复权乘数因子
 START_DATE = "19900101" # 首次下载的起始日期
+LOCAL_ENGINE = True # 本地计算因子；False 时逐只下载 (V2.0)
+FORCE_LOCAL = False # True: 全部股票本地重算 (首次切换到本地引擎时使用)
+RECENT_DAYS = 10 # 除权日落在最近 N 天的股票重算 (公告入库时除权日尚未到来)
+RECONCILE_SAMPLE = 30 # 每次抽样对账的股票数
+RECONCILE_TOL = 5e-3 # 归一后因子的最大相对误差
+COMPUTE_BATCH = 300 # 每批读取日线计算的股票数
 
 # --- 数据库连接 ---
-CLIENT = MongoClient("localhost", 27017)
+CLIENT = get_client()
 db = CLIENT["vnpy_stock"]
 col_adj = db["adjust_factor"] # 目标集合
 col_info = db["stock_info"] # 基础信息集合
+col_state = db["adjust_factor_state"] # 对账结果: {symbol, mode: local/remote, max_err, checked_at}
+# 变更检测写入: 回溯区间内未变化的因子不再重复 upsert；变化的打 updated_at，原地替换也能被下游 (run_pipeline 指纹) 感知
+FACTOR_WRITER = HashedUpsert(col_adj, keys=("symbol", "date"), stamp="updated_at")
 
 def get_symbols():
     """从本地数据库读取所有股票代码 (仅限 A股/北交所)"""
@@ -41,11 +61,8 @@ def get_symbols():
     return [(doc['symbol'], doc.get('exchange')) for doc in cursor]
 
 def get_sina_symbol(symbol, exchange_value):
-    """根据交易所推断新浪查询前缀"""
-    if exchange_value == Exchange.SSE.value: return f"sh{symbol}"
-    if exchange_value == Exchange.SZSE.value: return f"sz{symbol}"
-    if exchange_value == Exchange.BSE.value: return f"bj{symbol}" # 北交所修正为 bj 前缀
-    return f"sz{symbol}"
+    """根据交易所 (exchange.value，如 'SZSE') 生成新浪查询代码；交易所缺失时按号段推断"""
+    return symbol_master.to_sina([symbol], [exchange_value])[0]
 
 def get_incremental_start_date_factor(symbol: str) -> datetime:
     """
@@ -67,50 +84,52 @@ def get_incremental_start_date_factor(symbol: str) -> datetime:
     return datetime.strptime(START_DATE, "%Y%m%d")
 
 
-def download_and_save_factor(symbol, exchange_value, pbar, start_date_factor):
-    """核心下载与写入逻辑 (使用增量日期)"""
+def fetch_factor_docs(symbol, exchange_value, start_date_factor=START_DATE):
+    """下载新浪 qfq-factor，返回 adjust_factor 文档列表 (接口返回空时为空列表；网络错误向上抛出)"""
     sina_symbol = get_sina_symbol(symbol, exchange_value)
+    # 核心调用: 获取因子数据 (使用传入的 start_date_factor)
+    df = ak.stock_zh_a_daily(
+        symbol=sina_symbol,
+        start_date=start_date_factor, # <-- 使用增量起始日期
+        end_date=datetime.now().strftime("%Y%m%d"),
+        adjust=ADJUST
+    )
+
+    if df.empty or 'qfq_factor' not in df.columns:
+        return []
+
+    docs = []
+    for _, row in df.iterrows():
+        try:
+            # 🚨 日期解析: 兼容 datetime.date 对象和 ISODate 字符串
+            if isinstance(row['date'], datetime):
+                dt = row['date'].replace(tzinfo=None) # 去除时区信息
+            elif isinstance(row['date'], pd.Timestamp):
+                dt = row['date'].to_pydatetime().replace(tzinfo=None)
+            else:
+                # 假定为 YYYY-MM-DD 格式的字符串
+                dt_str_clean = str(row['date']).split()[0]
+                dt = datetime.strptime(dt_str_clean, "%Y-%m-%d")
+
+            # 构造文档 (按 symbol + date upsert 保证不重复)
+            docs.append({"symbol": symbol, "date": dt, "factor": float(row['qfq_factor']), "source": "SINA_FACTOR"})
+        except Exception:
+            continue
+    return docs
 
-    try:
-        # 核心调用: 获取因子数据 (使用传入的 start_date_factor)
-        df = ak.stock_zh_a_daily(
-            symbol=sina_symbol,
-            start_date=start_date_factor, # <-- 使用增量起始日期
-            end_date=datetime.now().strftime("%Y%m%d"),
-            adjust=ADJUST
-        )
 
-        if df.empty or 'qfq_factor' not in df.columns:
+def download_and_save_factor(symbol, exchange_value, pbar, start_date_factor):
+    """核心下载与写入逻辑 (使用增量日期)"""
+    try:
+        docs = fetch_factor_docs(symbol, exchange_value, start_date_factor)
+        if not docs:
             pbar.write(f"⚠️ {symbol}: 接口返回空或缺少 qfq_factor 字段。")
             return 0
 
-        updates = []
-        for _, row in df.iterrows():
-            try:
-                # 🚨 日期解析: 兼容 datetime.date 对象和 ISODate 字符串
-                if isinstance(row['date'], datetime):
-                    dt = row['date'].replace(tzinfo=None) # 去除时区信息
-                elif isinstance(row['date'], pd.Timestamp):
-                    dt = row['date'].to_pydatetime().replace(tzinfo=None)
-                else:
-                    # 假定为 YYYY-MM-DD 格式的字符串
-                    dt_str_clean = str(row['date']).split()[0]
-                    dt = datetime.strptime(dt_str_clean, "%Y-%m-%d")
-
-                # 构造文档 (Upsert 保证不重复)
-                updates.append(UpdateOne(
-                    {"symbol": symbol, "date": dt},
-                    {"$set": {"factor": float(row['qfq_factor']), "source": "SINA_FACTOR"}},
-                    upsert=True
-                ))
-            except Exception:
-                continue
-
-        if updates:
-            result = col_adj.bulk_write(updates)
-            pbar.write(f"✅ {symbol}: 成功写入/更新 {result.upserted_count + result.modified_count} 条因子记录。")
-            return len(updates)
-        return 0
+        # 回溯两年的重叠区间绝大多数没有变化，只写入新增 / 变化的因子
+        stats = FACTOR_WRITER.upsert(docs)
+        pbar.write(f"✅ {symbol}: 写入/更新 {stats['new'] + stats['changed']} 条因子记录 (未变跳过 {stats['unchanged']})。")
+        return len(docs)
 
     except requests.exceptions.ConnectionError:
         pbar.write(f"❌ {symbol}: 网络连接错误，等待重试。")
@@ -154,6 +173,132 @@ def run_factor_download():
         time.sleep(random.uniform(0.1, 0.3))
 
     print("\n✨ 复权因子下载完成！")
+    print(f"📝 {FACTOR_WRITER.summary()}")
+
+# ---------------------------------------------------------------
+# 本地公司行为引擎 (V3.0)
+# ---------------------------------------------------------------
+def replace_factors(symbol, docs):
+    """
+    整只股票替换因子: 写入 docs，并删除 docs 中没有的旧日期 (口径切换 / 新除权事件改写整段历史)。
+    FACTOR_WRITER 是 $set 语义: 由本地切到下载 (新浪只有 qfq) 时，同日期上旧的 hfq_factor 要显式删掉，
+    否则会留下 新浪 qfq + 过期本地 hfq 的混合文档。
+    """
+    stats = FACTOR_WRITER.upsert(docs)
+    stale = col_adj.delete_many({"symbol": symbol, "date": {"$nin": [d["date"] for d in docs]}}).deleted_count
+    if docs and "hfq_factor" not in docs[0]:
+        col_adj.update_many({"symbol": symbol, "hfq_factor": {"$exists": True}}, {"$unset": {"hfq_factor": ""}})
+    return stats, stale
+
+
+def local_docs(table):
+    """factor_table -> {symbol: [adjust_factor 文档]}"""
+    out = {}
+    for sym, g in table.groupby("symbol", sort=False):
+        out[sym] = [{"symbol": sym, "date": d.to_pydatetime(), "factor": float(q), "hfq_factor": float(h),
+                     "source": "LOCAL_CA"}
+                    for d, q, h in zip(g["date"], g["qfq_factor"], g["hfq_factor"])]
+    return out
+
+
+def plan_symbols(tracker, tasks):
+    """需要本地重算的股票 与 需要对账的股票"""
+    universe = {s for s, _ in tasks}
+    remote = set(col_state.distinct("symbol", {"mode": "remote"})) & universe
+    if FORCE_LOCAL:
+        recompute = set(universe)
+    else:
+        dirty = set(tracker.dirty_starts({corporate_actions.COL_DIVIDEND: "ex_date"}))
+        now = datetime.now()
+        recent = set(db[corporate_actions.COL_DIVIDEND].distinct(
+            "symbol", {"ex_date": {"$gte": now - timedelta(days=RECENT_DAYS), "$lte": now}}))
+        missing = universe - set(col_adj.distinct("symbol"))
+        # 25 审计出的因子覆盖缺口 (有日线但因子起点晚于首根 K 线)
+        gaps = set(completeness.claim(db, "adjust_factor", symbols=universe)["symbol"])
+        print(f"📋 事件变更 {len(dirty)} | 近期除权 {len(recent)} | 无因子 {len(missing)} | 覆盖缺口 {len(gaps)} | "
+              f"走网络 {len(remote)}")
+        recompute = (dirty | recent | missing | gaps) & universe
+
+    # 抽样: 优先本次重算的股票，不足时从全体补齐
+    pool = sorted(recompute - remote)
+    sample = set(random.sample(pool, min(RECONCILE_SAMPLE, len(pool))))
+    rest = sorted(universe - remote - sample)
+    sample |= set(random.sample(rest, min(RECONCILE_SAMPLE - len(sample), len(rest))))
+    return recompute - remote, sample | remote
+
+
+def reconcile(symbols, exchanges, local):
+    """下载 symbols 的新浪因子与本地结果比对，返回 ({symbol: 下载的文档} (不一致者), 一致的股票集合, 失败数)"""
+    mismatched, agreed, failed = {}, set(), 0
+    pbar = tqdm(sorted(symbols), unit="stock", desc="对账")
+    for symbol in pbar:
+        try:
+            remote = fetch_factor_docs(symbol, exchanges.get(symbol))
+        except Exception as e:
+            pbar.write(f"❌ {symbol}: 对账下载失败 ({e.__class__.__name__})，沿用本地结果。")
+            failed += 1
+            continue
+        if not remote:
+            continue
+        mine = local.get(symbol, [])
+        err = corporate_actions.compare(pd.DataFrame(mine, columns=["date", "factor"]),
+                                        pd.DataFrame(remote, columns=["date", "factor"]))
+        ok = not pd.isna(err) and err <= RECONCILE_TOL
+        col_state.update_one(
+            {"symbol": symbol},
+            {"$set": {"mode": "local" if ok else "remote", "max_err": None if pd.isna(err) else err,
+                      "checked_at": datetime.now()}},
+            upsert=True,
+        )
+        if ok:
+            agreed.add(symbol)
+        else:
+            mismatched[symbol] = remote
+            pbar.write(f"⚠️ {symbol}: 本地因子与新浪不一致 (max_err={err:.4g})，改用下载因子。")
+        time.sleep(random.uniform(0.1, 0.3))
+    return mismatched, agreed, failed
+
+
+def run_local_engine():
+    print("🚀 启动 [复权因子] 本地公司行为引擎 (V3.0)...")
+    tasks = get_symbols()
+    exchanges = dict(tasks)
+    tracker = ChangeTracker(db, "adjust_factor")
+    col_state.create_index("symbol", unique=True)
+
+    recompute, check = plan_symbols(tracker, tasks)
+    print(f"✅ 共有 {len(tasks)} 只股票: 本地重算 {len(recompute)}，对账 {len(check)}。")
+
+    # 1. 本地计算 (分批读取日线，批内全部向量化)
+    local = {}
+    targets = sorted(recompute | check)
+    for i in tqdm(range(0, len(targets), COMPUTE_BATCH), unit="batch", desc="本地计算"):
+        table, _ = corporate_actions.compute(db, targets[i:i + COMPUTE_BATCH])
+        local.update(local_docs(table))
+
+    # 2. 抽样对账，不一致的用下载因子
+    mismatched, agreed, failed = reconcile(check, exchanges, local)
+
+    # 3. 写入: 对账不一致 -> 下载因子；需要重算 / 对账恢复一致 -> 本地因子
+    n_local = n_remote = n_stale = 0
+    for symbol in targets:
+        if symbol in mismatched:
+            docs, n_remote = mismatched[symbol], n_remote + 1
+        elif symbol in recompute or symbol in agreed:
+            docs, n_local = local.get(symbol), n_local + 1
+        else:
+            continue
+        if docs:
+            _, stale = replace_factors(symbol, docs)
+            n_stale += stale
+
+    tracker.commit()
+    print(f"\n✨ 复权因子更新完成！本地 {n_local} 只 | 下载 {n_remote} 只 | 对账失败 {failed} 只 | 删除旧日期 {n_stale} 条")
+    print(f"📝 {FACTOR_WRITER.summary()}")
+
 
 if __name__ == "__main__":
-    run_factor_download()
\ No newline at end of file
+    if LOCAL_ENGINE:
+        run_local_engine()
+    else:
+        run_factor_download()
\ No newline at end of file
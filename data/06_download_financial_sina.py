@@ -6,6 +6,8 @@
 1. [智能避险]: 遇到 JSONDecodeError (被封) 自动触发指数级退避 (Sleep 10s -> 30s -> 60s...)。
 2. [顽强重试]: 单个接口失败会自动重试最多 5 次，确保数据完整。
 3. [PIT/分表]: 保持 v3.0 的 PIT 架构和分表存储逻辑。
+4. [规范化]: 每只股票入库后同步 finance_std 列式快照 (utils/financial_schema.py)。
+5. [变更检测]: 只写入新增 / 更正的报告期并打 updated_at (utils/hashed_upsert.py)。
 """
 import os
 import time
@@ -16,10 +18,15 @@ import requests
 import json
 from datetime import datetime
 from tqdm import tqdm
-from pymongo import UpdateOne, MongoClient
+import sys
 from vnpy.trader.constant import Exchange
 import akshare as ak
 
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+from utils.mongo_client import get_client
+from utils import financial_schema
+from utils.hashed_upsert import HashedUpsert
+
 # --- 🛡️ 直连补丁 ---
 os.environ['http_proxy'] = ''
 os.environ['https_proxy'] = ''
@@ -32,7 +39,7 @@ MAX_RETRIES = 5         # 最大重试次数
 BASE_WAIT = 60          # 基础等待时间 (秒)
 
 # 数据库连接
-CLIENT = MongoClient("localhost", 27017)
+CLIENT = get_client()
 DB = CLIENT["vnpy_stock"]
 COL_INFO = DB["stock_info"]
 
@@ -42,6 +49,8 @@ COL_MAP = {
     "利润表": DB["finance_income"],
     "现金流量表": DB["finance_cashflow"]
 }
+# 变更检测写入: 未变化的报告期跳过，变化的打 updated_at (估值 08 的增量重算依据)
+WRITERS = {name: HashedUpsert(col, keys=("symbol", "report_date"), stamp="updated_at") for name, col in COL_MAP.items()}
 
 # 关键字段检查清单
 CHECK_FIELDS = {
@@ -132,7 +141,7 @@ def download_one_stock(symbol, exchange_str, stock_name):
         try:
             # 预处理
             df = df.where(pd.notnull(df), None)
-            updates = []
+            docs = []
             for _, row in df.iterrows():
                 r_date = clean_date(row.get('报告日'))
                 if not r_date: continue
@@ -147,11 +156,11 @@ def download_one_stock(symbol, exchange_str, stock_name):
                 })
                 doc.pop('报告日', None); doc.pop('公告日期', None)
 
-                filter_doc = {"symbol": symbol, "report_date": r_date}
-                updates.append(UpdateOne(filter_doc, {"$set": doc}, upsert=True))
+                docs.append(doc)
 
-            if updates:
-                col_obj.bulk_write(updates)
+            if docs:
+                # 按 (symbol, report_date) upsert；只有内容变化的报告期才写入并刷新 updated_at (08 据此重算)
+                WRITERS[sheet_name].upsert(docs)
                 success_count += 1
 
         except Exception as e:
@@ -160,6 +169,13 @@ def download_one_stock(symbol, exchange_str, stock_name):
         # 表间微小延时
         time.sleep(random.uniform(1, 2))
 
+    # 同步规范化快照 (finance_std)，下游不必等 21
+    if success_count:
+        try:
+            financial_schema.sync(DB, [symbol])
+        except Exception as e:
+            print(f"   ⚠️ 规范化快照同步失败 (21 会补齐): {e}")
+
     return success_count
 
 def run():
@@ -5,6 +5,7 @@
 1. [Download] 从 AKShare 下载最新的股本变动记录 (来源: 巨潮资讯).
 2. [Fuse] 自动去 bar_daily (日线表) 查找对应的 A股流通股本 (outstanding_share).
 3. [Clean] 将查到的准确流通股本回写到 share_capital 表的 float_shares_a 字段.
+4. [Change] 下载记录与库中内容摘要比对，只写入变化的记录 (时间戳字段 update_at -> updated_at).
 
 前置条件: 建议先运行 脚本 02 (下载日线)，以保证有最新的行情数据可供缝合。
 """
@@ -13,19 +14,25 @@ import akshare as ak
 import pandas as pd
 from datetime import datetime, timedelta
 from tqdm import tqdm
-from pymongo import MongoClient, UpdateOne, ASCENDING, DESCENDING
+from pymongo import UpdateOne, ASCENDING, DESCENDING
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+from utils.mongo_client import get_client
+from utils.hashed_upsert import HashedUpsert
 
 # --- 配置 ---
-MONGO_HOST = "localhost"
-MONGO_PORT = 27017
 DB_NAME = "vnpy_stock"
 
 # 连接数据库
-CLIENT = MongoClient(MONGO_HOST, MONGO_PORT)
+CLIENT = get_client()
 DB = CLIENT[DB_NAME]
 COL_CAPITAL = DB["share_capital"]
 COL_BARS = DB["bar_daily"]
 COL_INFO = DB["stock_info"]
+# 变更检测写入: 历史变动记录每次全量返回，只写入新增 / 变化的记录并打 updated_at (估值 08 的增量重算依据)
+CAPITAL_WRITER = HashedUpsert(COL_CAPITAL, keys=("symbol", "date"), stamp="updated_at")
 
 def normalize_date(date_obj):
     """通用日期清洗工具"""
@@ -54,7 +61,7 @@ def download_capital_cninfo(symbol):
         df = ak.stock_share_changes_cninfo(symbol=symbol)
         if df.empty: return 0
 
-        updates = []
+        docs = []
         for _, row in df.iterrows():
             date_str = str(row['date'])
             date_obj = normalize_date(date_str)
@@ -72,16 +79,13 @@ def download_capital_cninfo(symbol):
                 "total_shares": total_shares,
                 "float_shares": float_shares_global, # 存下来作为参考，但不用于核心计算
                 "change_reason": reason,
-                "update_at": datetime.now()
             }
+            docs.append(doc)
 
-            # Upsert: 按照 symbol + date 唯一索引更新
-            filter_doc = {"symbol": symbol, "date": date_obj}
-            updates.append(UpdateOne(filter_doc, {"$set": doc}, upsert=True))
-
-        if updates:
-            res = COL_CAPITAL.bulk_write(updates, ordered=False)
-            return res.upserted_count + res.modified_count
+        if docs:
+            # Upsert: 按照 symbol + date 唯一索引更新；内容未变的记录跳过，变化的打 updated_at
+            stats = CAPITAL_WRITER.upsert(docs)
+            return stats["new"] + stats["changed"]
         return 0
 
     except Exception as e:
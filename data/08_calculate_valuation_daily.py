@@ -6,23 +6,39 @@
    - 流通市值 (Circ MV) = 收盘价 * 日线.outstanding_share (精确A股流通)
    - 总市值 (Total MV) = 收盘价 * 股本表.total_shares (用于PE/PB)
 2. [健壮性] 增加对缺失股本的处理，避免程序崩溃。
+3. [变更检测] 写入前比对内容摘要 (utils/hashed_upsert)，FORCE_UPDATE 全量重算时未变的估值行不再重写。
+4. [依赖增量] 股本 / 分红 / 财报 新增或更正后 (updated_at 水位，utils/change_tracker)，
+   只把受影响股票从最早受影响日期起重算，不必 FORCE_UPDATE 全市场。
+   上游旧文档首次补摘要时内容未变的不打 updated_at (utils/hashed_upsert)，部署后首跑不会被当成全市场变更。
+5. [缺口补算] 25 审计出的估值缺失区间 (utils/completeness 工作清单) 并入回溯起点，只补缺的那段。
 """
+import os
+import sys
 import pandas as pd
 from datetime import datetime, date, timedelta
 from tqdm import tqdm
-from pymongo import MongoClient, UpdateOne, ASCENDING, DESCENDING
+from pymongo import ASCENDING, DESCENDING
 import numpy as np
 
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+from utils.stage_profiler import StageProfiler
+from utils import sector_map, financial_schema, completeness
+from utils.mongo_loader import load_frame
+from utils.trailing_events import trailing_sum
+from utils.hashed_upsert import HashedUpsert
+from utils.change_tracker import ChangeTracker
+from utils.mongo_client import get_client
+
+PROF = StageProfiler(__file__)
+
 # ================= 配置区域 =================
 DEBUG_MODE = False  # 生产环境请设为 False
 DEBUG_SYMBOLS = ["601336"]
 FORCE_UPDATE = False # 设为 True 可重算所有历史数据
 # ===========================================
 
-MONGO_HOST = "localhost"
-MONGO_PORT = 27017
 DB_NAME = "vnpy_stock"
-CLIENT = MongoClient(MONGO_HOST, MONGO_PORT)
+CLIENT = get_client()
 DB = CLIENT[DB_NAME]
 
 COL_INFO = DB["stock_info"]
@@ -33,11 +49,23 @@ COL_BALANCE = DB["finance_balance"]
 COL_DIVIDEND = DB["finance_dividend"]
 COL_VALUATION = DB["valuation_daily"]
 COL_INDUSTRY = DB["industry_history"]
+COL_FIN_STD = DB[financial_schema.COL_STD]
+
+# 估值用到的规范财报字段 (utils/financial_schema.CANONICAL)
+FIN_FIELDS = ["net_profit", "revenue", "equity", "other_equity"]
+
+# 分红 TTM 窗口: 简单粗暴延长到 13 个月 (395 天)，容忍派息日推迟一个月
+# 这能解决 90% 的"比东财少"的问题
+DIVIDEND_WINDOW_DAYS = 395
 
-NET_PROFIT_FIELDS = ["归属于母公司所有者的净利润", "归属于母公司股东的净利润", "归属于母公司的净利润", "净利润"]
-REVENUE_FIELDS = ["营业总收入", "营业收入"]
-EQUITY_FIELDS = ["归属于母公司股东权益合计", "归属于母公司股东的权益", "归属于上市公司股东的权益", "所有者权益合计", "股东权益合计"]
-OTHER_EQUITY_FIELD = "其他权益工具"
+# 上游变更 -> 估值重算起点 (utils/change_tracker): {集合: 决定影响起点的日期字段}
+# 财报按 report_date 而非 publish_date: 原地更正会覆盖旧的公告日，从报告期起重算才能覆盖旧版本可见的区间
+DIRTY_SOURCES = {
+    "share_capital": "date",
+    "finance_dividend": "ex_date",
+    "finance_income": "report_date",
+    "finance_balance": "report_date",
+}
 
 def get_last_update_date(symbol: str):
     if FORCE_UPDATE: return None
@@ -45,60 +73,29 @@ def get_last_update_date(symbol: str):
     return last_record["date"] if last_record else None
 
 def get_clean_financial_data(symbol: str) -> pd.DataFrame:
-    """提取并清洗财务数据 (保持不变)"""
-    proj_bal = {"report_date": 1, "publish_date": 1, OTHER_EQUITY_FIELD: 1}
-    for f in EQUITY_FIELDS: proj_bal[f] = 1
-    proj_inc = {"report_date": 1, "publish_date": 1}
-    for f in NET_PROFIT_FIELDS + REVENUE_FIELDS: proj_inc[f] = 1
-
-    cursor_bal = COL_BALANCE.find({"symbol": symbol}, proj_bal).sort("report_date", ASCENDING)
-    df_bal = pd.DataFrame(list(cursor_bal))
-    cursor_inc = COL_INCOME.find({"symbol": symbol}, proj_inc).sort("report_date", ASCENDING)
-    df_inc = pd.DataFrame(list(cursor_inc))
-
-    if df_bal.empty and df_inc.empty: return pd.DataFrame()
-
-    if not df_bal.empty:
-        df_bal[OTHER_EQUITY_FIELD] = pd.to_numeric(df_bal.get(OTHER_EQUITY_FIELD), errors='coerce').fillna(0)
-        df_bal['total_equity'] = np.nan
-        for col in EQUITY_FIELDS:
-            if col in df_bal.columns:
-                df_bal['total_equity'] = df_bal['total_equity'].fillna(pd.to_numeric(df_bal[col], errors='coerce'))
-        df_bal['equity_adjusted'] = df_bal['total_equity'] - df_bal[OTHER_EQUITY_FIELD]
-        df_bal = df_bal.rename(columns={'publish_date': 'publish_date_bal'})
-        df_bal = df_bal[['report_date', 'publish_date_bal', 'equity_adjusted']].copy()
-
-    if not df_inc.empty:
-        df_inc['net_profit'] = np.nan
-        for col in NET_PROFIT_FIELDS:
-            if col in df_inc.columns:
-                df_inc['net_profit'] = df_inc['net_profit'].fillna(pd.to_numeric(df_inc[col], errors='coerce'))
-        df_inc['revenue'] = np.nan
-        for col in REVENUE_FIELDS:
-            if col in df_inc.columns:
-                df_inc['revenue'] = df_inc['revenue'].fillna(pd.to_numeric(df_inc[col], errors='coerce'))
-        df_inc = df_inc.rename(columns={'publish_date': 'publish_date_inc'})
-        df_inc = df_inc[['report_date', 'publish_date_inc', 'net_profit', 'revenue']].copy()
-
-    if df_bal.empty: df = df_inc
-    elif df_inc.empty: df = df_bal
+    """读取规范化财报快照 (finance_std，已是 float64)；快照缺失时从原始利润表 / 资产负债表现场规范化"""
+    doc = COL_FIN_STD.find_one({"symbol": symbol}, {"_id": 0, "report_date": 1, "publish_date": 1,
+                                                     **{f: 1 for f in FIN_FIELDS}})
+    if doc:
+        df = financial_schema.doc_to_frame(doc, FIN_FIELDS)
     else:
-        df = pd.merge(df_inc, df_bal, on='report_date', how='outer')
+        raw = {"income": COL_INCOME, "balance": COL_BALANCE}
+        df = financial_schema.normalize(raw, [symbol])[["report_date", "publish_date", *FIN_FIELDS]]
+    # 只有现金流量表的报告期对估值没有贡献
+    df = df.dropna(subset=["net_profit", "revenue", "equity"], how="all")
+    if df.empty: return pd.DataFrame()
 
-    df['report_date'] = pd.to_datetime(df['report_date'])
-    df['publish_date'] = df['publish_date_inc'].fillna(df['publish_date_bal'])
-    df['publish_date'] = pd.to_datetime(df['publish_date'])
+    df['equity_adjusted'] = df['equity'] - df['other_equity'].fillna(0)
     df = df.dropna(subset=['report_date', 'publish_date'])
     df = df.sort_values('publish_date').drop_duplicates('report_date', keep='last').sort_values('report_date')
-    return df
+    return df[['report_date', 'publish_date', 'net_profit', 'revenue', 'equity_adjusted']]
 
 def get_dividend_data(symbol: str) -> pd.DataFrame:
     """提取分红数据 (保持不变)"""
-    cursor = COL_DIVIDEND.find({"symbol": symbol}, {"ex_date": 1, "cash_dividend_per_share": 1, "_id": 0}).sort("ex_date", ASCENDING)
-    df = pd.DataFrame(list(cursor))
+    df = load_frame(COL_DIVIDEND, {"symbol": symbol}, {"ex_date": "datetime", "cash_dividend_per_share": "float"},
+                    sort=[("ex_date", ASCENDING)])
     if df.empty: return pd.DataFrame()
-    df['ex_date'] = pd.to_datetime(df['ex_date'])
-    df['cash_dividend_per_share'] = pd.to_numeric(df['cash_dividend_per_share'], errors='coerce').fillna(0.0)
+    df['cash_dividend_per_share'] = df['cash_dividend_per_share'].fillna(0.0)
     return df.set_index('ex_date')
 
 def calculate_financial_time_series(df_fin: pd.DataFrame) -> pd.DataFrame:
@@ -130,45 +127,44 @@ def calculate_financial_time_series(df_fin: pd.DataFrame) -> pd.DataFrame:
     df_pub['report_date_audit'] = df_pub['report_date']
     return df_pub.set_index('publish_date')
 
-def calculate_dividend_full_series(df_div: pd.DataFrame) -> pd.DataFrame:
-    """计算分红 (保持不变)"""
-    if df_div.empty: return pd.DataFrame()
-    start = df_div.index.min()
-    end = datetime.now()
-    idx = pd.date_range(start, end)
-    df_daily = df_div.reindex(idx).fillna(0.0)
-    # [MODIFIED]
-    # 方案 1: 简单粗暴延长窗口到 13个月 (395天)，容忍派息日推迟一个月
-    # 这能解决 90% 的“比东财少”的问题
-    df_daily['dividend_ttm'] = df_daily['cash_dividend_per_share'].rolling(window=395, min_periods=0).sum()
-    return df_daily[['dividend_ttm']]
-
-def calculate_one_stock(symbol: str, name: str, industry: str):
-    """单股计算逻辑 (已修正：使用日线流通股本)"""
+def calculate_dividend_ttm(df_div: pd.DataFrame, dates) -> pd.Series:
+    """
+    分红 TTM: 只在需要的交易日上取 (t - DIVIDEND_WINDOW_DAYS, t] 内的每股现金分红之和。
+    稀疏除息事件做前缀和 + searchsorted (utils/trailing_events.py)，不再把分红铺到每个自然日后 rolling。
+    """
+    if df_div.empty: return pd.Series(0.0, index=dates)
+    ttm = trailing_sum(df_div.index, df_div['cash_dividend_per_share'], dates, DIVIDEND_WINDOW_DAYS)
+    return pd.Series(ttm, index=dates)
+
+def calculate_one_stock(symbol: str, name: str, industry: str, recompute_from=None):
+    """
+    单股计算逻辑 (已修正：使用日线流通股本)
+    recompute_from: 上游 (股本 / 分红 / 财报) 有变更时的最早受影响日期，从该日起重算已有的估值行
+    """
     last_date = get_last_update_date(symbol)
     bars_query = {"symbol": symbol}
     cap_query = {"symbol": symbol} # 查全部股本变动
 
     if last_date:
         start_date = last_date + timedelta(days=1)
+        if recompute_from is not None:
+            start_date = min(start_date, recompute_from)
         bars_query["datetime"] = {"$gte": start_date}
 
     # 1. 获取行情 (含 outstanding_share)
-    cursor_bars = COL_BARS.find(bars_query, {"datetime": 1, "close_price": 1, "outstanding_share": 1}).sort("datetime", ASCENDING)
-    df_bars = pd.DataFrame(list(cursor_bars))
+    df_bars = load_frame(COL_BARS, bars_query,
+                         {"datetime": "datetime", "close_price": "float", "outstanding_share": "float"},
+                         sort=[("datetime", ASCENDING)])
     if df_bars.empty: return []
 
-    df_bars['date'] = pd.to_datetime(df_bars['datetime'])
     # 核心修正: 将日线里的股本重命名为 float_shares_daily
-    df_bars = df_bars.set_index('date')[['close_price', 'outstanding_share']].rename(columns={'outstanding_share': 'float_shares_daily'})
+    df_bars = df_bars.rename(columns={'datetime': 'date', 'outstanding_share': 'float_shares_daily'}).set_index('date')
 
     # 2. 获取总股本 (来自公告)
     # 我们只取 total_shares，忽略那个不准确的 float_shares
-    cursor_cap = COL_CAPITAL.find(cap_query, {"date": 1, "total_shares": 1}).sort("date", ASCENDING)
-    df_cap = pd.DataFrame(list(cursor_cap))
+    df_cap = load_frame(COL_CAPITAL, cap_query, {"date": "datetime", "total_shares": "float"}, sort=[("date", ASCENDING)])
 
     if not df_cap.empty:
-        df_cap['date'] = pd.to_datetime(df_cap['date'])
         df_cap = df_cap.set_index('date')[['total_shares']]
     else:
         df_cap = pd.DataFrame(columns=['total_shares'])
@@ -189,7 +185,6 @@ def calculate_one_stock(symbol: str, name: str, industry: str):
     df_fin = get_clean_financial_data(symbol)
     df_fin_pub = calculate_financial_time_series(df_fin)
     df_div = get_dividend_data(symbol)
-    df_div_daily = calculate_dividend_full_series(df_div)
 
     if not df_fin_pub.empty:
         df_fin_pub = df_fin_pub.sort_index()
@@ -203,11 +198,7 @@ def calculate_one_stock(symbol: str, name: str, industry: str):
         for col in ['equity_adjusted', 'net_profit_ttm', 'revenue_ttm', 'net_profit_lf', 'report_date_audit']:
             df_calc[col] = np.nan
 
-    if not df_div_daily.empty:
-        df_calc = df_calc.join(df_div_daily, how='left')
-        df_calc['dividend_ttm'] = df_calc['dividend_ttm'].fillna(0.0)
-    else:
-        df_calc['dividend_ttm'] = 0.0
+    df_calc['dividend_ttm'] = calculate_dividend_ttm(df_div, df_calc.index)
 
     # 5. 计算指标
     # 注意: 计算流通市值时，优先用 float_shares_daily (日线准确值)
@@ -232,8 +223,8 @@ def calculate_one_stock(symbol: str, name: str, industry: str):
         df_calc['roe_ttm'] = np.where(df_calc['equity_adjusted'] > 0, df_calc['net_profit_ttm'] / df_calc['equity_adjusted'], None)
         df_calc['eps_ttm'] = np.where(df_calc['total_shares'] > 0, df_calc['net_profit_ttm'] / df_calc['total_shares'], None)
 
-    # 6. 生成写入请求
-    updates = []
+    # 6. 生成写入文档 (由 HashedUpsert 比对后只写入变化的部分)
+    docs = []
     for date_idx, row in df_calc.iterrows():
         # 如果连流通市值都算不出来(没价格或没股本)，跳过
         if pd.isna(row['circ_mv']): continue
@@ -261,41 +252,74 @@ def calculate_one_stock(symbol: str, name: str, industry: str):
 
         # 清理 None 和 NaN
         clean_doc = {k: v for k, v in doc.items() if v is not None and not (isinstance(v, float) and np.isnan(v))}
-        updates.append(UpdateOne({"symbol": symbol, "date": date_idx}, {"$set": clean_doc}, upsert=True))
+        docs.append(clean_doc)
 
-    return updates
+    return docs
 
 def run():
     print(f"🚀 启动 [全市场估值计算器 V23] (双轨制股本版)...")
     COL_VALUATION.create_index([("symbol", ASCENDING), ("date", ASCENDING)], unique=True)
 
-    if DEBUG_MODE:
-        tasks = [{"symbol": s} for s in DEBUG_SYMBOLS]
-    else:
-        stocks = list(COL_INFO.find({}, {"symbol": 1}))
-        tasks = [s for s in stocks if not s['symbol'].startswith("8")] # 排除北交所8开头
+    with PROF.stage("load_tasks"):
+        if DEBUG_MODE:
+            tasks = [{"symbol": s} for s in DEBUG_SYMBOLS]
+        else:
+            stocks = list(COL_INFO.find({}, {"symbol": 1}))
+            tasks = [s for s in stocks if not s['symbol'].startswith("8")] # 排除北交所8开头
 
     print(f"📋 任务数: {len(tasks)}")
 
+    # 行业: 一次性加载全市场最新行业 (utils/sector_map 本地快照 + 增量刷新)，不再逐只 find_one
+    with PROF.stage("industry"):
+        industries = sector_map.load_or_build(COL_INDUSTRY.database).snapshot()["industry_name"].to_dict()
+
+    # 上游变更追踪: 股本 / 分红 / 财报 新增或更正过的股票，从最早受影响日期起重算
+    tracker = ChangeTracker(COL_VALUATION.database, COL_VALUATION.name)
+    with PROF.stage("dirty"):
+        dirty = tracker.dirty_starts(DIRTY_SOURCES)
+        # 估值缺口: 有日线却没有估值行的区间，从缺口起点回溯
+        gaps = completeness.claim(COL_VALUATION.database, "valuation_daily", symbols=[s['symbol'] for s in tasks])
+        for symbol, start in gaps.groupby("symbol")["start"].min().items():
+            start = start.to_pydatetime()
+            dirty[symbol] = min(dirty.get(symbol, start), start)
+    if FORCE_UPDATE: dirty = {}
+    if dirty:
+        print(f"🔁 上游变更: {len(dirty)} 只股票需回溯重算 (最早 {min(dirty.values()):%Y-%m-%d})")
+
+    # 变更检测写入: 全量 / 回溯重算时，内容未变的估值行不再重写
+    writer = HashedUpsert(COL_VALUATION, keys=("symbol", "date"), stamp="updated_at")  # 重算改写的行打时间戳，供下游指纹感知
     batch = []
+    failed = 0
     for s in tqdm(tasks):
         try:
-            # 简单查一下行业
-            ind_doc = COL_INDUSTRY.find_one({"symbol": s['symbol']}, sort=[("date", DESCENDING)])
-            industry = ind_doc.get('industry_name', 'Unknown') if ind_doc else 'Unknown'
+            industry = industries.get(s['symbol'], 'Unknown')
 
-            ops = calculate_one_stock(s['symbol'], "", industry)
-            if ops:
-                batch.extend(ops)
+            with PROF.stage("calculate"):
+                docs = calculate_one_stock(s['symbol'], "", industry, dirty.get(s['symbol']))
+            if docs:
+                batch.extend(docs)
                 if len(batch) >= 2000:
-                    COL_VALUATION.bulk_write(batch, ordered=False)
+                    with PROF.stage("write"):
+                        writer.upsert(batch)
+                        PROF.add_rows(len(batch))
                     batch = []
         except Exception as e:
+            failed += 1
             if DEBUG_MODE: print(f"Err {s['symbol']}: {e}")
 
     if batch:
-        COL_VALUATION.bulk_write(batch, ordered=False)
+        with PROF.stage("write"):
+            writer.upsert(batch)
+            PROF.add_rows(len(batch))
+    print(f"\n📝 {writer.summary()}")
+
+    # 全部写完才推进水位；有失败时保留，下次重跑同一批变更
+    if failed:
+        print(f"⚠️ {failed} 只股票计算失败，上游变更水位不推进")
+    else:
+        tracker.commit()
     print("\n✨ 全部完成.")
 
 if __name__ == "__main__":
-    run()
\ No newline at end of file
+    with PROF:
+        run()
\ No newline at end of file
@@ -9,13 +9,16 @@ Script 09: Download Trading Calendar
 import akshare as ak
 import pandas as pd
 from datetime import datetime
-from pymongo import MongoClient, UpdateOne
+from pymongo import UpdateOne
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+from utils.mongo_client import get_client
 
 # ==========================================
 # 配置
 # ==========================================
-MONGO_HOST = "localhost"
-MONGO_PORT = 27017
 DB_NAME = "vnpy_master"
 COLLECTION_NAME = "trading_calendar"
 
@@ -23,7 +26,7 @@ COLLECTION_NAME = "trading_calendar"
 def run():
     print("🚀 启动 [交易日历下载器]...")
 
-    client = MongoClient(MONGO_HOST, MONGO_PORT)
+    client = get_client()
     db = client[DB_NAME]
     col = db[COLLECTION_NAME]
 
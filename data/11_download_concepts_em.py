@@ -21,12 +21,17 @@ from pymongo import MongoClient, UpdateOne, ASCENDING
 sys.path.append(os.path.abspath(os.path.dirname(__file__)))
 from utils.network_guard import NetworkGuard
 from utils.fix_akshare import apply_patches
+from utils import pit_membership, symbol_master
 
 # --- 配置 ---
 MONGO_HOST = "localhost"
 MONGO_PORT = 27017
 DB_NAME = "vnpy_stock"
 SOURCE = "EM"
+# 成分股写入 PIT 增量存储 (utils/pit_membership)，同时保留旧的 index_components 每日全量快照:
+# verify_db_integrity.py / fix_stock_codes_unified.py / debug_concept_columns.py 仍读取该集合，
+# 它们迁移到 pit_membership.MembershipIndex 之前不能关闭，否则会对着过期数据校验和 "修复"。
+KEEP_DAILY_SNAPSHOT = True
 
 class Config:
     # 这里的休眠配置现在用于主循环控制
@@ -39,12 +44,15 @@ def ensure_indexes():
     db["index_info"].create_index([("symbol", ASCENDING)], unique=True)
     db["index_components"].create_index([("index_symbol", ASCENDING), ("date", ASCENDING)], unique=True)
     db["stock_concepts"].create_index([("symbol", ASCENDING), ("date", ASCENDING)], unique=True)
+    pit_membership.ensure_indexes(db)
 
-def format_stock_symbol(raw_code: str) -> str:
-    raw_code = str(raw_code).strip()
-    if raw_code.startswith(('60', '68')): return f"{raw_code}.SH"
-    elif raw_code.startswith(('8', '4')): return f"{raw_code}.BJ"
-    else: return f"{raw_code}.SZ"
+def format_stock_symbols(cons_df) -> list:
+    """成分表的代码列 ('代码' 或 'stock_code') 整列标准化为 VtSymbol (utils/symbol_master)，空代码丢弃"""
+    col = next((c for c in ("代码", "stock_code") if c in cons_df.columns), None)
+    if col is None:
+        return []
+    codes = cons_df[col].dropna().astype(str).str.strip()
+    return list(symbol_master.to_vt(codes[codes != ""]))
 
 def get_tasks_from_local_db():
     cursor = db["index_info"].find({"category": "CONCEPT", "source": SOURCE})
@@ -54,8 +62,11 @@ def get_tasks_from_local_db():
     return tasks
 
 def get_completed_tasks_today(date_str):
-    cursor = db["index_components"].find({"date": date_str}, {"index_symbol": 1, "_id": 0})
-    return set(doc.get("index_symbol") for doc in cursor if doc.get("index_symbol"))
+    done = pit_membership.observed_on(db, date_str)
+    if KEEP_DAILY_SNAPSHOT:
+        cursor = db["index_components"].find({"date": date_str}, {"index_symbol": 1, "_id": 0})
+        done |= set(doc.get("index_symbol") for doc in cursor if doc.get("index_symbol"))
+    return done
 
 def main():
     today = datetime.datetime.now().strftime("%Y-%m-%d")
@@ -107,10 +118,7 @@ def main():
             concept_tag = {"code": vt_symbol, "name": b_name, "source": SOURCE}
 
             if not cons_df.empty:
-                for _, row in cons_df.iterrows():
-                    code_val = row.get('代码') or row.get('stock_code')
-                    if not code_val: continue
-                    stock_symbol = format_stock_symbol(str(code_val))
+                for stock_symbol in format_stock_symbols(cons_df):
                     component_list.append(stock_symbol)
                     stock_ops.append(UpdateOne(
                         {"symbol": stock_symbol, "date": today},
@@ -121,17 +129,22 @@ def main():
             if stock_ops:
                 db["stock_concepts"].bulk_write(stock_ops, ordered=False)
 
-            comp_doc = {
-                "index_symbol": vt_symbol,
-                "date": today,
-                "components": component_list,
-                "count": len(component_list)
-            }
-            db["index_components"].update_one(
-                {"index_symbol": vt_symbol, "date": today},
-                {"$set": comp_doc},
-                upsert=True
-            )
+            # 空结果多半是接口异常，不能当作 "全部调出" 写入事件
+            if component_list:
+                pit_membership.record_snapshot(db, vt_symbol, today, component_list,
+                                               index_name=b_name, category="CONCEPT")
+            if KEEP_DAILY_SNAPSHOT:
+                comp_doc = {
+                    "index_symbol": vt_symbol,
+                    "date": today,
+                    "components": component_list,
+                    "count": len(component_list)
+                }
+                db["index_components"].update_one(
+                    {"index_symbol": vt_symbol, "date": today},
+                    {"$set": comp_doc},
+                    upsert=True
+                )
 
             # 🔥 智能冷却策略
             # 如果耗时 > 10秒，说明触发了 fix_akshare 里的翻页休眠，我们额外多歇会儿
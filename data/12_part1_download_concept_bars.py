@@ -1,5 +1,5 @@
 """
-Script 12 (Part 1 - V6.0): Download Concept Index Bars (Final Clean)
+Script 12 (Part 1 - V6.0): Download Concept Index Bars (Final Clean) - [已废弃] 使用015 脚本
 --------------------------------------------------------------------
 目标: 下载 [概念板块] 的日线行情 (index_daily)
 修复:
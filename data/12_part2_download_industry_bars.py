@@ -1,5 +1,5 @@
 """
-Script 12 (Part 2 - V6.0): Download Industry Index Bars (Smart Update)
+Script 12 (Part 2 - V6.0): Download Industry Index Bars (Smart Update) - [已废弃] 使用015 脚本
 ----------------------------------------------------------------------
 目标: 下载/补全 [行业指数] 日线行情 (SW & EM)
 修复: 解决"存在即跳过"导致的数据停更问题。
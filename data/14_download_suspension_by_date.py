@@ -2,14 +2,17 @@
 
 import akshare as ak
 import pandas as pd
-from pymongo import MongoClient, UpdateOne, ASCENDING
+from pymongo import UpdateOne, ASCENDING
 from datetime import datetime, timedelta
 from tqdm import tqdm
 import time
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+from utils.mongo_client import get_client
 
 # ---------------- Configuration ----------------
-MONGO_HOST = "localhost"
-MONGO_PORT = 27017
 DB_NAME = "vnpy_stock"
 
 # 存每天原始数据的集合 (临时/缓冲)
@@ -24,7 +27,7 @@ START_DATE = "20050101"
 # -----------------------------------------------
 
 def get_db():
-    client = MongoClient(MONGO_HOST, MONGO_PORT)
+    client = get_client()
     return client[DB_NAME]
 
 
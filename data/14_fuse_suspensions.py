@@ -2,13 +2,17 @@
 
 import pandas as pd
 import numpy as np
-from pymongo import MongoClient, UpdateOne, ASCENDING
+from pymongo import UpdateOne, ASCENDING
 from datetime import datetime
 from tqdm import tqdm
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+from utils.mongo_loader import load_frame
+from utils.mongo_client import get_client
 
 # ---------------- Configuration ----------------
-MONGO_HOST = "localhost"
-MONGO_PORT = 27017
 DB_NAME = "vnpy_stock"
 
 COL_BAR = "bar_daily"  # 日线行情集合
@@ -20,7 +24,7 @@ COL_TARGET = "stock_status_history"  # 最终结果表
 # -----------------------------------------------
 
 def get_db():
-    return MongoClient(MONGO_HOST, MONGO_PORT)[DB_NAME]
+    return get_client()[DB_NAME]
 
 
 def load_master_calendar(db):
@@ -123,32 +127,18 @@ def fuse_data(db, master_cal, em_map):
     for symbol in tqdm(stocks):
         try:
             # 1. 获取“有效交易日” (Volume > 0)
-            # 必须读取 volume 字段
-            cursor = bar_col.find(
-                {"symbol": symbol},
-                {"date": 1, "datetime": 1, "volume": 1, "_id": 0}
-            )
-
-            active_dates_list = []
-            for doc in cursor:
-                # --- 兼容性日期读取 (你要求的) ---
-                d = doc.get("datetime") or doc.get("date")
-                if not d:
-                    continue
-
-                # --- 核心判定逻辑 ---
-                # 如果 Volume > 0，视为在场交易
-                # 如果 Volume = 0，视为离场(停牌候选)，不加入 active_dates
-                vol = doc.get("volume", 0)
-                if vol > 0:
-                    active_dates_list.append(pd.to_datetime(d))
-
-            if not active_dates_list:
-                continue
+            # 流式读入定型列 (datetime64 / float)，日期兼容 datetime 与 date 两种字段
+            bars = load_frame(bar_col, {"symbol": symbol},
+                              {"datetime": "datetime", "date": "datetime", "volume": "float"})
+            days = bars["datetime"].fillna(bars["date"]).to_numpy("datetime64[D]")
 
-            # 转为 numpy array
-            active_dates = np.array(active_dates_list, dtype='datetime64[D]')
-            active_dates.sort()
+            # --- 核心判定逻辑 ---
+            # 如果 Volume > 0，视为在场交易
+            # 如果 Volume = 0，视为离场(停牌候选)，不加入 active_dates
+            active_dates = np.sort(days[(bars["volume"].to_numpy() > 0) & ~np.isnat(days)])
+
+            if len(active_dates) == 0:
+                continue
 
             # 2. 确定生命周期 (上市日 ~ 最新有交易日)
             min_date = active_dates[0]
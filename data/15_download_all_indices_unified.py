@@ -1,18 +1,21 @@
 """
-Script 15 (V11.0): Download All Indices (Robust & Normalized)
--------------------------------------------------------------
-目标: [清库重置版] 统一下载 [宽基]、[行业]、[概念] 三类指数。
-架构: Code-First + Unified Schema + Normalized Symbols
-
-改进:
-  1. [Normalize] 行业/概念代码强制添加 'BK' 前缀 (如 BK0475)，确保 DB 主键统一。
-  2. [Index] 自动创建 MongoDB 索引，加速断点查询。
-  3. [Feedback] 进度条显式展示 Skip 数量。
-
-Schema:
-  symbol, date, category, name,
-  open, high, low, close, volume,
-  turnover, turnover_rate, amplitude, change_pct
+Script 15 (V12.0): Unified Index Ingestion Engine (Concurrent & Incremental)
+----------------------------------------------------------------------------
+目标: 统一下载 [宽基]、[行业 (东财/申万)]、[概念]、[地域] 全部指数日线。
+      取代 05 (宽基)、12_part1 (概念)、12_part2 (行业) 以及 V11 的串行版本。
+
+架构:
+  1. [Targets]   目标清单统一来自 index_info (+ 内置宽基清单)，REFRESH_LISTS=True 时先从接口刷新板块列表。
+  2. [Watermark] 一次聚合 ($sort + $group $first，走 symbol_1_datetime_-1 索引) 得到全部指数的最新日期，
+                 不再逐个 find_one。
+  3. [Skip]      最新日期 >= 最近一个已收盘交易日的指数直接跳过；其余只下载 水位线 - OVERLAP_DAYS 之后的数据。
+  4. [Parallel]  所有类别的任务进入同一个线程池并发执行，按数据源 (EM / SW) 令牌桶限速与限并发，
+                 取代固定的 random sleep。
+  5. [Write]     向量化构造文档，按指数 unordered bulk upsert。
+
+Schema (index_daily):
+  symbol, exchange="INDEX", datetime (YYYY-MM-DD), interval="d", category, name,
+  open, high, low, close, volume, [turnover, turnover_rate, change_pct, amplitude]
 """
 
 import akshare as ak
@@ -22,22 +25,35 @@ import random
 import sys
 import os
 import datetime
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from tqdm import tqdm
-from pymongo import MongoClient, UpdateOne, ASCENDING
+from pymongo import UpdateOne, ASCENDING
 
 # 引入工具
 sys.path.append(os.path.abspath(os.path.dirname(__file__)))
 from utils.network_guard import NetworkGuard
 from utils.fix_akshare import apply_patches
+from utils.rate_limiter import SourceLimit
+from utils.mongo_client import get_client
 
 # --- 配置 ---
-MONGO_HOST = "localhost"
-MONGO_PORT = 27017
 DB_NAME = "vnpy_stock"
 MAX_RETRIES = 5
+MAX_WORKERS = 6
 
 START_DATE = "19900101"
 END_DATE = datetime.datetime.now().strftime("%Y%m%d")
+OVERLAP_DAYS = 3            # 增量下载时回看几天，覆盖最后几根 K 线的修正
+AFTER_CLOSE_HOUR = 16       # 此时间之前运行，当天不视为已收盘
+REFRESH_LISTS = True        # 先从接口刷新 东财行业/概念、申万行业 列表并写入 index_info
+CATEGORIES = ["BENCHMARK", "INDUSTRY", "INDUSTRY_EM", "INDUSTRY_SW", "CONCEPT", "REGION"]
+
+# 每个数据源的限速: rate=平均请求数/秒, max_concurrency=同时在途请求数
+SOURCE_LIMITS = {
+    "EM": SourceLimit(rate=1.5, burst=2, max_concurrency=3),
+    "SW": SourceLimit(rate=0.4, burst=1, max_concurrency=1),   # 申万接口容易封
+}
 
 BENCHMARKS = [
     ("sh000001", "上证指数"), ("sz399001", "深证成指"), ("sz399006", "创业板指"),
@@ -46,15 +62,26 @@ BENCHMARKS = [
     ("sh000985", "中证全指"), ("sz899050", "北证50"),
 ]
 
-client = MongoClient(MONGO_HOST, MONGO_PORT)
+RENAME_MAP = {
+    "date": "date", "amount": "turnover",
+    "日期": "date", "开盘": "open", "最高": "high", "最低": "low", "收盘": "close",
+    "成交量": "volume", "成交额": "turnover", "换手率": "turnover_rate",
+    "涨跌幅": "change_pct", "振幅": "amplitude"
+}
+REQUIRED = ["date", "open", "high", "low", "close", "volume"]
+OPTIONAL = ["turnover", "turnover_rate", "change_pct", "amplitude"]
+
+client = get_client()
 db = client[DB_NAME]
 
+
 def ensure_indexes():
     """创建索引加速查询"""
     print("🔨 正在优化数据库索引...")
     db["index_daily"].create_index([("symbol", ASCENDING), ("datetime", -1)])
     db["index_daily"].create_index([("category", ASCENDING)])
 
+
 def normalize_bk_code(code: str) -> str:
     """标准化板块代码: 0475 -> BK0475"""
     code = str(code).strip()
@@ -62,182 +89,220 @@ def normalize_bk_code(code: str) -> str:
         return f"BK{code}"
     return code
 
-def get_db_latest_date(symbol):
-    """查询数据库最新日期"""
-    doc = db["index_daily"].find_one(
-        {"symbol": symbol},
-        sort=[("datetime", -1)],
-        projection={"datetime": 1}
-    )
-    return doc["datetime"] if doc else None
 
-def retry_action(func, *args, **kwargs):
+# =========================================================================
+# 1. 数据源: category -> (source, fetch(symbol, start, end))
+# =========================================================================
+def fetch_benchmark(symbol, start, end):
+    return ak.stock_zh_index_daily_em(symbol=symbol, start_date=start, end_date=end)
+
+
+def fetch_em_industry(symbol, start, end):
+    return ak.stock_board_industry_hist_em(symbol=symbol, start_date=start, end_date=end)
+
+
+def fetch_em_concept(symbol, start, end):
+    # 地域板块与概念板块共用东财 b:BKxxxx 行情接口 (fix_akshare 补丁支持直接传 BK 代码)
+    return ak.stock_board_concept_hist_em(symbol=symbol, period="daily", start_date=start, end_date=end)
+
+
+def fetch_sw(symbol, start, end):
+    # 申万接口不支持日期参数，返回全量后在本地截取
+    return ak.index_hist_sw(symbol=symbol)
+
+
+CATEGORY_SOURCES = {
+    "BENCHMARK": ("EM", fetch_benchmark),
+    "INDUSTRY": ("EM", fetch_em_industry),
+    "INDUSTRY_EM": ("EM", fetch_em_industry),
+    "CONCEPT": ("EM", fetch_em_concept),
+    "REGION": ("EM", fetch_em_concept),
+    "INDUSTRY_SW": ("SW", fetch_sw),
+}
+
+
+def retry_action(source, func, *args, **kwargs):
     for attempt in range(MAX_RETRIES):
         try:
-            return func(*args, **kwargs)
+            with SOURCE_LIMITS[source]:
+                return func(*args, **kwargs)
         except Exception as e:
             err_msg = str(e)
             if "Length mismatch" in err_msg or "char 0" in err_msg: return pd.DataFrame()
             if "ProxyError" in err_msg or "ConnectionPool" in err_msg:
                 time.sleep(random.uniform(3, 8))
                 NetworkGuard.rotate_identity()
-            if attempt == MAX_RETRIES - 1: pass
-            time.sleep(random.uniform(1, 3))
+            time.sleep(random.uniform(1, 3) * (attempt + 1))
     return None
 
-def standardize_columns(df):
+
+# =========================================================================
+# 2. 目标清单与水位线
+# =========================================================================
+def refresh_target_lists():
+    """从接口刷新板块列表并写入 index_info (失败时沿用库中已有列表)"""
+    ops = []
+    listings = [
+        ("INDUSTRY", "EM", ak.stock_board_industry_name_em, "板块代码", "板块名称"),
+        ("CONCEPT", "EM", ak.stock_board_concept_name_em, "板块代码", "板块名称"),
+        ("INDUSTRY_SW", "SW", ak.sw_index_first_info, "行业代码", "行业名称"),
+        ("INDUSTRY_SW", "SW", ak.sw_index_second_info, "行业代码", "行业名称"),
+    ]
+    for category, source, func, code_col, name_col in listings:
+        df = retry_action(source, func)
+        if df is None or df.empty:
+            print(f"   ⚠️ {category} 列表获取失败，沿用 index_info")
+            continue
+        for _, r in df.iterrows():
+            raw = str(r[code_col]).split(".")[0]
+            symbol = raw if source == "SW" else normalize_bk_code(raw)
+            ops.append(UpdateOne({"symbol": symbol},
+                                 {"$set": {"symbol": symbol, "name": r[name_col], "category": category,
+                                           "source": source}}, upsert=True))
+    for symbol, name in BENCHMARKS:
+        ops.append(UpdateOne({"symbol": symbol},
+                             {"$set": {"symbol": symbol, "name": name, "category": "BENCHMARK",
+                                       "source": "EXCHANGE"}}, upsert=True))
+    if ops:
+        db["index_info"].bulk_write(ops, ordered=False)
+    print(f"   ✅ index_info 已刷新 {len(ops)} 条")
+
+
+def load_targets():
+    targets = {s: {"symbol": s, "name": n, "category": "BENCHMARK"} for s, n in BENCHMARKS}
+    cursor = db["index_info"].find({"category": {"$in": CATEGORIES}}, {"_id": 0, "symbol": 1, "name": 1, "category": 1})
+    for d in cursor:
+        targets.setdefault(d["symbol"], {"symbol": d["symbol"], "name": d.get("name", d["symbol"]),
+                                         "category": d["category"]})
+    return list(targets.values())
+
+
+def load_watermarks():
+    """一次聚合取出全部指数的最新日期: {symbol: 'YYYY-MM-DD'}"""
+    pipeline = [
+        {"$sort": {"symbol": 1, "datetime": -1}},
+        {"$group": {"_id": "$symbol", "last": {"$first": "$datetime"}}},
+    ]
+    cursor = db["index_daily"].aggregate(pipeline, hint=[("symbol", ASCENDING), ("datetime", -1)],
+                                         allowDiskUse=True)
+    return {d["_id"]: str(d["last"])[:10] for d in cursor}
+
+
+def latest_closed_trade_date():
+    """最近一个已收盘的交易日 (日历缺失时退化为昨天)"""
+    now = datetime.datetime.now()
+    limit = now if now.hour >= AFTER_CLOSE_HOUR else now - datetime.timedelta(days=1)
+    doc = client["vnpy_master"]["trading_calendar"].find_one(
+        {"exchange": "SSE", "date": {"$lte": limit.strftime("%Y-%m-%d")}}, sort=[("date", -1)])
+    if doc:
+        return doc["date"]
+    return (now - datetime.timedelta(days=1)).strftime("%Y-%m-%d")
+
+
+def plan_tasks(targets, watermarks, target_date):
+    tasks, skipped = [], Counter()
+    for t in targets:
+        last = watermarks.get(t["symbol"])
+        if last and last >= target_date:
+            skipped[t["category"]] += 1
+            continue
+        if last:
+            start = datetime.datetime.strptime(last, "%Y-%m-%d") - datetime.timedelta(days=OVERLAP_DAYS)
+            start = start.strftime("%Y%m%d")
+        else:
+            start = START_DATE
+        tasks.append(dict(t, start=start))
+    return tasks, skipped
+
+
+# =========================================================================
+# 3. 下载与入库
+# =========================================================================
+def standardize_columns(df, start):
     if df is None or df.empty: return None
-    rename_map = {
-        "date": "date", "amount": "turnover",
-        "日期": "date", "开盘": "open", "最高": "high", "最低": "low", "收盘": "close",
-        "成交量": "volume", "成交额": "turnover", "换手率": "turnover_rate",
-        "涨跌幅": "change_pct", "振幅": "amplitude"
-    }
-    cols_to_rename = {k: v for k, v in rename_map.items() if k in df.columns}
-    df.rename(columns=cols_to_rename, inplace=True)
-
-    for col in ["turnover_rate", "change_pct"]:
-        if col not in df.columns: df[col] = 0.0
+    df = df.rename(columns={k: v for k, v in RENAME_MAP.items() if k in df.columns})
+    if any(c not in df.columns for c in REQUIRED): return None
 
+    df = df.copy()
+    df["date"] = pd.to_datetime(df["date"]).dt.strftime("%Y-%m-%d")
+    df = df.sort_values("date").reset_index(drop=True)
     if "amplitude" not in df.columns:
-        df = df.sort_values("date").reset_index(drop=True)
         pre_close = df["close"].shift(1)
-        amplitude = (df["high"] - df["low"]) / pre_close * 100
-        df["amplitude"] = amplitude.fillna(0.0)
-
-    required = ["date", "open", "high", "low", "close", "volume", "turnover", "turnover_rate", "change_pct", "amplitude"]
-    for col in required:
-        if col not in df.columns: return None
-    return df[required]
-
-def process_one_symbol(store_symbol, query_symbol, name, category, fetch_func, **kwargs):
-    """
-    :param store_symbol: 存库代码 (BK0475)
-    :param query_symbol: 查询代码 (BK0475 / 0475 / sh000300)
-    """
-
-    # 1. 断点跳过
-    last_date = get_db_latest_date(store_symbol)
-    yesterday = (datetime.datetime.now() - datetime.timedelta(days=1)).strftime("%Y-%m-%d")
-
-    if last_date and last_date >= yesterday:
-        return "SKIPPED"
-
-    # 2. 下载
-    df = retry_action(fetch_func, symbol=query_symbol, **kwargs)
-
-    # 3. 标准化
-    df = standardize_columns(df)
-    if df is None or df.empty: return "EMPTY"
-
-    # 4. 入库
+        df["amplitude"] = ((df["high"] - df["low"]) / pre_close * 100).fillna(0.0)
+
+    start_str = f"{start[:4]}-{start[4:6]}-{start[6:]}"
+    df = df[df["date"] >= start_str]
+    cols = REQUIRED + [c for c in OPTIONAL if c in df.columns]
+    out = df[cols].copy()
+    out[cols[1:]] = out[cols[1:]].apply(pd.to_numeric, errors="coerce")
+    return out.dropna(subset=["open", "high", "low", "close"])
+
+
+def process_task(task):
+    """返回 (状态, 写入行数)"""
+    source, fetch = CATEGORY_SOURCES[task["category"]]
+    df = retry_action(source, fetch, task["symbol"], task["start"], END_DATE)
+    if df is None:
+        return "FAILED", 0
+    df = standardize_columns(df, task["start"])
+    if df is None or df.empty:
+        return "EMPTY", 0
+
+    base = {"symbol": task["symbol"], "exchange": "INDEX", "interval": "d",
+            "category": task["category"], "name": task["name"]}
     ops = []
-    for _, row in df.iterrows():
-        try:
-            date_str = str(row["date"])[:10]
-            doc = {
-                "symbol": store_symbol,
-                "exchange": "INDEX",
-                "datetime": date_str,
-                "interval": "d",
-                "category": category,
-                "name": name,
-                "open": float(row["open"]),
-                "high": float(row["high"]),
-                "low": float(row["low"]),
-                "close": float(row["close"]),
-                "volume": float(row["volume"]),
-                "turnover": float(row["turnover"]),
-                "turnover_rate": float(row["turnover_rate"]),
-                "change_pct": float(row["change_pct"]),
-                "amplitude": float(row["amplitude"])
-            }
-            ops.append(UpdateOne({"symbol": store_symbol, "datetime": date_str}, {"$set": doc}, upsert=True))
-        except: continue
+    for rec in df.rename(columns={"date": "datetime"}).to_dict("records"):
+        doc = dict(base, **{k: float(v) if k != "datetime" else v for k, v in rec.items() if pd.notna(v)})
+        ops.append(UpdateOne({"symbol": task["symbol"], "datetime": doc["datetime"]}, {"$set": doc}, upsert=True))
+    db["index_daily"].bulk_write(ops, ordered=False)
+    return "UPDATED", len(ops)
 
-    if ops:
-        db["index_daily"].bulk_write(ops, ordered=False)
-        return "UPDATED"
-    return "EMPTY"
 
 def run_unified_job():
-    print("🚀 启动 [全指数] 统一下载任务 (V11.0 Robust)...")
+    print("🚀 启动 [全指数] 统一增量下载任务 (V12.0 Concurrent)...")
     ensure_indexes()
 
     apply_patches()
     NetworkGuard.install()
 
-    # --- 1. 宽基 ---
-    print(f"\n📊 [1/3] 宽基指数 ({len(BENCHMARKS)} 个)...")
-    for symbol, name in tqdm(BENCHMARKS, desc="Benchmark"):
-        process_one_symbol(
-            store_symbol=symbol, query_symbol=symbol, name=name, category="BENCHMARK",
-            fetch_func=ak.stock_zh_index_daily_em
-        )
+    if REFRESH_LISTS:
+        print("\n📡 [1/3] 刷新板块列表...")
+        refresh_target_lists()
+
+    print("\n🧭 [2/3] 计算水位线...")
+    target_date = latest_closed_trade_date()
+    targets = load_targets()
+    watermarks = load_watermarks()
+    tasks, skipped = plan_tasks(targets, watermarks, target_date)
+    print(f"   目标日期 {target_date} | 指数 {len(targets)} 个 | 已最新 {sum(skipped.values())} | 待下载 {len(tasks)}")
+
+    print(f"\n📊 [3/3] 并发下载 (workers={MAX_WORKERS})...")
+    stats = defaultdict(Counter)
+    t0 = time.time()
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as pool:
+        futures = {pool.submit(process_task, t): t for t in tasks}
+        pbar = tqdm(as_completed(futures), total=len(futures), desc="Index")
+        for fut in pbar:
+            task = futures[fut]
+            try:
+                status, rows = fut.result()
+            except Exception as e:
+                status, rows = "FAILED", 0
+                tqdm.write(f"   ❌ {task['symbol']} {task['name']}: {e}")
+            stats[task["category"]][status] += 1
+            stats[task["category"]]["rows"] += rows
+            pbar.set_postfix(upd=sum(s["UPDATED"] for s in stats.values()))
+
+    print("\n" + "=" * 60)
+    for category in sorted(set(stats) | set(skipped)):
+        s = stats[category]
+        print(f"   {category:<12} 更新 {s['UPDATED']:>4} | 跳过 {skipped[category]:>4} | "
+              f"无数据 {s['EMPTY']:>3} | 失败 {s['FAILED']:>3} | 写入 {s['rows']:,} 行")
+    print(f"✨ 任务完成，耗时 {time.time() - t0:.1f}s")
 
-    # --- 2. 行业 ---
-    print("\n📊 [2/3] 行业板块 (Normalized BK)...")
-    try:
-        em_ind_df = ak.stock_board_industry_name_em()
-        # 标准化: 存库用 BKxxxx, 查询用 BKxxxx (AKShare 支持)
-        em_ind_list = [{"code": normalize_bk_code(r["板块代码"]), "name": r["板块名称"]} for _, r in em_ind_df.iterrows()]
-
-        pbar = tqdm(em_ind_list, desc="Industry")
-        stats = {"skip": 0, "upd": 0}
-
-        for item in pbar:
-            status = process_one_symbol(
-                store_symbol=item['code'], query_symbol=item['code'],
-                name=item['name'], category="INDUSTRY",
-                fetch_func=ak.stock_board_industry_hist_em,
-                start_date=START_DATE, end_date=END_DATE
-            )
-            if status == "UPDATED":
-                stats["upd"] += 1
-                time.sleep(random.uniform(0.5, 1.5))
-            elif status == "SKIPPED":
-                stats["skip"] += 1
-
-            pbar.set_postfix(skip=stats['skip'], upd=stats['upd'])
-
-    except Exception as e: print(f"❌ 行业失败: {e}")
-
-    # --- 3. 概念 ---
-    print("\n📊 [3/3] 概念板块 (Normalized BK)...")
-    try:
-        try:
-            em_con_df = retry_action(ak.stock_board_concept_name_em)
-            if em_con_df is None: raise Exception("API Error")
-            em_con_list = [{"code": normalize_bk_code(r["板块代码"]), "name": r["板块名称"]} for _, r in em_con_df.iterrows()]
-        except:
-            print("   ⚠️ 切换本地缓存...")
-            cursor = db["index_info"].find({"category": "CONCEPT"}, {"name": 1, "symbol": 1})
-            em_con_list = [{"code": normalize_bk_code(d["symbol"]), "name": d["name"]} for d in cursor]
-
-        pbar = tqdm(em_con_list, desc="Concept")
-        stats = {"skip": 0, "upd": 0}
-
-        for item in pbar:
-            status = process_one_symbol(
-                store_symbol=item['code'], query_symbol=item['code'],
-                name=item['name'], category="CONCEPT",
-                fetch_func=ak.stock_board_concept_hist_em,
-                start_date=START_DATE, end_date=END_DATE, period="daily"
-            )
-            if status == "UPDATED":
-                stats["upd"] += 1
-                time.sleep(random.uniform(1.0, 3.0))
-            elif status == "SKIPPED":
-                stats["skip"] += 1
-
-            pbar.set_postfix(skip=stats['skip'], upd=stats['upd'])
-
-    except Exception as e: print(f"❌ 概念失败: {e}")
-
-    print("\n✨ 任务完成。")
 
 if __name__ == "__main__":
     try:
         run_unified_job()
     except KeyboardInterrupt:
-        print("\n🛑 用户停止。")
\ No newline at end of file
+        print("\n🛑 用户停止。")
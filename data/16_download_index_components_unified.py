@@ -17,7 +17,6 @@ import time
 import random
 import datetime
 from tqdm import tqdm
-from pymongo import MongoClient, UpdateOne
 
 # 引入工具
 import sys
@@ -25,12 +24,17 @@ import os
 sys.path.append(os.path.abspath(os.path.dirname(__file__)))
 from utils.network_guard import NetworkGuard
 from utils.fix_akshare import apply_patches
+from utils import pit_membership, symbol_master
+from utils.mongo_client import get_client
+from utils.hashed_upsert import HashedUpsert
 
 # --- 配置 ---
-MONGO_HOST = "localhost"
-MONGO_PORT = 27017
 DB_NAME = "vnpy_stock"
 TODAY = datetime.datetime.now().strftime("%Y-%m-%d")
+# 成分股写入 PIT 增量存储 (utils/pit_membership)，同时保留旧的 index_components 每日全量快照:
+# verify_db_integrity.py / fix_stock_codes_unified.py / debug_concept_columns.py 仍读取该集合，
+# 它们迁移到 pit_membership.MembershipIndex 之前不能关闭，否则会对着过期数据校验和 "修复"。
+KEEP_DAILY_SNAPSHOT = True
 
 # 宽基映射: {指数名称: (API代码, 存库Symbol)}
 BENCHMARK_MAP = {
@@ -46,21 +50,28 @@ BENCHMARK_MAP = {
     "北证50":   ("899050", "sz899050"),
 }
 
-client = MongoClient(MONGO_HOST, MONGO_PORT)
+client = get_client()
 db = client[DB_NAME]
 
-def format_stock_symbol(symbol):
-    """标准化股票代码"""
-    s = str(symbol).strip()
-    if len(s) == 6:
-        if s.startswith(('6')): return f"{s}.SH"
-        if s.startswith(('0', '3')): return f"{s}.SZ"
-        if s.startswith(('4', '8')): return f"{s}.BJ"
-    return s
+# 变更检测写入: 元数据 / 兼容快照内容未变时不再重复 upsert
+INFO_WRITER = HashedUpsert(db["index_info"], keys=("symbol",))
+SNAPSHOT_WRITER = HashedUpsert(db["index_components"], keys=("index_symbol", "date"))
+
+def format_stock_symbols(df, column="代码"):
+    """成分表的代码列整列标准化为 VtSymbol (utils/symbol_master)，空代码丢弃"""
+    if column not in df.columns:
+        return []
+    codes = df[column].dropna().astype(str).str.strip()
+    return list(symbol_master.to_vt(codes[codes != ""]))
 
 def save_components(db_symbol, index_name, category, component_list, weights=None):
     if not component_list: return
 
+    pit_membership.record_snapshot(db, db_symbol, TODAY, component_list, weights,
+                                   index_name=index_name, category=category)
+    if not KEEP_DAILY_SNAPSHOT:
+        return
+
     doc = {
         "index_symbol": db_symbol,
         "index_name": index_name,
@@ -71,11 +82,7 @@ def save_components(db_symbol, index_name, category, component_list, weights=Non
         "weights": weights if weights else {}
     }
 
-    db["index_components"].update_one(
-        {"index_symbol": db_symbol, "date": TODAY},
-        {"$set": doc},
-        upsert=True
-    )
+    SNAPSHOT_WRITER.upsert([doc])
 
 # =========================================================================
 # 0. 元数据同步 (Sync Info) - 新增功能
@@ -93,7 +100,7 @@ def sync_index_info():
     ]
     cursor = db["index_daily"].aggregate(pipeline)
 
-    ops = []
+    docs = []
     for doc in cursor:
         symbol = doc["_id"]
         name = doc.get("name", symbol)
@@ -106,11 +113,12 @@ def sync_index_info():
             "category": category,
             "source": "EM" if "BK" in symbol else "EXCHANGE"
         }
-        ops.append(UpdateOne({"symbol": symbol}, {"$set": info_doc}, upsert=True))
+        docs.append(info_doc)
 
-    if ops:
-        db["index_info"].bulk_write(ops, ordered=False)
-        print(f"   ✅ 已同步 {len(ops)} 条指数元数据到 index_info")
+    if docs:
+        stats = INFO_WRITER.upsert(docs)
+        print(f"   ✅ 已同步 {len(docs)} 条指数元数据到 index_info "
+              f"(新增 {stats['new']} / 变更 {stats['changed']} / 未变 {stats['unchanged']})")
     else:
         print("   ⚠️ index_daily 为空，无法同步。")
 
@@ -145,17 +153,14 @@ def download_benchmark_components():
                 # print(f"   ⚠️ {name} 无数据")
                 continue
 
-            comps = []
+            code_col = "成分券代码" if "成分券代码" in df.columns else "代码"
+            df = df[df[code_col].notna() & (df[code_col].astype(str) != "")]
+            comps = list(symbol_master.to_vt(df[code_col].astype(str).str.zfill(6)))
             weights = {}
-            for _, row in df.iterrows():
-                raw_code = row.get("成分券代码") or row.get("代码")
-                if not raw_code: continue
-
-                stock_sym = format_stock_symbol(str(raw_code).zfill(6))
-                comps.append(stock_sym)
-
-                w = row.get("权重") or row.get("权重(%)")
-                if w: weights[stock_sym] = float(w)
+            weight_col = next((c for c in ("权重", "权重(%)") if c in df.columns), None)
+            if weight_col:
+                for stock_sym, w in zip(comps, df[weight_col]):
+                    if w: weights[stock_sym] = float(w)
 
             save_components(db_symbol, name, "BENCHMARK", comps, weights)
             time.sleep(1)
@@ -180,11 +185,7 @@ def download_industry_components():
                 # item['symbol'] 是 BK0475
                 df = ak.stock_board_industry_cons_em(symbol=item['symbol'])
 
-                comps = []
-                for _, row in df.iterrows():
-                    raw_code = row.get("代码")
-                    if raw_code: comps.append(format_stock_symbol(raw_code))
-
+                comps = format_stock_symbols(df)
                 save_components(item['symbol'], item['name'], "INDUSTRY", comps)
                 time.sleep(random.uniform(0.5, 1.5))
             except: continue
@@ -213,11 +214,7 @@ def download_concept_components():
 
                 df = ak.stock_board_concept_cons_em(symbol=item['symbol'])
 
-                comps = []
-                for _, row in df.iterrows():
-                    raw_code = row.get("代码")
-                    if raw_code: comps.append(format_stock_symbol(raw_code))
-
+                comps = format_stock_symbols(df)
                 save_components(item['symbol'], item['name'], "CONCEPT", comps)
                 time.sleep(random.uniform(1.0, 2.0))
 
@@ -232,6 +229,7 @@ def run():
     print("🚀 启动 [成分股下载 + 元数据同步] 任务 (V2.0)...")
     apply_patches()
     NetworkGuard.install()
+    pit_membership.ensure_indexes(db)
 
     # 1. 先同步元数据，确保 index_info 有最新数据
     sync_index_info()
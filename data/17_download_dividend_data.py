@@ -8,25 +8,32 @@
   - A股股权登记日 -> record_date
   - 分红方案说明 -> plan_desc
   - 实施公告日 -> notice_date
+写入: 与库中内容摘要比对，只写入变化的记录并打 updated_at (utils/hashed_upsert)。
 """
 import akshare as ak
 import pandas as pd
-from pymongo import MongoClient, UpdateOne, ASCENDING, DESCENDING
+from pymongo import ASCENDING, DESCENDING
 from tqdm import tqdm
 from datetime import datetime, date
 import time
 import re
 import traceback
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+from utils.mongo_client import get_client
+from utils.hashed_upsert import HashedUpsert
 
 # --- 配置 ---
-MONGO_HOST = "localhost"
-MONGO_PORT = 27017
 DB_NAME = "vnpy_stock"
-CLIENT = MongoClient(MONGO_HOST, MONGO_PORT)
+CLIENT = get_client()
 DB = CLIENT[DB_NAME]
 
 COL_INFO = DB["stock_info"]
 COL_DIVIDEND = DB["finance_dividend"]
+# 变更检测写入: 只写入新增 / 变化的分红记录并打 updated_at (估值 08 的增量重算依据)
+DIVIDEND_WRITER = HashedUpsert(COL_DIVIDEND, keys=("symbol", "ex_date"), stamp="updated_at")
 
 # ================= 配置区域 =================
 # 调试模式: True=只跑测试股; False=跑全量
@@ -103,7 +110,7 @@ def download_one_stock(symbol: str):
         # 很多预案阶段的数据没有除权日，必须剔除
         df = df.dropna(subset=['A股除权除息日'])
 
-        updates = []
+        docs = []
         for _, row in df.iterrows():
             ex_date_raw = row['A股除权除息日']
 
@@ -136,13 +143,9 @@ def download_one_stock(symbol: str):
             }
 
             # 唯一键: symbol + ex_date
-            updates.append(UpdateOne(
-                {"symbol": symbol, "ex_date": doc["ex_date"]},
-                {"$set": doc},
-                upsert=True
-            ))
+            docs.append(doc)
 
-        return updates
+        return docs
 
     except Exception as e:
         # print(f"   ❌ 异常 {symbol}: {e}")
@@ -181,14 +184,15 @@ def run():
         symbol = s['symbol']
         pbar.set_description(f"下载 {symbol}")
 
-        ops = download_one_stock(symbol)
-        if ops:
-            COL_DIVIDEND.bulk_write(ops, ordered=False)
+        docs = download_one_stock(symbol)
+        if docs:
+            DIVIDEND_WRITER.upsert(docs)
             success_cnt += 1
 
         time.sleep(0.2) # 同花顺建议稍慢一点
 
     print(f"\n🎉 下载完成！成功处理 {success_cnt} 只股票。")
+    print(f"📝 {DIVIDEND_WRITER.summary()}")
 
 if __name__ == "__main__":
     run()
\ No newline at end of file
@@ -0,0 +1,118 @@
+"""
+Script 18: Cross-Sectional Factor Calculator (因子计算)
+------------------------------------------------------
+目标: 填充 vnpy_factor 下的 factor_technical / momentum / value / quality / sentiment / volatility 与 factor_master。
+依赖: 02 (bar_daily)、03 (adjust_factor)、08 (valuation_daily)、15 (index_daily: 沪深300)。
+
+逻辑:
+1. 因子定义统一在 utils/factor_engine 中注册 (rsi / macd / mom / ep / bp / roe / atr / std / beta / 涨停数)，
+   共享中间量 (前复权价、收益、EMA ...) 按 DAG 每批只计算一次；factor_master 中 enabled=False 的因子跳过。
+2. 增量模式: 读取 factor_master 中各因子的 last_date，只加载 (最早 last_date - 最大有效回看) 之后的数据，
+   只写入新日期；FORCE_FULL=True 时从 START_DATE 全量重算。
+3. 股票按 SYMBOL_BATCH 分批读取面板并计算，控制全量重算时的内存。
+"""
+
+import os
+import sys
+import time
+from datetime import datetime
+
+from pymongo import ASCENDING
+from tqdm import tqdm
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+from utils.stage_profiler import StageProfiler
+from utils import factor_engine as fe
+from utils.mongo_client import get_client
+
+PROF = StageProfiler(__file__)
+
+# --- 配置 ---
+START_DATE = datetime(2005, 1, 1)
+FORCE_FULL = False
+FACTORS = None              # None = 全部已注册因子，或如 ["rsi_14", "beta_60"]
+SYMBOL_BATCH = 500
+WRITE_BATCH = 5000
+
+CLIENT = get_client()
+DB_STOCK = CLIENT["vnpy_stock"]
+DB_MASTER = CLIENT["vnpy_master"]
+DB_FACTOR = CLIENT[fe.FACTOR_DB]
+
+
+def ensure_indexes(names):
+    for col in {fe.REGISTRY[n].collection for n in names}:
+        DB_FACTOR[col].create_index([("symbol", ASCENDING), ("date", ASCENDING)], unique=True)
+    DB_FACTOR["factor_master"].create_index([("factor_name", ASCENDING)], unique=True)
+
+
+def plan(names):
+    """返回 (写入起点 {factor: last_date|None}, 数据加载起点)"""
+    master = {} if FORCE_FULL else fe.load_master(DB_FACTOR)
+    last = {n: master.get(n, {}).get("last_date") for n in names}
+    known = [d for d in last.values() if d is not None]
+    first_new = min(known) if known and len(known) == len(names) else START_DATE
+    lookback = max(fe.effective_lookback(n) for n in names)
+    return last, max(fe.lookback_start(DB_MASTER, first_new, lookback), START_DATE)
+
+
+def write(frames, last):
+    rows = 0
+    for col, df in frames.items():
+        names = [c for c in df.columns if c not in ("symbol", "date")]
+        # 只写入各因子 last_date 之后的日期 (同一集合内取最早的 last_date)
+        col_last = [last[n] for n in names]
+        if all(d is not None for d in col_last):
+            df = df[df["date"] > min(col_last)]
+        ops = fe.to_ops(df)
+        for i in range(0, len(ops), WRITE_BATCH):
+            DB_FACTOR[col].bulk_write(ops[i:i + WRITE_BATCH], ordered=False)
+        rows += len(ops)
+    return rows
+
+
+def run():
+    names = FACTORS or fe.enabled_factors(fe.load_master(DB_FACTOR))
+    graph = fe.closure(names)
+    print(f"🚀 启动 [截面因子计算] ({len(names)} 个因子 / {len(graph)} 个节点, {'全量' if FORCE_FULL else '增量'})...")
+    ensure_indexes(names)
+
+    with PROF.stage("plan"):
+        last, load_start = plan(names)
+        symbols = sorted(s["symbol"] for s in DB_STOCK["stock_info"].find({}, {"symbol": 1}))
+    print(f"📅 数据加载起点: {load_start:%Y-%m-%d} | 股票 {len(symbols)} 只 | 每批 {SYMBOL_BATCH}")
+
+    t0 = time.time()
+    total_rows, max_date = 0, None
+    node_seconds = {}
+    for i in tqdm(range(0, len(symbols), SYMBOL_BATCH), desc="Batch"):
+        batch = symbols[i:i + SYMBOL_BATCH]
+        ctx = fe.PanelContext(DB_STOCK, batch, load_start, targets=names)
+        try:
+            with PROF.stage("load"):
+                index = ctx.index
+            if index.empty:
+                continue
+            with PROF.stage("compute"):
+                frames = fe.compute(ctx, names)
+            with PROF.stage("write"):
+                n = write(frames, last)
+                PROF.add_rows(n)
+        finally:
+            for node, sec in ctx.timings.items():
+                node_seconds[node] = node_seconds.get(node, 0.0) + sec
+            ctx.close()
+        total_rows += n
+        max_date = index.max() if max_date is None else max(max_date, index.max())
+
+    if max_date is not None:
+        fe.update_master(DB_FACTOR, names, max_date.to_pydatetime())
+    print(f"\n✨ 完成: 写入 {total_rows:,} 行, 最新日期 {max_date:%Y-%m-%d}" if max_date is not None
+          else "\n⚠️ 没有可计算的行情数据")
+    print(f"⏱  耗时 {time.time() - t0:.1f}s | 计算节点 {len(node_seconds)} 个，最慢: " +
+          ", ".join(f"{k} {v:.2f}s" for k, v in sorted(node_seconds.items(), key=lambda x: -x[1])[:5]))
+
+
+if __name__ == "__main__":
+    with PROF:
+        run()
@@ -0,0 +1,280 @@
+"""
+Script 19: Limit-Up / Limit-Down Analysis (涨跌停分析)
+------------------------------------------------------
+目标: 填充 vnpy_stock.analysis_limit_up / analysis_limit_down。
+依赖: 02 (bar_daily)、03 (adjust_factor)、13/14 (stock_status_history: st_history)、stock_info (上市日)。
+
+逻辑:
+1. 整块面板计算 (日期 × 股票)，不做逐只股票循环:
+   - 前收盘取该股上一个有成交日的收盘价，除权日按复权因子换算为除权参考价;
+   - 涨跌幅比例按板块 + ST 状态生成 (utils/limit_rules.py)，新股不设涨跌幅的日子剔除;
+   - 涨停价/跌停价四舍五入到分，收盘价等于涨停价即封板。
+2. 连板数用 run-length 运算一次算出，停牌日不打断连板 (窗口首日停牌的股票带入窗口前最后一个收盘价)。
+3. 只写入触及涨停/跌停的 (symbol, date)，两张表都是稀疏事件表。
+4. 增量模式: 以 analysis_limit_state 记录的已处理交易日为水位线，向前多取 SEED_DAYS 个交易日重算，
+   每只股票取窗口首日及之前最近一条已存记录的连板数接续更早的连板 (停牌跨过窗口首日也不断)，
+   只写入水位线之后的日期。
+
+字段 (日线近似，盘口类字段需要逐笔数据):
+   analysis_limit_up:   is_limit_up, limit_seq (连板数), limit_price, limit_success (触板后封住),
+                        is_one_word (一字板), limit_amount (当日成交额，代替封单额)
+   analysis_limit_down: is_limit_down, limit_down_seq, limit_down_price, is_one_word,
+                        limit_down_amount (当日成交额), open_times (撬板: 触及跌停后盘中打开记 1)
+"""
+
+import os
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from pymongo import UpdateOne, ASCENDING, DESCENDING
+from tqdm import tqdm
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+from utils.stage_profiler import StageProfiler
+from utils import limit_rules
+from utils.mongo_loader import load_frame
+from utils.mongo_client import get_client
+
+PROF = StageProfiler(__file__)
+
+# --- 配置 ---
+DB_NAME = "vnpy_stock"
+START_DATE = datetime(1996, 12, 16)
+FORCE_FULL = False
+SEED_DAYS = 20          # 增量时向前回溯的交易日数 (前收盘 / 复权因子 / 连板接续)
+SYMBOL_BATCH = 1000     # 全量时每批股票数 (连板只沿时间轴计算，按股票分批不影响结果)
+WRITE_BATCH = 5000
+PRICE_EPS = 0.001       # 价格精确到分，比较时留 0.1 分容差
+
+COL_UP = "analysis_limit_up"
+COL_DOWN = "analysis_limit_down"
+COL_STATE = "analysis_limit_state"  # {_id: "last_session", date: 已处理到的交易日, updated_at}
+
+CLIENT = get_client()
+DB = CLIENT[DB_NAME]
+
+BAR_FIELDS = {"open": "open_price", "high": "high_price", "low": "low_price",
+              "close": "close_price", "volume": "volume", "amount": "turnover"}
+
+
+def ensure_indexes():
+    for col in (COL_UP, COL_DOWN):
+        DB[col].create_index([("symbol", ASCENDING), ("date", ASCENDING)], unique=True)
+        DB[col].create_index([("date", DESCENDING)])
+
+
+def watermark():
+    """
+    已处理到的交易日 (没有则为 None)。
+    两张表是稀疏事件表，最新事件日期不等于最后处理的交易日，因此单独记在 COL_STATE；
+    旧库尚无状态记录时退回事件表的最新日期 (只会偏早，多重算几天)。
+    """
+    state = DB[COL_STATE].find_one({"_id": "last_session"})
+    if state:
+        return state["date"]
+    latest = [d["date"] for col in (COL_UP, COL_DOWN)
+              for d in DB[col].find({}, {"date": 1}).sort("date", DESCENDING).limit(1)]
+    return max(latest) if latest else None
+
+
+def save_watermark(session):
+    DB[COL_STATE].update_one({"_id": "last_session"},
+                             {"$set": {"date": session, "updated_at": datetime.now()}}, upsert=True)
+
+
+def window_start(mark):
+    """水位线之前第 SEED_DAYS 个交易日"""
+    if SEED_DAYS <= 0:
+        return mark
+    docs = list(CLIENT["vnpy_master"]["trading_calendar"].find(
+        {"exchange": "SSE", "date": {"$lte": mark.strftime("%Y-%m-%d")}}, {"date": 1}
+    ).sort("date", DESCENDING).limit(SEED_DAYS + 1))
+    if len(docs) == SEED_DAYS + 1:
+        return datetime.strptime(docs[-1]["date"], "%Y-%m-%d")
+    return mark - pd.Timedelta(days=int(SEED_DAYS * 1.5) + 10)
+
+
+# =========================================================================
+# 加载
+# =========================================================================
+def _pivot(df, date_field, value):
+    return df.pivot(index=date_field, columns="symbol", values=value).sort_index()
+
+
+def load_panels(symbols, start):
+    q = {"symbol": {"$in": symbols}, "datetime": {"$gte": start}}
+    fields = {"symbol": "str", "datetime": "datetime", **{f: "float" for f in BAR_FIELDS.values()}}
+    bars = load_frame(DB["bar_daily"], q, fields)
+    if bars.empty:
+        return None
+    bars = bars.drop_duplicates(["symbol", "datetime"], keep="last")
+    p = {k: _pivot(bars, "datetime", f) for k, f in BAR_FIELDS.items() if f in bars.columns}
+    index, columns = p["close"].index, p["close"].columns
+
+    adj = pd.DataFrame(list(DB["adjust_factor"].find(
+        {"symbol": {"$in": symbols}}, {"_id": 0, "symbol": 1, "date": 1, "factor": 1})))
+    if adj.empty:
+        p["adj"] = pd.DataFrame(1.0, index=index, columns=columns)
+    else:
+        adj = adj.assign(date=pd.to_datetime(adj["date"])).drop_duplicates(["symbol", "date"], keep="last")
+        adj = _pivot(adj, "date", "factor")
+        p["adj"] = adj.reindex(index.union(adj.index)).ffill().reindex(index=index, columns=columns).fillna(1.0)
+    _carry_last_close(p, start, adj)
+
+    status = DB["stock_status_history"].find(
+        {"symbol": {"$in": symbols}, "st_history": {"$exists": True}}, {"_id": 0, "symbol": 1, "st_history": 1})
+    p["st"] = limit_rules.st_mask(status, index, columns)
+
+    listed = {d["symbol"]: d.get("list_date") for d in DB["stock_info"].find(
+        {"symbol": {"$in": symbols}}, {"_id": 0, "symbol": 1, "list_date": 1})}
+    p["ipo_free"] = limit_rules.ipo_free_mask(index, columns, listed)
+    return p
+
+
+def _carry_last_close(p, start, factors):
+    """
+    面板首行本身不参与计算 (没有前收盘)。首行停牌的股票把 start 之前最后一个成交日的收盘价 / 复权因子
+    填到首行，停牌跨过窗口起点时复牌日才有前收盘，不会被整天漏掉。
+    """
+    first = p["close"].iloc[0]
+    idle = first.index[~(first.notna() & (p["volume"].iloc[0] > 0))]
+    if idle.empty:
+        return
+    pipeline = [
+        {"$match": {"symbol": {"$in": list(idle)}, "datetime": {"$lt": start}, "volume": {"$gt": 0}}},
+        {"$sort": {"symbol": -1, "exchange": -1, "interval": -1, "datetime": -1}},
+        {"$group": {"_id": "$symbol", "datetime": {"$first": "$datetime"},
+                    "close": {"$first": "$close_price"}, "volume": {"$first": "$volume"}}},
+    ]
+    for d in DB["bar_daily"].aggregate(pipeline, allowDiskUse=True):
+        j = p["close"].columns.get_loc(d["_id"])
+        p["close"].iat[0, j], p["volume"].iat[0, j] = d["close"], d["volume"]
+        if isinstance(factors, pd.DataFrame) and d["_id"] in factors.columns:
+            f = factors[d["_id"]].loc[:d["datetime"]].dropna()
+            p["adj"].iat[0, j] = f.iloc[-1] if len(f) else 1.0
+
+
+def load_seed(col, seq_field, symbols, first_day):
+    """
+    窗口首日没有前收盘、不参与计算，每只股票截至首日的连板数即为窗口内连板的接续基数。
+    事件表是稀疏的: 取首日及之前最近一条记录 (按 (symbol, date) 索引倒序 $group $first)；
+    记录早于首日时，其后到首日之间有过成交 (且没有触板记录) 说明连板已断，只有一直停牌才接续。
+    """
+    pipeline = [
+        {"$match": {"symbol": {"$in": symbols}, "date": {"$lte": first_day}}},
+        {"$sort": {"symbol": -1, "date": -1}},
+        {"$group": {"_id": "$symbol", "date": {"$first": "$date"}, "seq": {"$first": f"${seq_field}"}}},
+    ]
+    last = {d["_id"]: d for d in DB[col].aggregate(pipeline, allowDiskUse=True) if (d["seq"] or 0) >= 1}
+    gaps = [{"symbol": s, "datetime": {"$gt": d["date"], "$lte": first_day}}
+            for s, d in last.items() if d["date"] < first_day]
+    broken = set(DB["bar_daily"].distinct("symbol", {"$or": gaps, "volume": {"$gt": 0}})) if gaps else set()
+    return pd.Series({s: d["seq"] for s, d in last.items() if s not in broken}, dtype=float)
+
+
+# =========================================================================
+# 计算
+# =========================================================================
+def compute(p, seed_up=None, seed_down=None):
+    """返回 (up_df, down_df)，均为 long 格式且只包含触板的行"""
+    close, high, low, open_ = p["close"], p["high"], p["low"], p["open"]
+    traded = close.notna() & (p["volume"] > 0)
+
+    up_price, down_price, valid = limit_rules.reference_limits(
+        close, p["adj"], traded, st=p["st"], ipo_free=p["ipo_free"])
+
+    at_up = (close >= up_price - PRICE_EPS) & valid
+    at_down = (close <= down_price + PRICE_EPS) & valid
+    touch_up = (high >= up_price - PRICE_EPS) & valid
+    touch_down = (low <= down_price + PRICE_EPS) & valid
+    flat = (high - low).abs() < PRICE_EPS
+
+    seq_up = limit_rules.streak(at_up.astype(float).where(valid), seed_up)
+    seq_down = limit_rules.streak(at_down.astype(float).where(valid), seed_down)
+
+    up = _long(touch_up, {
+        "is_limit_up": at_up, "limit_seq": seq_up.fillna(0), "limit_price": up_price,
+        "limit_success": at_up, "is_one_word": at_up & flat & (open_ >= up_price - PRICE_EPS),
+        "limit_amount": p.get("amount", pd.DataFrame(np.nan, index=close.index, columns=close.columns)),
+    })
+    # 撬板: 触及跌停后收盘打开，或收盘封住但盘中曾高于跌停价
+    pried = (touch_down & ~at_down) | (at_down & (high > down_price + PRICE_EPS))
+    down = _long(touch_down, {
+        "is_limit_down": at_down, "limit_down_seq": seq_down.fillna(0), "limit_down_price": down_price,
+        "is_one_word": at_down & flat & (open_ <= down_price + PRICE_EPS),
+        "limit_down_amount": p.get("amount", pd.DataFrame(np.nan, index=close.index, columns=close.columns)),
+        "open_times": pried.astype(int),
+    })
+    return up, down
+
+
+def _long(mask, fields):
+    rows = np.nonzero(mask.to_numpy())
+    out = pd.DataFrame({"date": mask.index[rows[0]], "symbol": mask.columns[rows[1]]})
+    for name, panel in fields.items():
+        out[name] = panel.to_numpy()[rows]
+    return out
+
+
+def write(col, df, after):
+    if after is not None:
+        df = df[df["date"] > after]
+    ops = []
+    for rec in df.to_dict("records"):
+        key = {"symbol": rec.pop("symbol"), "date": rec.pop("date").to_pydatetime()}
+        doc = {k: (bool(v) if isinstance(v, (bool, np.bool_)) else
+                   int(v) if k.endswith(("seq", "times")) else
+                   None if pd.isna(v) else round(float(v), 4)) for k, v in rec.items()}
+        doc["updated_at"] = datetime.now()
+        ops.append(UpdateOne(key, {"$set": doc}, upsert=True))
+    for i in range(0, len(ops), WRITE_BATCH):
+        DB[col].bulk_write(ops[i:i + WRITE_BATCH], ordered=False)
+    return len(ops)
+
+
+# =========================================================================
+# 主流程
+# =========================================================================
+def run():
+    ensure_indexes()
+    mark = None if FORCE_FULL else watermark()
+    start = START_DATE if mark is None else window_start(mark)
+    print(f"🚀 启动 [涨跌停分析] ({'全量' if mark is None else f'增量, 水位 {mark:%Y-%m-%d}'}) 加载起点 {start:%Y-%m-%d}")
+
+    with PROF.stage("plan"):
+        symbols = sorted(DB["bar_daily"].distinct("symbol", {"datetime": {"$gte": start}}))
+        batch_size = SYMBOL_BATCH if mark is None else max(len(symbols), 1)
+    print(f"📋 股票 {len(symbols)} 只 | 每批 {batch_size}")
+
+    t0 = time.time()
+    n_up = n_down = 0
+    session = None
+    for i in tqdm(range(0, len(symbols), batch_size), desc="Batch"):
+        batch = symbols[i:i + batch_size]
+        with PROF.stage("load"):
+            p = load_panels(batch, start)
+        if p is None:
+            continue
+        with PROF.stage("compute"):
+            first_day = p["close"].index[0].to_pydatetime()
+            seed_up = load_seed(COL_UP, "limit_seq", batch, first_day) if mark is not None else None
+            seed_down = load_seed(COL_DOWN, "limit_down_seq", batch, first_day) if mark is not None else None
+            up, down = compute(p, seed_up, seed_down)
+        with PROF.stage("write"):
+            rows = (write(COL_UP, up, mark), write(COL_DOWN, down, mark))
+            PROF.add_rows(sum(rows))
+        n_up, n_down = n_up + rows[0], n_down + rows[1]
+        session = max(session or first_day, p["close"].index[-1].to_pydatetime())
+
+    # 全部批次写完才推进水位，中途失败下次从原水位重跑
+    if session is not None and (mark is None or session > mark):
+        save_watermark(session)
+    print(f"\n✨ 完成: 涨停/触板 {n_up:,} 条, 跌停/触板 {n_down:,} 条 | 耗时 {time.time() - t0:.1f}s")
+
+
+if __name__ == "__main__":
+    with PROF:
+        run()
@@ -0,0 +1,153 @@
+"""
+Script 20: Tradability Mask Panels (可交易性掩码面板)
+------------------------------------------------------
+目标: 把分散在 stock_info / stock_status_history (suspensions 区间、st_history 事件) / bar_daily 中的状态
+     物化为 日期 × 股票 的 uint8 位图 (utils/mask_store.py)，供回测与因子中性化直接做数组过滤。
+依赖: 09 (trading_calendar)、02 (bar_daily)、03 (adjust_factor)、13 (st_history)、14_fuse (suspensions)。
+
+逻辑:
+1. 位定义: LISTED / SUSPENDED / ST / LIMIT_UP / LIMIT_DOWN / IPO_FREE。
+2. LISTED: list_date <= 日期 < delisted_date (缺失时用首根 K 线推断)。
+   SUSPENDED: 14_fuse 的停牌区间 ∪ 上市期间当日无成交 (覆盖 14 尚未处理的最新交易日)。
+   LIMIT_UP / LIMIT_DOWN: 收盘封板 (与 19 相同的涨跌停价规则)。
+3. 增量: 只计算 last_date 之后的交易日并追加到文件尾；另外重算最近 REWRITE_DAYS 天并原地覆盖，
+   吸收停牌 / ST 数据的迟到修正。全量时按 CHUNK_DAYS 分段计算以控制内存。
+"""
+
+import os
+import shutil
+import sys
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+from utils.stage_profiler import StageProfiler
+from utils import mask_store, portfolio_backtest
+from utils.mongo_client import get_client
+
+PROF = StageProfiler(__file__)
+
+# --- 配置 ---
+START_DATE = datetime(2005, 1, 1)
+FORCE_FULL = False
+REWRITE_DAYS = 5        # 增量时重算并覆盖的最近交易日数
+SEED_DAYS = 5           # 每段向前多取的交易日 (前收盘)
+CHUNK_DAYS = 500        # 全量构建时每段交易日数
+PRICE_EPS = 0.001
+MASK_DIR = mask_store.MASK_DIR
+
+CLIENT = get_client()
+DB = CLIENT["vnpy_stock"]
+DB_MASTER = CLIENT["vnpy_master"]
+
+
+def load_calendar():
+    docs = DB_MASTER["trading_calendar"].find({"exchange": "SSE"}, {"_id": 0, "date": 1})
+    cal = pd.DatetimeIndex(sorted({pd.Timestamp(d["date"]) for d in docs}))
+    last_bar = DB["bar_daily"].find_one({}, {"datetime": 1}, sort=[("datetime", -1)])
+    if last_bar is None:
+        return cal[:0]
+    # 只物化已有行情的交易日，避免把未来日期当成全市场停牌
+    return cal[(cal >= pd.Timestamp(START_DATE)) & (cal <= pd.Timestamp(last_bar["datetime"]))]
+
+
+def load_static():
+    """上市区间与停牌区间 (全量读取一次，各段复用)"""
+    info = {d["symbol"]: d for d in DB["stock_info"].find(
+        {}, {"_id": 0, "symbol": 1, "list_date": 1, "delisted_date": 1})}
+    suspensions = {d["symbol"]: d["suspensions"] for d in DB["stock_status_history"].find(
+        {"suspensions": {"$exists": True}}, {"_id": 0, "symbol": 1, "suspensions": 1})}
+    return info, suspensions
+
+
+def _interval_mask(dates, columns, intervals):
+    """intervals: {symbol: [(start, end_inclusive), ...]} -> bool ndarray"""
+    mask = np.zeros((len(dates), len(columns)), dtype=bool)
+    for col, symbol in enumerate(columns):
+        for start, end in intervals.get(symbol, ()):
+            lo = dates.searchsorted(pd.Timestamp(start))
+            hi = dates.searchsorted(pd.Timestamp(end), side="right") if end is not None else len(dates)
+            mask[lo:hi, col] = True
+    return mask
+
+
+def compute_chunk(dates, info, suspensions, seed_start):
+    market = portfolio_backtest.load_market(DB, seed_start, dates[-1].to_pydatetime())
+    m = {k: v.reindex(index=dates) for k, v in market.items()}
+    columns = m["close"].columns.union(pd.Index(list(info))).sort_values()
+    m = {k: v.reindex(columns=columns) for k, v in m.items()}
+    traded = m["traded"].fillna(False).astype(bool)
+
+    # 上市区间: stock_info 优先，缺失时用该段内首末根 K 线
+    first_bar = traded.idxmax().where(traded.any())
+    listed_iv = {}
+    for s in columns:
+        doc = info.get(s, {})
+        start = pd.to_datetime(doc.get("list_date"), errors="coerce")
+        end = pd.to_datetime(doc.get("delisted_date"), errors="coerce")
+        if pd.isna(start):
+            start = first_bar.get(s)
+        if start is None or pd.isna(start):
+            continue
+        listed_iv[s] = [(start, None if pd.isna(end) else end - pd.Timedelta(days=1))]
+    listed = _interval_mask(dates, columns, listed_iv)
+
+    susp_iv = {s: [(iv["start"], iv["end"]) for iv in ivs if iv.get("start")] for s, ivs in suspensions.items()}
+    suspended = (_interval_mask(dates, columns, susp_iv) | ~traded.to_numpy()) & listed
+
+    valid = m["valid"].fillna(False).astype(bool)
+    close = m["close"]
+    flags = {
+        "listed": listed,
+        "suspended": suspended,
+        "st": m["st"].fillna(False).astype(bool) & listed,
+        "limit_up": valid & (close >= m["up"] - PRICE_EPS),
+        "limit_down": valid & (close <= m["down"] + PRICE_EPS),
+        "ipo_free": m["ipo_free"].fillna(False).astype(bool) & listed,
+    }
+    return mask_store.pack(flags, dates, columns)
+
+
+def run():
+    if FORCE_FULL:
+        shutil.rmtree(MASK_DIR, ignore_errors=True)
+    store = mask_store.MaskStore.open(MASK_DIR)
+    with PROF.stage("plan"):
+        cal = load_calendar()
+        if store.last_date is not None:
+            redo_from = store.dates[max(len(store.dates) - REWRITE_DAYS, 0)]
+            todo = cal[cal >= redo_from]
+        else:
+            todo = cal
+        info, suspensions = load_static()
+    if not len(todo):
+        print("✅ 掩码面板已是最新")
+        return
+    print(f"🚀 启动 [掩码面板] {todo[0]:%Y-%m-%d} ~ {todo[-1]:%Y-%m-%d} ({len(todo)} 个交易日) | "
+          f"已有 {len(store.dates)} 天 × {len(store.symbols)} 只")
+
+    t0 = time.time()
+    overwritten = appended = 0
+    for i in range(0, len(todo), CHUNK_DAYS):
+        dates = todo[i:i + CHUNK_DAYS]
+        pos = cal.searchsorted(dates[0])
+        seed_start = cal[max(pos - SEED_DAYS, 0)].to_pydatetime()
+        with PROF.stage("compute"):
+            frame = compute_chunk(dates, info, suspensions, seed_start)
+        with PROF.stage("write"):
+            o, a = store.write(frame)
+            PROF.add_rows(frame.size)
+        overwritten, appended = overwritten + o, appended + a
+        print(f"   ✅ {dates[0]:%Y-%m-%d} ~ {dates[-1]:%Y-%m-%d}: 覆盖 {o} 天, 追加 {a} 天")
+
+    size_mb = os.path.getsize(store.data_path) / 1024 / 1024
+    print(f"\n✨ 完成: 覆盖 {overwritten} 天, 追加 {appended} 天 | 共 {len(store.dates)} 天 × "
+          f"{len(store.symbols)} 只 ({size_mb:.1f} MB) | 耗时 {time.time() - t0:.1f}s")
+
+
+if __name__ == "__main__":
+    with PROF:
+        run()
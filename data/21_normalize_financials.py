@@ -0,0 +1,87 @@
+"""
+Script 21: Normalize Financial Statements (财报规范化快照)
+------------------------------------------------------
+目标: 把 06 下载的新浪三大报表 (中文宽表，字段类型混杂) 规范化为 finance_std 列式快照
+     (每只股票一个文档，规范英文字段 float64，见 utils/financial_schema.py)。
+依赖: 06 (finance_income / finance_balance / finance_cashflow)。
+下游: 08 估值、utils/financial_pit (18 成长因子)。
+
+逻辑:
+1. 06 每下载完一只股票会立即同步它的快照；本脚本负责首次回填与兜底。
+2. 增量: 对比原始三表每只股票的 (报告期数, 最新报告期) 与快照，只重建有新报告期、
+   快照缺失或 SCHEMA_VERSION 过旧的股票。FORCE_FULL=True 时全部重建 (同一报告期被原地修改时使用)。
+3. 按 SYMBOL_BATCH 分批读原始表，每批一次 unordered bulk upsert。
+"""
+
+import os
+import sys
+import time
+
+from pymongo import ASCENDING
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+from utils.stage_profiler import StageProfiler
+from utils import financial_schema as fs
+from utils.mongo_client import get_client
+
+PROF = StageProfiler(__file__)
+
+# --- 配置 ---
+FORCE_FULL = False
+SYMBOL_BATCH = 300
+
+CLIENT = get_client()
+DB = CLIENT["vnpy_stock"]
+
+
+def raw_signature():
+    """symbol -> (三表中最多的报告期数, 最新报告期)"""
+    sig = {}
+    for col in fs.SHEETS.values():
+        pipeline = [{"$group": {"_id": "$symbol", "n": {"$sum": 1}, "last": {"$max": "$report_date"}}}]
+        for d in DB[col].aggregate(pipeline, allowDiskUse=True):
+            n, last = sig.get(d["_id"], (0, None))
+            sig[d["_id"]] = (max(n, d["n"]), max(filter(None, [last, d["last"]]), default=None))
+    return sig
+
+
+def std_signature():
+    """symbol -> (快照报告期数, 最新报告期)，旧 SCHEMA_VERSION 的快照视为缺失"""
+    pipeline = [
+        {"$match": {"schema_version": fs.SCHEMA_VERSION}},
+        {"$project": {"symbol": 1, "n": {"$size": "$report_date"}, "last": {"$arrayElemAt": ["$report_date", -1]}}},
+    ]
+    return {d["symbol"]: (d["n"], d.get("last")) for d in DB[fs.COL_STD].aggregate(pipeline)}
+
+
+def run():
+    DB[fs.COL_STD].create_index([("symbol", ASCENDING)], unique=True)
+    with PROF.stage("plan"):
+        raw = raw_signature()
+        if FORCE_FULL:
+            todo = sorted(raw)
+        else:
+            std = std_signature()
+            todo = sorted(s for s, (n, last) in raw.items()
+                          if s not in std or n > std[s][0] or (last is not None and (std[s][1] is None or last > std[s][1])))
+    if not todo:
+        print("✅ finance_std 已是最新")
+        return
+    print(f"🚀 启动 [财报规范化] 待重建 {len(todo)} / {len(raw)} 只股票")
+
+    t0 = time.time()
+    written = 0
+    for i in range(0, len(todo), SYMBOL_BATCH):
+        batch = todo[i:i + SYMBOL_BATCH]
+        with PROF.stage("normalize"):
+            df = fs.normalize({k: DB[v] for k, v in fs.SHEETS.items()}, batch)
+            PROF.add_rows(len(df))
+        with PROF.stage("write"):
+            written += fs.write_docs(DB[fs.COL_STD], fs.to_docs(df))
+        print(f"   ✅ {min(i + SYMBOL_BATCH, len(todo))}/{len(todo)}")
+    print(f"\n✨ 完成: 写入 {written} 只股票的快照 | 耗时 {time.time() - t0:.1f}s")
+
+
+if __name__ == "__main__":
+    with PROF:
+        run()
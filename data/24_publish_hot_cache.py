@@ -0,0 +1,58 @@
+"""
+Script 24: Publish Hot Snapshot Cache (最新截面热缓存)
+------------------------------------------------------
+目标: 每日管道末尾把全市场最新状态发布到 Redis (docker-compose.yaml 的 redis 服务)，
+     选股器 / UI 通过 utils/hot_cache.HotCache 毫秒级读取当前截面，不再扫描 valuation_daily。
+依赖: 02 (bar_daily)、08 (valuation_daily)、13/14 (stock_status_history)、10 (industry_history)。
+
+内容 (每只股票一个 Hash，见 utils/hot_cache.py):
+1. 最新日线: 开高低收、成交量 / 额、换手率、流通股本、bar_date。
+2. 最新估值: PE / PB / PS / 股息率 / 市值 等、valuation_date。
+3. 状态: st (风险警示)、suspended (停牌区间或最新交易日无 K 线)。
+4. 行业: 申万行业名 (utils/sector_map)。
+
+Redis 不可用时只打印警告并正常退出 (读取端会回退到 Mongo)，不阻塞管道。
+"""
+
+import os
+import sys
+import time
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+from utils.stage_profiler import StageProfiler
+from utils import hot_cache
+from utils.mongo_client import get_client
+
+PROF = StageProfiler(__file__)
+
+# --- 配置 ---
+CLIENT = get_client()
+DB = CLIENT["vnpy_stock"]
+
+
+def run():
+    cache = hot_cache.HotCache(DB)
+    if not cache.available():
+        hint = "" if hot_cache.HAVE_REDIS else " (pip install redis)"
+        print(f"⚠️ Redis 不可用 ({cache.url}){hint}，跳过发布；读取端将回退到 Mongo")
+        return
+    print(f"🚀 启动 [热缓存发布] -> {cache.url}")
+
+    t0 = time.time()
+    with PROF.stage("build"):
+        frame = hot_cache.build_snapshot(DB)
+        PROF.add_rows(len(frame))
+    if frame.empty:
+        print("⚠️ 没有可发布的数据 (bar_daily / valuation_daily 为空)")
+        return
+    with PROF.stage("publish"):
+        n = cache.publish(frame)
+
+    meta = cache.meta()
+    print(f"   📊 截面日期 {meta.get('as_of')} | 停牌 {int(frame['suspended'].sum())} | ST {int(frame['st'].sum())}")
+    print(f"\n✨ 完成: 发布 {n} 只股票 | 耗时 {time.time() - t0:.1f}s")
+
+
+if __name__ == "__main__":
+    with PROF:
+        run()
@@ -0,0 +1,97 @@
+"""
+Script 25: Completeness Matrix Audit (数据完整性矩阵审计)
+------------------------------------------------------
+目标: 用 交易日 × 股票 覆盖位图 (utils/completeness) 一次性审计 bar_daily / adjust_factor / valuation_daily /
+     share_capital，取代 audit_delisted_completeness / verify_* / clean_empty_stocks 中逐只 find_one 的检查。
+依赖: 09 (trading_calendar)、stock_info (上市 / 退市日)、14_fuse (停牌区间)、02 / 03 / 07 / 08 的产出。
+
+逻辑:
+1. 每批 BATCH_SYMBOLS 只股票，每个集合一次按 (symbol, 日期) 排序扫描，落位到 uint8 位图。
+2. 与交易日历、上市区间、停牌区间求交，得到每只股票每个来源的连续缺失区间。
+3. 缺口写入 repair_worklist (保留已领取次数)，次日由下载器按区间精确补数:
+     02 日线按区间补下载 / 03 因子本地重算 / 08 估值从缺口起点回溯重算。
+   share_capital 缺口只报告: 07 每次本就全量刷新所有股票。
+4. 汇总打印，并导出 data/logs/completeness_gaps.csv。
+"""
+
+import os
+import sys
+import time
+from datetime import datetime
+
+import pandas as pd
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+from utils.stage_profiler import StageProfiler
+from utils import completeness
+from utils.mongo_client import get_client
+
+PROF = StageProfiler(__file__)
+
+# --- 配置 ---
+START_DATE = datetime(2005, 1, 1)  # 与 02 的 START_DATE 一致
+BATCH_SYMBOLS = 500
+REPORT_CSV = os.path.join(os.path.abspath(os.path.dirname(__file__)), "logs", "completeness_gaps.csv")
+
+CLIENT = get_client()
+DB = CLIENT["vnpy_stock"]
+DB_MASTER = CLIENT["vnpy_master"]
+
+
+def load_static():
+    """股票列表、上市区间与停牌区间 (全量读取一次，各批复用)"""
+    info = {d["symbol"]: d for d in DB["stock_info"].find(
+        {"category": {"$in": ["STOCK_A", "STOCK_BJ"]}}, {"_id": 0, "symbol": 1, "list_date": 1, "delisted_date": 1})}
+    suspensions = {d["symbol"]: d["suspensions"] for d in DB["stock_status_history"].find(
+        {"suspensions": {"$exists": True}}, {"_id": 0, "symbol": 1, "suspensions": 1})}
+    return info, suspensions
+
+
+def run():
+    with PROF.stage("plan"):
+        last_bar = DB["bar_daily"].find_one({}, {"datetime": 1}, sort=[("datetime", -1)])
+        if last_bar is None:
+            print("⚠️ bar_daily 为空，无从审计")
+            return
+        dates = completeness.load_calendar(DB_MASTER, START_DATE, last_bar["datetime"])
+        info, suspensions = load_static()
+        symbols = sorted(info)
+    if not len(dates) or not symbols:
+        print("⚠️ 交易日历或股票列表为空，请先运行 09 / 02")
+        return
+    print(f"🚀 启动 [完整性审计] {dates[0]:%Y-%m-%d} ~ {dates[-1]:%Y-%m-%d} ({len(dates)} 个交易日) × {len(symbols)} 只")
+
+    t0 = time.time()
+    DB[completeness.COL_WORKLIST].create_index([("source", 1), ("attempts", 1)])
+    DB[completeness.COL_WORKLIST].create_index([("symbol", 1)])
+    parts, written = [], 0
+    for i in range(0, len(symbols), BATCH_SYMBOLS):
+        batch = symbols[i:i + BATCH_SYMBOLS]
+        with PROF.stage("scan"):
+            frame = completeness.build_matrix(DB, batch, dates, info, suspensions)
+            PROF.add_rows(frame.size)
+        with PROF.stage("runs"):
+            gaps = completeness.find_gaps(frame)
+        with PROF.stage("write"):
+            written += completeness.save_worklist(DB, gaps, batch)
+        parts.append(gaps)
+        print(f"   ✅ {i + len(batch)}/{len(symbols)}: 缺口 {len(gaps)} 段")
+
+    gaps = pd.concat(parts, ignore_index=True)
+    if gaps.empty:
+        print(f"\n✨ 数据完整，无缺口 | 耗时 {time.time() - t0:.1f}s")
+        return
+
+    summary = gaps.groupby("source").agg(symbols=("symbol", "nunique"), runs=("symbol", "size"),
+                                         missing_days=("days", "sum"), longest=("days", "max"))
+    print("\n📊 缺口汇总:")
+    print(summary.to_string())
+    os.makedirs(os.path.dirname(REPORT_CSV), exist_ok=True)
+    gaps.sort_values(["source", "symbol", "start"]).to_csv(REPORT_CSV, index=False, encoding="utf-8-sig")
+    print(f"\n📝 明细: {REPORT_CSV}")
+    print(f"✨ 完成: 工作清单 {written} 段 | 耗时 {time.time() - t0:.1f}s")
+
+
+if __name__ == "__main__":
+    with PROF:
+        run()
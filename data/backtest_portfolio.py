@@ -0,0 +1,110 @@
+"""
+Script: Cross-Sectional Portfolio Backtest (A 股组合回测)
+------------------------------------------------------
+目标: 用 vnpy_stock 全套数据 (行情 / 复权 / 停牌 / ST / 涨跌停 / 指数成分) 与 vnpy_factor 因子，
+     回测日频截面选股组合。引擎见 utils/portfolio_backtest.py。
+
+示例策略:
+1. 股票池: UNIVERSE 指数的历史成分 (PIT，utils/pit_membership.py)，剔除 ST 与当日停牌股。
+2. 信号: factor_master 中的 FACTOR，每个调仓日取因子值最高的 TOP_QUANTILE，等权。
+3. 调仓: 每月最后一个交易日收盘出信号，下一交易日按 EXEC_AT 成交 (T+1)。
+4. 归因: 按申万一级行业 (utils/sector_map.py) 汇总收益贡献。
+"""
+
+import os
+import sys
+import time
+from datetime import datetime
+
+import pandas as pd
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+from utils.stage_profiler import StageProfiler
+from utils import factor_engine as fe
+from utils import pit_membership, sector_map
+from utils import portfolio_backtest as pb
+from utils.mongo_client import get_client
+
+PROF = StageProfiler(__file__)
+
+# --- 配置 ---
+START_DATE = datetime(2010, 1, 1)
+END_DATE = None
+UNIVERSE = "sh000300"       # None = 全市场
+FACTOR = "mom_12m"
+TOP_QUANTILE = 0.1
+REBALANCE = "M"             # 调仓频率: M 月 / W 周 / D 日
+EXEC_AT = "close"           # open / close
+CAPITAL = 1e8
+
+CLIENT = get_client()
+DB_STOCK = CLIENT["vnpy_stock"]
+DB_FACTOR = CLIENT[fe.FACTOR_DB]
+
+
+def load_factor(name, index, columns):
+    col = fe.REGISTRY[name].collection
+    q = {"date": {"$gte": index[0], "$lte": index[-1]}, name: {"$exists": True}}
+    df = pd.DataFrame(list(DB_FACTOR[col].find(q, {"_id": 0, "symbol": 1, "date": 1, name: 1})))
+    if df.empty:
+        raise ValueError(f"{fe.FACTOR_DB}.{col} 中没有 {name}，请先运行 18_calculate_factors.py")
+    return df.pivot(index="date", columns="symbol", values=name).reindex(index=index, columns=columns)
+
+
+def load_universe(index, columns):
+    if UNIVERSE is None:
+        return pd.DataFrame(True, index=index, columns=columns)
+    mi = pit_membership.MembershipIndex.load(DB_STOCK, [UNIVERSE])
+    uni = mi.universe(UNIVERSE, index)
+    uni.columns = [str(c).split(".")[0] for c in uni.columns]
+    return uni.T.groupby(level=0).any().T.reindex(columns=columns, fill_value=False)
+
+
+def rebalance_days(index):
+    if REBALANCE == "D":
+        return index
+    s = pd.Series(index, index=index)
+    return pd.DatetimeIndex(s.groupby(index.to_period(REBALANCE)).max().values)
+
+
+def build_target(market, factor, universe):
+    """每个调仓日: 池内、非 ST、当日有成交、因子有效的股票中取前 TOP_QUANTILE 等权"""
+    eligible = universe & ~market["st"] & market["traded"] & factor.notna()
+    score = factor.where(eligible)
+    rank = score.rank(axis=1, ascending=False, pct=True)
+    picks = (rank <= TOP_QUANTILE).astype(float)
+    weights = picks.div(picks.sum(axis=1).replace(0, float("nan")), axis=0).fillna(0.0)
+    target = pd.DataFrame(float("nan"), index=market["close"].index, columns=market["close"].columns)
+    days = rebalance_days(target.index)
+    target.loc[days] = weights.loc[days]
+    return target
+
+
+def run():
+    print(f"🚀 启动 [组合回测] 因子 {FACTOR} | 股票池 {UNIVERSE or '全市场'} | 调仓 {REBALANCE} | 成交 {EXEC_AT}")
+    with PROF.stage("load_market"):
+        market = pb.load_market(DB_STOCK, START_DATE, END_DATE)
+    index, columns = market["close"].index, market["close"].columns
+    print(f"📊 面板: {len(index)} 个交易日 × {len(columns)} 只股票")
+
+    with PROF.stage("signal"):
+        factor = load_factor(FACTOR, index, columns)
+        target = build_target(market, factor, load_universe(index, columns))
+        snap = sector_map.load_or_build(DB_STOCK).snapshot(symbols=columns)
+        industry = snap["level1_name"].astype(object).fillna(snap["industry_name"])
+
+    with PROF.stage("backtest"):
+        t0 = time.time()
+        bt = pb.PortfolioBacktester(market, exec_at=EXEC_AT, capital=CAPITAL)
+        result = bt.run(target, groups=industry)
+        elapsed = time.time() - t0
+    PROF.add_rows(len(index) * len(columns))
+
+    print(f"\n--- 📊 回测结果 ({index[0]:%Y-%m-%d} ~ {index[-1]:%Y-%m-%d}, 引擎耗时 {elapsed:.2f}s) ---")
+    print(pb.format_report(result))
+    return result
+
+
+if __name__ == "__main__":
+    with PROF:
+        run()
@@ -0,0 +1,281 @@
+"""
+Tool: Pipeline Benchmark Suite (离线基准测试)
+---------------------------------------------
+目标: 在不联网的情况下，度量数据管道核心计算的吞吐与内存，用于评估每一次性能改动。
+
+流程:
+1. [Generate] 用 utils/synthetic_data 按 SCALES 生成 N 只股票 × M 年的合成数据 (固定种子，可复现)。
+2. [Load]     灌入 本地 mongod (BACKEND="mongod", 使用独立的 bench_ 前缀库) 或内存替身 (BACKEND="mongomock")。
+3. [Run]      依次运行 BENCHMARKS 中登记的计算 (估值 08 / TTM / 分红滚动 / 估值重写比对 / 停牌融合 14 /
+              代码编码 + 面板透视)。
+4. [Report]   记录 耗时、吞吐 (行/秒)、峰值内存 (tracemalloc)，写入 data/logs/bench/，并与上一次结果对比。
+
+注意: 脚本模块的 COL_* 全局变量会被重新绑定到基准库，不会触碰生产库。
+"""
+
+import gc
+import importlib.util
+import json
+import os
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+import pandas as pd
+from pymongo import MongoClient, ASCENDING
+from tabulate import tabulate
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+from utils.synthetic_data import generate, load_into, count_rows
+from utils import financial_schema, symbol_master
+from utils.hashed_upsert import HashedUpsert
+
+# --- 配置 ---
+BACKEND = "mongomock"          # "mongod" | "mongomock"
+MONGO_HOST = "localhost"
+MONGO_PORT = 27017
+DB_PREFIX = "bench_"           # mongod 模式下的库名前缀，避免覆盖生产数据
+
+SCALES = [(20, 2), (100, 5), (300, 10)]   # (股票数, 年数)
+SEED = 42
+MEASURE_MEMORY = True          # 额外跑一轮 tracemalloc 统计峰值内存 (会变慢，单独计时)
+ONLY = None                    # 只跑指定基准, 如 ["valuation"]
+
+DATA_DIR = os.path.abspath(os.path.dirname(__file__))
+RESULT_DIR = os.path.join(DATA_DIR, "logs", "bench")
+
+BENCH_INDEXES = {
+    "bar_daily": [("symbol", ASCENDING), ("exchange", ASCENDING), ("interval", ASCENDING), ("datetime", ASCENDING)],
+    "share_capital": [("symbol", ASCENDING), ("date", ASCENDING)],
+    "finance_income": [("symbol", ASCENDING), ("report_date", ASCENDING)],
+    "finance_balance": [("symbol", ASCENDING), ("report_date", ASCENDING)],
+    "finance_dividend": [("symbol", ASCENDING), ("ex_date", ASCENDING)],
+    "valuation_daily": [("symbol", ASCENDING), ("date", ASCENDING)],
+    "industry_history": [("symbol", ASCENDING), ("date", ASCENDING)],
+    "stock_status_history": [("symbol", ASCENDING)],
+}
+
+
+def load_script(filename):
+    """按文件名导入数字开头的脚本模块 (如 08_calculate_valuation_daily.py)"""
+    path = os.path.join(DATA_DIR, filename)
+    name = "bench_" + os.path.splitext(filename)[0]
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def get_client():
+    if BACKEND == "mongomock":
+        try:
+            import mongomock
+        except ImportError:
+            raise RuntimeError("BACKEND='mongomock' 需要安装 mongomock (pip install mongomock)")
+        _patch_mongomock_bulk(mongomock)
+        return mongomock.MongoClient()
+    return MongoClient(MONGO_HOST, MONGO_PORT)
+
+
+def _patch_mongomock_bulk(mongomock):
+    """pymongo>=4.9 的 UpdateOne 会向 bulk builder 传 sort 参数，旧版 mongomock 不认识，这里丢弃它"""
+    builder = mongomock.collection.BulkOperationBuilder
+    for name in ("add_update", "add_replace"):
+        original = getattr(builder, name)
+        if getattr(original, "_drop_sort", False):
+            continue
+
+        def wrapper(self, *args, _original=original, sort=None, **kwargs):
+            return _original(self, *args, **kwargs)
+
+        wrapper._drop_sort = True
+        setattr(builder, name, wrapper)
+
+
+def prepare(client, n_symbols, n_years):
+    dataset = generate(n_symbols, n_years, seed=SEED)
+    prefix = DB_PREFIX if BACKEND == "mongod" else ""
+    dbs = load_into(client, dataset, db_prefix=prefix)
+    for col, keys in BENCH_INDEXES.items():
+        dbs["vnpy_stock"][col].create_index(keys)
+    return dataset, dbs
+
+
+# =========================================================================
+# 基准注册表: name -> (setup(dataset, dbs) -> ctx, run(ctx) -> 处理行数)
+# =========================================================================
+def setup_valuation(dataset, dbs):
+    m = load_script("08_calculate_valuation_daily.py")
+    db = dbs["vnpy_stock"]
+    m.COL_INFO, m.COL_BARS, m.COL_CAPITAL = db["stock_info"], db["bar_daily"], db["share_capital"]
+    m.COL_INCOME, m.COL_BALANCE, m.COL_DIVIDEND = db["finance_income"], db["finance_balance"], db["finance_dividend"]
+    m.COL_VALUATION, m.COL_INDUSTRY = db["valuation_daily"], db["industry_history"]
+    m.COL_FIN_STD = db[financial_schema.COL_STD]
+    financial_schema.sync(db)  # 财报快照在 21 中生成，不计入估值耗时
+    m.FORCE_UPDATE = True
+    symbols = [d["symbol"] for d in dataset["vnpy_stock"]["stock_info"]]
+    return {"m": m, "symbols": symbols}
+
+
+def run_valuation(ctx):
+    rows = 0
+    for symbol in ctx["symbols"]:
+        rows += len(ctx["m"].calculate_one_stock(symbol, "", "Unknown"))
+    return rows
+
+
+def setup_ttm(dataset, dbs):
+    m = setup_valuation(dataset, dbs)["m"]
+    # 预先取出财报，基准只衡量 TTM 计算本身
+    frames = [m.get_clean_financial_data(s) for s in {d["symbol"] for d in dataset["vnpy_stock"]["finance_income"]}]
+    return {"m": m, "frames": [f for f in frames if not f.empty]}
+
+
+def run_ttm(ctx):
+    return sum(len(ctx["m"].calculate_financial_time_series(f)) for f in ctx["frames"])
+
+
+def setup_dividend(dataset, dbs):
+    m = setup_valuation(dataset, dbs)["m"]
+    days = pd.DataFrame(dataset["vnpy_stock"]["bar_daily"], columns=["symbol", "datetime"])
+    days = {s: pd.DatetimeIndex(g["datetime"]).sort_values() for s, g in days.groupby("symbol")}
+    frames = [(m.get_dividend_data(s), days.get(s, pd.DatetimeIndex([])))
+              for s in {d["symbol"] for d in dataset["vnpy_stock"]["finance_dividend"]}]
+    return {"m": m, "frames": [(f, d) for f, d in frames if not f.empty]}
+
+
+def run_dividend(ctx):
+    return sum(len(ctx["m"].calculate_dividend_ttm(f, d)) for f, d in ctx["frames"])
+
+
+def setup_rewrite(dataset, dbs):
+    ctx = setup_valuation(dataset, dbs)
+    docs = [d for s in ctx["symbols"] for d in ctx["m"].calculate_one_stock(s, "", "Unknown")]
+    col = dbs["vnpy_stock"]["valuation_daily"]
+    col.delete_many({})
+    HashedUpsert(col, keys=("symbol", "date")).upsert(docs)
+    return {"col": col, "docs": docs}
+
+
+def run_rewrite(ctx):
+    # FORCE_UPDATE 重算后内容不变: 只比对摘要，不产生写入
+    stats = HashedUpsert(ctx["col"], keys=("symbol", "date")).upsert(ctx["docs"])
+    return stats["unchanged"]
+
+
+def setup_suspension(dataset, dbs):
+    m = load_script("14_fuse_suspensions.py")
+    db = dbs["vnpy_stock"]
+    return {"m": m, "db": db, "cal": m.load_master_calendar(db), "em": m.load_em_annotations(db),
+            "rows": db["bar_daily"].estimated_document_count()}
+
+
+def run_suspension(ctx):
+    ctx["db"]["stock_status_history"].delete_many({})
+    ctx["m"].fuse_data(ctx["db"], ctx["cal"], ctx["em"])
+    return ctx["rows"]
+
+
+def setup_symbol_panel(dataset, dbs):
+    return {"bars": pd.DataFrame(dataset["vnpy_stock"]["bar_daily"], columns=["symbol", "datetime", "close_price"])}
+
+
+def run_symbol_panel(ctx):
+    # 纯代码 -> VtSymbol -> 纯代码 的逐行格式转换，再透视为 日期 × 股票 面板
+    bars = ctx["bars"]
+    codes = symbol_master.to_code(symbol_master.to_vt(bars["symbol"]))
+    panel = symbol_master.dense_pivot(bars.assign(symbol=codes), "datetime", "symbol", "close_price")
+    return int(panel.notna().to_numpy().sum())
+
+
+BENCHMARKS = {
+    "valuation": (setup_valuation, run_valuation),
+    "ttm": (setup_ttm, run_ttm),
+    "dividend_rolling": (setup_dividend, run_dividend),
+    "valuation_rewrite": (setup_rewrite, run_rewrite),
+    "suspension_fusion": (setup_suspension, run_suspension),
+    "symbol_panel": (setup_symbol_panel, run_symbol_panel),
+}
+
+
+# =========================================================================
+# 执行与报告
+# =========================================================================
+def measure(setup, runner, dataset, dbs):
+    ctx = setup(dataset, dbs)
+    gc.collect()
+    t0 = time.perf_counter()
+    rows = runner(ctx)
+    elapsed = time.perf_counter() - t0
+
+    peak_mb = None
+    if MEASURE_MEMORY:
+        ctx = setup(dataset, dbs)
+        gc.collect()
+        tracemalloc.start()
+        runner(ctx)
+        peak_mb = tracemalloc.get_traced_memory()[1] / 1024 / 1024
+        tracemalloc.stop()
+    return rows, elapsed, peak_mb
+
+
+def load_previous():
+    if not os.path.isdir(RESULT_DIR):
+        return {}
+    files = sorted(f for f in os.listdir(RESULT_DIR) if f.endswith(".json"))
+    if not files:
+        return {}
+    with open(os.path.join(RESULT_DIR, files[-1]), encoding="utf-8") as f:
+        prev = json.load(f)
+    return {(r["benchmark"], r["symbols"], r["years"]): r for r in prev["results"]}
+
+
+def run():
+    print(f"🚀 启动 [管道基准测试] (backend={BACKEND}, scales={SCALES})...")
+    client = get_client()
+    previous = load_previous()
+    results = []
+
+    for n_symbols, n_years in SCALES:
+        t0 = time.perf_counter()
+        dataset, dbs = prepare(client, n_symbols, n_years)
+        sizes = count_rows(dataset)
+        print(f"\n📦 规模 {n_symbols} 只 × {n_years} 年: {sizes['vnpy_stock.bar_daily']:,} 条日线 "
+              f"(生成+加载 {time.perf_counter() - t0:.1f}s)")
+
+        for name, (setup, runner) in BENCHMARKS.items():
+            if ONLY and name not in ONLY:
+                continue
+            try:
+                rows, elapsed, peak_mb = measure(setup, runner, dataset, dbs)
+            except Exception as e:
+                print(f"   ❌ {name}: {e}")
+                continue
+            prev = previous.get((name, n_symbols, n_years))
+            results.append({
+                "benchmark": name, "symbols": n_symbols, "years": n_years,
+                "bars": sizes["vnpy_stock.bar_daily"], "rows": rows,
+                "seconds": round(elapsed, 4), "rows_per_s": round(rows / elapsed, 1) if elapsed else None,
+                "peak_mb": round(peak_mb, 1) if peak_mb is not None else None,
+                "speedup": round(prev["seconds"] / elapsed, 2) if prev and elapsed else None,
+            })
+            print(f"   ✅ {name:<18} {elapsed:8.3f}s  {rows:>10,} rows")
+
+    print("\n" + "=" * 80)
+    print("📊 基准结果 (speedup = 上次耗时 / 本次耗时)")
+    print("=" * 80)
+    print(tabulate(pd.DataFrame(results), headers="keys", tablefmt="simple_grid", showindex=False))
+
+    os.makedirs(RESULT_DIR, exist_ok=True)
+    path = os.path.join(RESULT_DIR, datetime.now().strftime("%Y%m%d_%H%M%S") + ".json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({"backend": BACKEND, "seed": SEED, "results": results}, f, ensure_ascii=False, indent=2)
+    print(f"\n📝 结果已保存: {path}")
+
+
+if __name__ == "__main__":
+    run()
@@ -13,9 +13,14 @@ Script 21: Fix & Verify Stock Codes (Unified Standard)
   - 90xxxx -> .SH (沪B)
 """
 
+import os
+import sys
+
 from pymongo import MongoClient, UpdateOne
 from tqdm import tqdm
-import re
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+from utils import symbol_master
 
 # --- 配置 ---
 MONGO_HOST = "localhost"
@@ -28,29 +33,15 @@ db = client[DB_NAME]
 
 def get_suffix(code):
     """
-    更完善的代码后缀推断逻辑
+    单个代码补后缀 (规则见 utils/symbol_master.MARKET_RULES)；已有后缀或无法识别的保持原样
     """
-    code = str(code).strip()
-
-    # 如果已经有后缀，直接返回
-    if code.endswith((".SH", ".SZ", ".BJ")):
-        return code
-
-    # 纯数字判断
-    if not code.isdigit():
-        return code  # 可能是 weird string
+    return symbol_master.to_vt([code])[0]
 
-    # 规则匹配
-    if code.startswith(("6")):
-        return f"{code}.SH"
-    elif code.startswith(("0", "3", "20")):  # 20xxxx 是深B
-        return f"{code}.SZ"
-    elif code.startswith(("8", "4", "92")):  # 92xxxx 是北证新号段
-        return f"{code}.BJ"
-    elif code.startswith("90"):  # 90xxxx 是沪B
-        return f"{code}.SH"
 
-    return code  # 无法识别，保持原样
+def build_suffix_map(col):
+    """全部成分代码去重后一次向量化转换: {原代码: VtSymbol}"""
+    codes = [c for c in col.distinct("components") if isinstance(c, str)]
+    return dict(zip(codes, symbol_master.to_vt(codes)))
 
 
 def inspect_collection_format(col_name, sample_size=5):
@@ -81,6 +72,7 @@ def fix_index_components():
     col = db["index_components"]
     cursor = col.find({})
     total = col.count_documents({})
+    suffix_map = build_suffix_map(col)
 
     ops = []
     fixed_count = 0
@@ -95,7 +87,7 @@ def fix_index_components():
 
         # 1. 修复列表
         for code in components:
-            new_code = get_suffix(code)
+            new_code = suffix_map.get(code) or get_suffix(code)
             new_components.append(new_code)
             if new_code != code:
                 changed = True
@@ -103,7 +95,7 @@ def fix_index_components():
         # 2. 修复权重字典的 Key
         if weights:
             for k, v in weights.items():
-                new_k = get_suffix(k)
+                new_k = suffix_map.get(k) or get_suffix(k)
                 new_weights[new_k] = v
                 if new_k != k:
                     changed = True
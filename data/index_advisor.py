@@ -0,0 +1,361 @@
+"""
+Tool: Index Advisor & Query Profiler (索引顾问)
+-----------------------------------------------
+目标: 找出数据管道中没有命中索引前缀的热点查询，并给出补充索引建议。
+
+流程:
+1. [Profile] 对 PROFILE_DBS 开启 MongoDB Profiler (level 2)，然后运行目标脚本。
+2. [Collect] 从 system.profile 收集查询形状 (过滤键/排序/投影) 及执行计划摘要。
+3. [Report]  标记 COLLSCAN、内存排序 (SORT)、低效索引扫描 (扫描量 >> 返回量) 与可覆盖却回表的查询。
+4. [Advise]  按 ESR 规则 (Equality -> Sort -> Range) 生成索引建议，已有索引前缀可支撑的不重复建议。
+5. [Apply]   APPLY_INDEXES=True 时创建建议索引，并重跑脚本对比前后耗时。
+
+不带脚本参数运行时，对 HOT_QUERIES 中登记的已知热点查询做静态 explain 检查。
+
+用法:
+    python data/index_advisor.py                         # 静态检查 HOT_QUERIES
+    python data/index_advisor.py data/02_download_stock_daily.py
+"""
+
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import pandas as pd
+from pymongo import MongoClient, ASCENDING, DESCENDING
+from tabulate import tabulate
+
+# --- 配置 ---
+MONGO_HOST = "localhost"
+MONGO_PORT = 27017
+PROFILE_DBS = ["vnpy_stock", "vnpy_master", "vnpy_factor"]
+
+APPLY_INDEXES = False      # True: 创建建议的索引
+RERUN_AFTER_APPLY = True   # 创建索引后重跑脚本，展示提速效果
+SCRIPT_TIMEOUT = None      # 目标脚本超时 (秒)，None 为不限
+
+# 判定阈值
+SCAN_RATIO_LIMIT = 10      # (keysExamined 或 docsExamined) / nreturned 超过此值视为低效
+MIN_EXAMINED = 1000        # 扫描量太小的查询不值得建索引
+MAX_COVER_FIELDS = 2       # 为覆盖查询最多额外追加的投影字段数
+
+# 管道中已知的热点查询 (静态 explain 检查)
+HOT_QUERIES = [
+    ("vnpy_stock", "stock_info", {"category": {"$in": ["STOCK_A", "STOCK_BJ"]}}, None,
+     {"symbol": 1, "name": 1, "exchange": 1}),
+    ("vnpy_stock", "bar_daily", {"symbol": "600519", "datetime": {"$gte": datetime(2020, 1, 1)}}, [("datetime", ASCENDING)],
+     {"datetime": 1, "close_price": 1}),
+    ("vnpy_stock", "bar_daily", {"symbol": "600519"}, [("datetime", DESCENDING)], {"datetime": 1}),
+    ("vnpy_stock", "index_info", {"category": "CONCEPT"}, None, {"name": 1, "symbol": 1}),
+    ("vnpy_stock", "index_daily", {"symbol": "sh000001"}, [("datetime", DESCENDING)], {"datetime": 1}),
+    ("vnpy_stock", "industry_history", {"symbol": "600519"}, [("date", DESCENDING)], None),
+    ("vnpy_stock", "finance_dividend", {"symbol": "600519"}, [("ex_date", ASCENDING)], None),
+]
+
+RANGE_OPS = {"$gt", "$gte", "$lt", "$lte", "$ne", "$nin", "$exists", "$regex", "$not", "$type"}
+EQUALITY_OPS = {"$eq", "$in"}
+
+
+def get_client():
+    return MongoClient(MONGO_HOST, MONGO_PORT)
+
+
+# =========================================================================
+# 1. 查询形状解析
+# =========================================================================
+def classify_filter(filt, eq=None, rng=None):
+    """把过滤条件拆成 等值字段 / 范围字段 (保持出现顺序)"""
+    eq = [] if eq is None else eq
+    rng = [] if rng is None else rng
+    for key, val in (filt or {}).items():
+        if key in ("$and", "$or", "$nor"):
+            for sub in val:
+                classify_filter(sub, eq, rng)
+            continue
+        if key.startswith("$"):
+            continue
+        if isinstance(val, dict) and any(k.startswith("$") for k in val):
+            ops = set(val)
+            target = rng if ops & RANGE_OPS or not ops <= EQUALITY_OPS else eq
+        else:
+            target = eq
+        if key not in eq and key not in rng:
+            target.append(key)
+    return eq, rng
+
+
+def shape_of(value):
+    """把具体值替换为占位符，得到可分组的查询形状"""
+    if isinstance(value, dict):
+        return {k: shape_of(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [shape_of(v) for v in value[:1]]
+    return "?"
+
+
+def parse_profile_entry(entry):
+    """从 system.profile 文档中抽取 (集合, 操作, 过滤, 排序, 投影)"""
+    cmd = entry.get("command") or {}
+    op = entry.get("op")
+    ns = entry.get("ns", "")
+    col = ns.split(".", 1)[1] if "." in ns else ns
+    if col.startswith("system."):
+        return None
+
+    filt, sort, proj = None, None, None
+    if op == "query":
+        filt, sort, proj = cmd.get("filter"), cmd.get("sort"), cmd.get("projection")
+    elif op in ("update", "remove"):
+        filt = cmd.get("q")
+    elif op == "command":
+        if "count" in cmd:
+            filt = cmd.get("query")
+        elif "distinct" in cmd:
+            filt = cmd.get("query")
+        elif "aggregate" in cmd:
+            stages = cmd.get("pipeline") or []
+            if stages and "$match" in stages[0]:
+                filt = stages[0]["$match"]
+            if len(stages) > 1 and "$sort" in stages[1]:
+                sort = stages[1]["$sort"]
+        else:
+            return None
+    else:
+        return None
+
+    return {
+        "ns": ns, "collection": col, "op": op,
+        "filter": filt or {}, "sort": dict(sort or {}), "projection": dict(proj or {}),
+    }
+
+
+def shape_key(parsed):
+    return (parsed["ns"], parsed["op"], repr(shape_of(parsed["filter"])),
+            repr(list(parsed["sort"].items())), repr(sorted(parsed["projection"])))
+
+
+# =========================================================================
+# 2. 索引建议 (ESR)
+# =========================================================================
+def propose_index(filt, sort, proj):
+    eq, rng = classify_filter(filt)
+    keys = [(f, ASCENDING) for f in eq]
+    keys += [(f, int(d)) for f, d in sort.items() if f not in eq]
+    keys += [(f, ASCENDING) for f in rng if f not in dict(keys)]
+
+    # 投影字段很少时追加进索引，使查询可被覆盖 (需投影排除 _id)
+    extra = [f for f, v in proj.items() if v and f != "_id" and f not in dict(keys)]
+    if keys and 0 < len(extra) <= MAX_COVER_FIELDS:
+        keys += [(f, ASCENDING) for f in extra]
+    return keys
+
+
+def is_supported(existing, proposal):
+    """已有索引的前缀是否覆盖了建议索引的 等值+排序 部分"""
+    need = [f for f, _ in proposal]
+    for keys in existing:
+        fields = [f for f, _ in keys]
+        if fields[:len(need)] == need:
+            return True
+    return False
+
+
+def existing_indexes(client, ns):
+    db_name, col = ns.split(".", 1)
+    return [list(info["key"]) for info in client[db_name][col].index_information().values()]
+
+
+def diagnose(stats):
+    """根据执行统计给出问题标签"""
+    issues = []
+    plan = stats["plan"]
+    returned = max(stats["nreturned"], 1)
+    if "COLLSCAN" in plan:
+        issues.append("COLLSCAN")
+    if stats["has_sort_stage"]:
+        issues.append("IN-MEMORY SORT")
+    if "IXSCAN" in plan and stats["keys_examined"] / returned > SCAN_RATIO_LIMIT:
+        issues.append("WIDE IXSCAN")
+    if stats["docs_examined"] / returned > SCAN_RATIO_LIMIT and "COLLSCAN" not in plan:
+        issues.append("FETCH FILTER")
+    if stats["docs_examined"] > 0 and stats["projection"] and "IXSCAN" in plan:
+        fields = {f for f, v in stats["projection"].items() if v and f != "_id"}
+        if fields and len(fields) <= MAX_COVER_FIELDS + 2:
+            issues.append("NOT COVERED")
+    return issues
+
+
+# =========================================================================
+# 3. Profiler 运行
+# =========================================================================
+def run_profiled(client, script):
+    """开启 Profiler 运行脚本，返回 (耗时, 按查询形状聚合的统计)"""
+    # slowms / sampleRate 是全局设置: 只恢复级别的话 slowms=0 会留在 mongod 上，之后每条操作都记慢日志
+    previous = {}
+    try:
+        for db_name in PROFILE_DBS:
+            db = client[db_name]
+            status = db.command("profile", -1)
+            previous[db_name] = {"level": status.get("was", 0), "slowms": status.get("slowms", 100),
+                                 "sampleRate": status.get("sampleRate", 1.0)}
+            db.command("profile", 0)
+            db["system.profile"].drop()
+            db.command("profile", 2, slowms=0)
+
+        print(f"▶️  运行 {script} (Profiler ON)...")
+        t0 = time.perf_counter()
+        try:
+            subprocess.run([sys.executable, script], check=False, timeout=SCRIPT_TIMEOUT)
+        except subprocess.TimeoutExpired:
+            print(f"⏱  脚本超时 ({SCRIPT_TIMEOUT}s)，使用已采集到的样本。")
+        elapsed = time.perf_counter() - t0
+    finally:
+        for db_name, prev in previous.items():
+            client[db_name].command("profile", prev["level"], slowms=prev["slowms"], sampleRate=prev["sampleRate"])
+
+    shapes = {}
+    for db_name in PROFILE_DBS:
+        db = client[db_name]
+        for entry in db["system.profile"].find({}):
+            parsed = parse_profile_entry(entry)
+            if not parsed:
+                continue
+            key = shape_key(parsed)
+            s = shapes.get(key)
+            if s is None:
+                s = shapes[key] = dict(parsed, calls=0, millis=0, keys_examined=0, docs_examined=0,
+                                       nreturned=0, has_sort_stage=False, plans=set())
+            s["calls"] += 1
+            s["millis"] += entry.get("millis", 0)
+            s["keys_examined"] += entry.get("keysExamined", 0)
+            s["docs_examined"] += entry.get("docsExamined", 0)
+            s["nreturned"] += entry.get("nreturned", entry.get("nMatched", 0)) or 0
+            s["has_sort_stage"] |= bool(entry.get("hasSortStage"))
+            s["plans"].add(entry.get("planSummary", "-"))
+
+    for s in shapes.values():
+        s["plan"] = " | ".join(sorted(p for p in s["plans"] if p))
+    return elapsed, shapes
+
+
+def explain_hot_queries(client):
+    """静态检查: 对 HOT_QUERIES 做 explain，换算为与 Profiler 相同的统计结构"""
+    shapes = {}
+    for db_name, col, filt, sort, proj in HOT_QUERIES:
+        cursor = client[db_name][col].find(filt, proj)
+        if sort:
+            cursor = cursor.sort(sort)
+        exp = cursor.explain()
+        es = exp.get("executionStats", {})
+        plan_text = repr(exp.get("queryPlanner", {}).get("winningPlan", {}))
+        plan = "COLLSCAN" if "COLLSCAN" in plan_text else ("IXSCAN" if "IXSCAN" in plan_text else "-")
+        parsed = {"ns": f"{db_name}.{col}", "collection": col, "op": "query",
+                  "filter": filt, "sort": dict(sort or []), "projection": dict(proj or {})}
+        shapes[shape_key(parsed)] = dict(
+            parsed, calls=1, millis=es.get("executionTimeMillis", 0),
+            keys_examined=es.get("totalKeysExamined", 0), docs_examined=es.get("totalDocsExamined", 0),
+            nreturned=es.get("nReturned", 0), has_sort_stage="'SORT'" in plan_text, plan=plan,
+        )
+    return shapes
+
+
+# =========================================================================
+# 4. 报告与建议
+# =========================================================================
+def build_advice(client, shapes):
+    rows, proposals = [], {}
+    index_cache = {}
+    for key, s in sorted(shapes.items(), key=lambda kv: -kv[1]["millis"]):
+        issues = diagnose(s)
+        examined = max(s["keys_examined"], s["docs_examined"])
+        suggestion = "-"
+        if "COLLSCAN" in issues or (issues and examined >= MIN_EXAMINED):
+            proposal = propose_index(s["filter"], s["sort"], s["projection"])
+            if s["ns"] not in index_cache:
+                index_cache[s["ns"]] = existing_indexes(client, s["ns"])
+            if proposal and not is_supported(index_cache[s["ns"]], proposal):
+                proposals[(s["ns"], tuple(proposal))] = proposal
+                suggestion = ", ".join(f"{f}:{d}" for f, d in proposal)
+            elif proposal:
+                suggestion = "(已有前缀索引)"
+        rows.append({
+            "Collection": s["ns"], "Op": s["op"],
+            "Filter": repr(shape_of(s["filter"]))[:50], "Sort": repr(s["sort"])[:25],
+            "Calls": s["calls"], "ms": s["millis"],
+            "Keys/Docs/Ret": f"{s['keys_examined']}/{s['docs_examined']}/{s['nreturned']}",
+            "Plan": s["plan"][:40], "Issues": ",".join(issues) or "OK", "Suggest": suggestion,
+        })
+    return rows, proposals
+
+
+def apply_indexes(client, proposals):
+    for (ns, _), keys in proposals.items():
+        db_name, col = ns.split(".", 1)
+        print(f"   🔨 create_index {ns} {keys}")
+        try:
+            client[db_name][col].create_index(keys, background=True)
+        except Exception as e:
+            print(f"   ❌ 失败: {e}")
+
+
+def compare_runs(before, after):
+    rows = []
+    for key, b in before.items():
+        a = after.get(key)
+        if not a:
+            continue
+        b_avg = b["millis"] / max(b["calls"], 1)
+        a_avg = a["millis"] / max(a["calls"], 1)
+        if b_avg == 0 and a_avg == 0:
+            continue
+        rows.append({
+            "Collection": b["ns"], "Filter": repr(shape_of(b["filter"]))[:50],
+            "Before(ms/call)": round(b_avg, 2), "After(ms/call)": round(a_avg, 2),
+            "Docs Before": b["docs_examined"], "Docs After": a["docs_examined"],
+            "Plan After": a["plan"][:40],
+        })
+    return rows
+
+
+def run(script=None):
+    print("🚀 启动 [索引顾问 & 查询分析器]...")
+    client = get_client()
+
+    if script:
+        elapsed, shapes = run_profiled(client, script)
+        print(f"⏱  脚本耗时: {elapsed:.1f}s, 采集到 {len(shapes)} 种查询形状")
+    else:
+        print("📋 未指定脚本，对 HOT_QUERIES 执行静态 explain 检查...")
+        elapsed, shapes = None, explain_hot_queries(client)
+
+    rows, proposals = build_advice(client, shapes)
+    print(tabulate(pd.DataFrame(rows), headers="keys", tablefmt="simple_grid", showindex=False))
+
+    if not proposals:
+        print("\n✅ 未发现需要补充的索引。")
+        return
+
+    print(f"\n💡 建议新增 {len(proposals)} 个索引:")
+    for (ns, _), keys in proposals.items():
+        print(f"   - {ns}: {keys}")
+
+    if not APPLY_INDEXES:
+        print("\n   (APPLY_INDEXES=False，仅输出建议)")
+        return
+
+    apply_indexes(client, proposals)
+
+    if script and RERUN_AFTER_APPLY:
+        elapsed_after, shapes_after = run_profiled(client, script)
+        print(f"\n📊 提速对比: 脚本耗时 {elapsed:.1f}s -> {elapsed_after:.1f}s")
+        print(tabulate(pd.DataFrame(compare_runs(shapes, shapes_after)),
+                       headers="keys", tablefmt="simple_grid", showindex=False))
+    elif not script:
+        after = explain_hot_queries(client)
+        print(tabulate(pd.DataFrame(compare_runs(shapes, after)),
+                       headers="keys", tablefmt="simple_grid", showindex=False))
+
+
+if __name__ == "__main__":
+    run(sys.argv[1] if len(sys.argv) > 1 else None)
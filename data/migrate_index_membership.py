@@ -0,0 +1,106 @@
+"""
+Script: Migrate Index Components -> PIT Membership (成分股历史迁移)
+------------------------------------------------------------------
+目标: 把 index_components 中历史积累的每日全量快照，按日期重放为调入/调出事件，
+      写入 utils/pit_membership 的增量存储。之后 11 / 16 只写增量。
+
+逻辑:
+1. 按指数逐个读取快照 (按 date 升序)，逐日调用 record_snapshot 求差集。
+2. 已迁移过的日期 (早于 state.last_seen) 会被自动忽略，可重复运行。
+3. 迁移结束后对比新旧存储体积，并抽样校验 as-of 查询结果与原快照一致。
+
+配置:
+    DROP_LEGACY: 校验通过后删除 index_components (默认关闭，确认无误后再开)
+"""
+
+import random
+import sys
+import os
+import time
+
+from pymongo import MongoClient
+from tqdm import tqdm
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+from utils import pit_membership
+from utils.pit_membership import MembershipIndex
+
+# --- 配置 ---
+MONGO_HOST = "localhost"
+MONGO_PORT = 27017
+DB_NAME = "vnpy_stock"
+COL_LEGACY = "index_components"
+VERIFY_SAMPLES = 200
+DROP_LEGACY = False
+
+
+def _components_of(doc):
+    """旧快照的 components 可能是 list，也可能是 {symbol: weight}"""
+    comps = doc.get("components") or []
+    if isinstance(comps, dict):
+        return list(comps.keys()), comps
+    return list(comps), doc.get("weights") or {}
+
+
+def storage_mb(db, name):
+    try:
+        stats = db.command("collStats", name)
+    except Exception:
+        return 0.0
+    return (stats.get("storageSize", 0) + stats.get("totalIndexSize", 0)) / 1024 / 1024
+
+
+def migrate(db):
+    index_symbols = sorted(db[COL_LEGACY].distinct("index_symbol"))
+    print(f"📦 共 {len(index_symbols)} 个指数/板块需要迁移")
+    added = removed = snapshots = 0
+
+    for symbol in tqdm(index_symbols, desc="Migrate"):
+        cursor = db[COL_LEGACY].find({"index_symbol": symbol}, {"_id": 0}).sort("date", 1)
+        for doc in cursor:
+            comps, weights = _components_of(doc)
+            if not comps:
+                continue
+            res = pit_membership.record_snapshot(db, symbol, doc["date"], comps, weights,
+                                                 index_name=doc.get("index_name"), category=doc.get("category"))
+            if res:
+                added += res[0]
+                removed += res[1]
+                snapshots += 1
+    print(f"✅ 重放 {snapshots:,} 份快照 -> 调入 {added:,} / 调出 {removed:,} 条事件")
+
+
+def verify(db):
+    index = MembershipIndex.load(db)
+    docs = list(db[COL_LEGACY].aggregate([{"$sample": {"size": VERIFY_SAMPLES}}]))
+    bad = 0
+    t0 = time.perf_counter()
+    for doc in docs:
+        comps, _ = _components_of(doc)
+        if comps and index.members(doc["index_symbol"], doc["date"]) != set(comps):
+            bad += 1
+    per_query_us = (time.perf_counter() - t0) / max(len(docs), 1) * 1e6
+    print(f"🔍 抽样校验 {len(docs)} 份快照: 不一致 {bad} 份 (as-of 查询 {per_query_us:.0f} µs/次)")
+    return bad == 0
+
+
+def run():
+    print("🚀 启动 [成分股历史迁移 -> PIT 增量存储]...")
+    db = MongoClient(MONGO_HOST, MONGO_PORT)[DB_NAME]
+    pit_membership.ensure_indexes(db)
+
+    migrate(db)
+    ok = verify(db)
+
+    before = storage_mb(db, COL_LEGACY)
+    after = sum(storage_mb(db, c) for c in (pit_membership.COL_EVENTS, pit_membership.COL_CHECKPOINTS,
+                                             pit_membership.COL_STATE))
+    print(f"💾 存储: {COL_LEGACY} {before:.1f} MB -> PIT {after:.1f} MB")
+
+    if DROP_LEGACY and ok:
+        db[COL_LEGACY].drop()
+        print(f"🗑  已删除 {COL_LEGACY}")
+
+
+if __name__ == "__main__":
+    run()
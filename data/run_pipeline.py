@@ -0,0 +1,150 @@
+"""
+Script: Nightly Pipeline Runner (每日数据管道)
+----------------------------------------------
+目标: 替代手工按顺序执行 02 -> 03 -> 15 -> 07 -> 08 -> 14 -> 16 -> 17 ...
+逻辑:
+1. PIPELINE 中每个脚本声明输入/输出集合，依赖由 utils/pipeline_dag 自动推导。
+2. 无依赖关系的分支并发执行 (如 02 / 03 / 15 / 17 同时下载)，墙钟时间降到关键路径。
+3. 派生计算 (14 停牌融合, 08 估值) 在输入集合没有变化时自动跳过。
+4. 状态写入 data/logs/pipeline_state.json，中断后再次运行会续跑。
+
+配置:
+    MAX_PARALLEL: 同时运行的脚本数 (下载器受外部接口限速，不宜过大)
+    FORCE:        强制重跑的节点名 (忽略指纹比对)
+    write_mode:   节点级写关注 acked (默认) / fast / majority，见 utils/mongo_client.py
+"""
+
+import os
+import sys
+
+import pandas as pd
+from tabulate import tabulate
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+from utils.pipeline_dag import PipelineRunner
+from utils.mongo_client import get_client
+
+# --- 配置 ---
+MAX_PARALLEL = 4
+RESUME = True
+FORCE = []
+
+DATA_DIR = os.path.abspath(os.path.dirname(__file__))
+STATE_PATH = os.path.join(DATA_DIR, "logs", "pipeline_state.json")
+LOG_DIR = os.path.join(DATA_DIR, "logs", "pipeline")
+
+# 不带库名的集合默认属于 vnpy_stock
+PIPELINE = {
+    # --- 外部数据源 (每次运行) ---
+    "09_calendar": {
+        "script": "09_download_calendar.py",
+        "inputs": [], "outputs": ["vnpy_master.trading_calendar"],
+        "external": True, "enabled": False,  # 每月运行一次即可
+        "write_mode": "majority",  # 主数据，写入须落盘
+    },
+    "02_bars": {
+        "script": "02_download_stock_daily.py",
+        "inputs": ["stock_info", "vnpy_master.trading_calendar"], "outputs": ["bar_daily"], "external": True,
+    },
+    # 03 由 02 的日线与 17 的除权除息事件本地计算因子，只抽样下载对账
+    "03_adjust_factor": {
+        "script": "03_download_adjust_factor.py",
+        "inputs": ["stock_info", "bar_daily", "finance_dividend"], "outputs": ["adjust_factor"], "external": True,
+    },
+    # 05 / 12_part1 / 12_part2 已由 15 统一替代 (同样写 index_daily)，不再单独列为节点
+    "15_index_bars": {
+        "script": "15_download_all_indices_unified.py",
+        "inputs": [], "outputs": ["index_daily", "index_info"], "external": True,
+    },
+    "17_dividend": {
+        "script": "17_download_dividend_data.py",
+        "inputs": ["stock_info"], "outputs": ["finance_dividend"], "external": True,
+    },
+    "14_suspension_raw": {
+        "script": "14_download_suspension_by_date.py",
+        "inputs": [], "outputs": ["suspension_daily_raw"], "external": True,
+    },
+    # 07 会用 bar_daily 的流通股本缝合 float_shares_a，因此排在 02 之后
+    "07_share_capital": {
+        "script": "07_download_share_capital.py",
+        "inputs": ["stock_info", "bar_daily"], "outputs": ["share_capital"], "external": True,
+    },
+    # 16 从 index_daily 同步 index_info，再下载成分股
+    "16_index_components": {
+        "script": "16_download_index_components_unified.py",
+        "inputs": ["index_daily"], "outputs": ["index_info", "index_membership_events"], "external": True,
+        "write_mode": "majority",  # 成分变动事件是 PIT 历史，无法从接口完整重下
+    },
+
+    # --- 派生计算 (输入未变化则跳过) ---
+    # 14_fuse 的日历按顺序取 vnpy_stock 中第一个存在的 trade_date_hist / trading_calendar / index_daily
+    # (load_master_calendar)，不读 09 维护的 vnpy_master.trading_calendar；三者都声明，指纹才盯得住实际读的那张
+    "14_fuse_suspension": {
+        "script": "14_fuse_suspensions.py",
+        "inputs": ["bar_daily", "suspension_daily_raw", "trade_date_hist", "trading_calendar", "index_daily"],
+        "outputs": ["stock_status_history"],
+    },
+    # 06 (财报下载) 不在每日管道中，手动运行后由 21 补齐 / 兜底规范化快照
+    "21_fin_std": {
+        "script": "21_normalize_financials.py",
+        "inputs": ["finance_income", "finance_balance", "finance_cashflow"],
+        "outputs": ["finance_std"],
+    },
+    "08_valuation": {
+        "script": "08_calculate_valuation_daily.py",
+        "inputs": ["stock_info", "bar_daily", "share_capital", "finance_std", "finance_dividend", "industry_history"],
+        "outputs": ["valuation_daily"],
+    },
+    "18_factors": {
+        "script": "18_calculate_factors.py",
+        "inputs": ["bar_daily", "adjust_factor", "valuation_daily", "index_daily", "finance_std"],
+        "outputs": ["vnpy_factor.factor_master"],
+    },
+    "19_limits": {
+        "script": "19_calculate_limit_analysis.py",
+        "inputs": ["bar_daily", "adjust_factor", "stock_status_history", "stock_info"],
+        "outputs": ["analysis_limit_up", "analysis_limit_down"],
+    },
+    "20_masks": {
+        "script": "20_build_mask_panels.py",
+        "inputs": ["vnpy_master.trading_calendar", "bar_daily", "adjust_factor", "stock_status_history", "stock_info"],
+        "outputs": [],  # 写入 data/cache/masks/ (memmap 文件)
+    },
+    # 25 审计出的缺口写入 repair_worklist，由次日的 02 / 03 / 08 领取补数 (不声明为它们的输入，避免成环)
+    "25_completeness": {
+        "script": "25_audit_completeness.py",
+        "inputs": ["vnpy_master.trading_calendar", "stock_info", "stock_status_history",
+                   "bar_daily", "adjust_factor", "valuation_daily", "share_capital"],
+        "outputs": ["repair_worklist"],
+    },
+    "24_hot_cache": {
+        "script": "24_publish_hot_cache.py",
+        "inputs": ["bar_daily", "valuation_daily", "stock_status_history", "industry_history"],
+        "outputs": [],  # 发布到 Redis (utils/hot_cache)
+    },
+}
+
+
+def run():
+    print("🚀 启动 [每日数据管道 DAG]...")
+    client = get_client()
+    runner = PipelineRunner(PIPELINE, client, DATA_DIR, STATE_PATH, LOG_DIR,
+                            max_parallel=MAX_PARALLEL, resume=RESUME, force=FORCE)
+
+    print("🧭 依赖关系:")
+    for name in runner.nodes:
+        deps = sorted(runner.deps[name])
+        print(f"   {name:<22} <- {', '.join(deps) if deps else '(无)'}")
+    print("-" * 60)
+
+    result = runner.run()
+
+    rows = [{"Node": n, "Status": s, "Seconds": round(result["durations"].get(n, 0.0), 1)}
+            for n, s in result["finished"].items()]
+    print("\n" + tabulate(pd.DataFrame(rows), headers="keys", tablefmt="simple_grid", showindex=False))
+    print(f"\n⏱  墙钟 {result['wall_s']:.1f}s | 串行合计 {result['serial_s']:.1f}s | "
+          f"关键路径 {result['critical_path_s']:.1f}s: {' -> '.join(result['critical_path'])}")
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,102 @@
+"""
+Tool: Pipeline Run Report (运行记录对比)
+---------------------------------------
+目标: 读取 utils/stage_profiler 写下的 JSON 运行记录，跨运行对比各阶段耗时。
+输出:
+1. 每次运行的 总耗时 / 网络 / Mongo 读写 / 本地计算 占比，以及瓶颈判定 (network / mongo / compute)。
+2. 最近一次与之前运行中位数的阶段级对比，超过 REGRESSION_RATIO 标记为回归。
+
+用法:
+    python data/run_report.py                          # 所有脚本的最近一次运行
+    python data/run_report.py 02_download_stock_daily  # 单个脚本的历史对比
+"""
+
+import os
+import sys
+
+import pandas as pd
+from tabulate import tabulate
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+from utils.stage_profiler import LOG_ROOT, load_runs
+
+# --- 配置 ---
+HISTORY_LIMIT = 10        # 每个脚本最多对比最近 N 次运行
+REGRESSION_RATIO = 1.2    # 比历史中位数慢 20% 以上视为回归
+
+
+def summarize(run):
+    t = run["totals"]
+    wall = run["wall_s"] or 0.0
+    pct = (lambda v: f"{v / wall:.0%}") if wall else (lambda v: "-")
+    mongo = t["mongo_read_s"] + t["mongo_write_s"]
+    return {
+        "Script": run["script"], "Started": (run["started_at"] or "")[:19], "Status": run["status"],
+        "Wall(s)": wall, "Network": pct(t["network_s"]), "Mongo": pct(mongo),
+        "Compute": pct(t["compute_s"]), "Rows": t["rows"], "PeakRSS(MB)": run["peak_rss_mb"],
+        "Bound": run["bound"],
+    }
+
+
+def stage_frame(runs):
+    rows = []
+    for i, run in enumerate(runs):
+        for st in run["stages"]:
+            rows.append(dict(st, run=i))
+    return pd.DataFrame(rows)
+
+
+def compare_latest(runs):
+    """最近一次 vs 之前运行的中位数 (阶段级)"""
+    df = stage_frame(runs)
+    if df.empty or len(runs) < 2:
+        return []
+    latest_id = len(runs) - 1
+    latest = df[df["run"] == latest_id].set_index("name")
+    history = df[df["run"] < latest_id].groupby("name")[["wall_s", "network_s", "mongo_read_s",
+                                                         "mongo_write_s", "compute_s"]].median()
+    rows = []
+    for name, cur in latest.iterrows():
+        base = history.loc[name] if name in history.index else None
+        base_wall = base["wall_s"] if base is not None else None
+        ratio = cur["wall_s"] / base_wall if base_wall else None
+        rows.append({
+            "Stage": name, "Wall(s)": cur["wall_s"], "Median(s)": base_wall if base_wall is not None else "-",
+            "Ratio": f"{ratio:.2f}x" if ratio else "-",
+            "Net(s)": cur["network_s"], "MongoR(s)": cur["mongo_read_s"], "MongoW(s)": cur["mongo_write_s"],
+            "Compute(s)": cur["compute_s"], "Rows": cur["rows"], "RSS(MB)": cur["peak_rss_mb"],
+            "Flag": "🔺 回归" if ratio and ratio > REGRESSION_RATIO else "",
+        })
+    return rows
+
+
+def run(script=None):
+    if not os.path.isdir(LOG_ROOT):
+        print(f"⚠️ 暂无运行记录: {LOG_ROOT}")
+        return
+
+    scripts = [script] if script else sorted(os.listdir(LOG_ROOT))
+    if not script:
+        latest = [load_runs(s, 1) for s in scripts]
+        rows = [summarize(r[-1]) for r in latest if r]
+        print("📋 各脚本最近一次运行")
+        print(tabulate(pd.DataFrame(rows), headers="keys", tablefmt="simple_grid", showindex=False))
+        return
+
+    runs = load_runs(script, HISTORY_LIMIT)
+    if not runs:
+        print(f"⚠️ {script} 暂无运行记录")
+        return
+
+    print(f"📋 {script} 最近 {len(runs)} 次运行")
+    print(tabulate(pd.DataFrame([summarize(r) for r in runs]), headers="keys",
+                   tablefmt="simple_grid", showindex=False))
+
+    rows = compare_latest(runs)
+    if rows:
+        print("\n🔍 最近一次 vs 历史中位数 (阶段级)")
+        print(tabulate(pd.DataFrame(rows), headers="keys", tablefmt="simple_grid", showindex=False))
+
+
+if __name__ == "__main__":
+    run(sys.argv[1] if len(sys.argv) > 1 else None)
@@ -0,0 +1,96 @@
+"""
+Module: change_tracker.py
+Description: 基于 updated_at 水位线的上游变更追踪 (派生表的增量重算)
+Features:
+    1. [Watermark] 每个 (消费者, 上游集合) 在 change_watermarks 中记一条水位 (已处理到的最大 updated_at)。
+       上游写入经 utils/hashed_upsert 的 stamp="updated_at"，只有内容真正变化的记录才刷新时间戳，
+       因此重复下载不会触发重算。
+    2. [Dirty Range] changes() 取回水位之后变化的记录 (symbol + 业务日期)，
+       dirty_starts() 汇总为 每只股票最早受影响的日期 —— 消费者从该日重算到最新即可覆盖更正 / 补录。
+    3. [Commit] 消费者全部写完后再 commit()；中途失败不推进水位，下次重跑同一批 (配合变更检测写入，重复重算很便宜)。
+    4. [Baseline] 首次运行 (无水位) 不产生脏区间，只把水位设为当前最大 updated_at；需要全量请用各脚本的 FORCE 开关。
+
+说明: 未使用 change streams —— 需要副本集且要保存 resume token，本地单机 mongod 不满足；
+      水位线只依赖 updated_at 字段上的索引 (ensure_indexes 自动创建)。
+
+用法:
+    tracker = ChangeTracker(db, "valuation_daily")
+    starts = tracker.dirty_starts({"share_capital": "date", "finance_dividend": "ex_date"})
+    ... 按 starts[symbol] 重算 ...
+    tracker.commit()
+"""
+
+from datetime import datetime
+
+import pandas as pd
+from pymongo import ASCENDING
+
+from .mongo_loader import DATETIME_DTYPE, load_frame
+
+# --- 配置 ---
+COL_WATERMARKS = "change_watermarks"
+STAMP_FIELD = "updated_at"
+
+
+class ChangeTracker:
+    def __init__(self, db, consumer):
+        self.db = db
+        self.consumer = consumer
+        self._pending = {}  # 上游集合 -> 本次读到的最大 updated_at
+
+    def _id(self, source):
+        return f"{self.consumer}:{source}"
+
+    def ensure_indexes(self, sources):
+        for source in sources:
+            self.db[source].create_index([(STAMP_FIELD, ASCENDING)])
+
+    def watermark(self, source):
+        doc = self.db[COL_WATERMARKS].find_one({"_id": self._id(source)})
+        return doc["ts"] if doc else None
+
+    def _latest(self, source):
+        doc = self.db[source].find_one({STAMP_FIELD: {"$ne": None}}, {STAMP_FIELD: 1}, sort=[(STAMP_FIELD, -1)])
+        return doc[STAMP_FIELD] if doc else None
+
+    def changes(self, source, date_field):
+        """
+        水位之后变化的记录 DataFrame[symbol, date]。
+        首次运行返回空表，并把当前最大 updated_at 作为待提交的基线。
+        """
+        empty = pd.DataFrame({"symbol": pd.Series(dtype=object), "date": pd.Series(dtype=DATETIME_DTYPE)})
+        mark = self.watermark(source)
+        if mark is None:
+            # 上游为空时基线记为最早时间，之后写入的记录全部算作变更
+            self._pending[source] = self._latest(source) or datetime.min
+            return empty
+        df = load_frame(self.db[source], {STAMP_FIELD: {"$gt": mark}},
+                        {"symbol": "str", date_field: "datetime", STAMP_FIELD: "datetime"})
+        if df.empty:
+            return empty
+        self._pending[source] = df[STAMP_FIELD].max().to_pydatetime()
+        return df.rename(columns={date_field: "date"})[["symbol", "date"]]
+
+    def dirty_starts(self, sources):
+        """
+        sources: {上游集合: 该集合中决定影响起点的日期字段}
+        返回 {symbol: 最早受影响日期 (datetime)}；缺少日期的变更记录视为从头受影响 (datetime.min)
+        """
+        self.ensure_indexes(sources)
+        frames = [self.changes(src, field) for src, field in sources.items()]
+        frames = [f for f in frames if not f.empty]
+        if not frames:
+            return {}
+        df = pd.concat(frames, ignore_index=True).dropna(subset=["symbol"])
+        first = df.assign(date=df["date"].fillna(pd.Timestamp(datetime.min))).groupby("symbol")["date"].min()
+        return {s: ts.to_pydatetime() for s, ts in first.items()}
+
+    def commit(self):
+        """推进水位到本次读到的最大 updated_at"""
+        for source, ts in self._pending.items():
+            self.db[COL_WATERMARKS].update_one(
+                {"_id": self._id(source)},
+                {"$set": {"consumer": self.consumer, "source": source, "ts": ts, "committed_at": datetime.now()}},
+                upsert=True,
+            )
+        self._pending.clear()
@@ -0,0 +1,211 @@
+"""
+Module: completeness.py
+Description: 数据完整性矩阵 (交易日 × 股票 覆盖位图) 与精确补数工作清单
+Features:
+    1. [Bits] 每个单元 1 字节，按位记录: 应有行情 (EXPECTED) / 日线 / 估值 / 复权因子覆盖 / 股本覆盖。
+       EXPECTED = 交易日历 ∩ [上市日, 退市日) − 14_fuse 停牌区间 (上市日缺失时用首根 K 线)。
+    2. [Sorted Scan] 每个集合每批股票只做一次按 (symbol, 日期) 索引排序的扫描:
+       日频表 (bar_daily / valuation_daily) 逐日落位；阶梯表 (adjust_factor / share_capital) 取每只股票首个日期，
+       之后视为已覆盖。取代逐只 find_one / count_documents 的审计脚本。
+    3. [Runs] missing_runs() 把缺失位按列做差分，向量化得到每只股票的连续缺失区间 (起止交易日 + 天数)。
+    4. [Work List] 缺口写入 repair_worklist (25_audit_completeness)，下游按来源领取:
+         bar_daily -> 02 按区间补下载；adjust_factor -> 03 本地重算；valuation_daily -> 08 从缺口起点回溯重算。
+       claim() 领取时累加 attempts，超过 MAX_ATTEMPTS 的缺口 (数据源本身没有) 不再反复请求。
+
+缺失规则 (RULES): 日线 = EXPECTED 且无日线；估值 / 因子 / 股本 = 有日线 且无对应覆盖。
+
+用法:
+    dates = load_calendar(db_master, START, end)
+    frame = build_matrix(db, symbols, dates, info, suspensions)
+    gaps = find_gaps(frame)            # DataFrame[symbol, source, start, end, days]
+    todo = claim(db, "bar_daily")      # 02 / 03 / 08 领取
+"""
+
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from .mongo_loader import DATETIME_DTYPE, load_frame
+
+# --- 配置 ---
+COL_WORKLIST = "repair_worklist"
+MAX_ATTEMPTS = 3  # 同一缺口最多领取次数
+
+EXPECTED = 1 << 0
+BAR = 1 << 1
+VALUATION = 1 << 2
+FACTOR = 1 << 3
+CAPITAL = 1 << 4
+BITS = {"expected": EXPECTED, "bar": BAR, "valuation": VALUATION, "factor": FACTOR, "capital": CAPITAL}
+
+# 集合 -> (日期字段, 位, 日频 daily / 阶梯 step)
+SOURCES = {
+    "bar_daily": ("datetime", BAR, "daily"),
+    "valuation_daily": ("date", VALUATION, "daily"),
+    "adjust_factor": ("date", FACTOR, "step"),
+    "share_capital": ("date", CAPITAL, "step"),
+}
+# 集合 -> (前提位, 需要的位): 前提成立而缺少需要的位即为缺口
+RULES = {
+    "bar_daily": (EXPECTED, BAR),
+    "valuation_daily": (BAR, VALUATION),
+    "adjust_factor": (BAR, FACTOR),
+    "share_capital": (BAR, CAPITAL),
+}
+
+
+def load_calendar(db_master, start, end):
+    """SSE 交易日 DatetimeIndex，[start, end]"""
+    docs = db_master["trading_calendar"].find(
+        {"exchange": "SSE", "date": {"$gte": start.strftime("%Y-%m-%d"), "$lte": end.strftime("%Y-%m-%d")}},
+        {"_id": 0, "date": 1})
+    return pd.DatetimeIndex(sorted({d["date"] for d in docs})).astype(DATETIME_DTYPE)
+
+
+def _positions(dates, symbols, frame, field):
+    """frame[symbol, field] -> (行号, 列号)，不在日历 / 股票列表内的丢弃"""
+    rows = dates.get_indexer(pd.DatetimeIndex(frame[field]).normalize())
+    cols = pd.Index(symbols).get_indexer(frame["symbol"])
+    ok = (rows >= 0) & (cols >= 0)
+    return rows[ok], cols[ok]
+
+
+def _first_dates(col, field, symbols):
+    """每只股票最早的日期 (按 (symbol, field) 索引排序后 $group $first)"""
+    pipeline = [
+        {"$match": {"symbol": {"$in": list(symbols)}}},
+        {"$sort": {"symbol": 1, field: 1}},
+        {"$group": {"_id": "$symbol", "first": {"$first": f"${field}"}}},
+    ]
+    out = {d["_id"]: d["first"] for d in col.aggregate(pipeline, allowDiskUse=True)}
+    return pd.to_datetime(pd.Series(out, dtype=object).reindex(list(symbols)), errors="coerce").dt.normalize()
+
+
+def presence(db, source, symbols, dates):
+    """source 在 dates × symbols 上的覆盖 bool ndarray"""
+    field, _, kind = SOURCES[source]
+    col = db[source]
+    if kind == "step":
+        first = _first_dates(col, field, symbols)
+        first = first.fillna(pd.Timestamp.max.normalize()).to_numpy(dtype="datetime64[D]")
+        return dates.to_numpy(dtype="datetime64[D]")[:, None] >= first[None, :]
+    q = {"symbol": {"$in": list(symbols)}, field: {"$gte": dates[0].to_pydatetime(),
+                                                     "$lt": (dates[-1] + pd.Timedelta(days=1)).to_pydatetime()}}
+    df = load_frame(col, q, {"symbol": "str", field: "datetime"}, sort=[("symbol", 1), (field, 1)])
+    mask = np.zeros((len(dates), len(symbols)), dtype=bool)
+    rows, cols = _positions(dates, symbols, df, field)
+    mask[rows, cols] = True
+    return mask
+
+
+def _interval_mask(dates, symbols, intervals):
+    """intervals: {symbol: [(start, end_inclusive 或 None), ...]} -> bool ndarray"""
+    mask = np.zeros((len(dates), len(symbols)), dtype=bool)
+    for c, symbol in enumerate(symbols):
+        for start, end in intervals.get(symbol, ()):
+            lo = dates.searchsorted(pd.Timestamp(start).normalize())
+            hi = dates.searchsorted(pd.Timestamp(end).normalize(), side="right") if end is not None else len(dates)
+            mask[lo:hi, c] = True
+    return mask
+
+
+def expected(dates, symbols, info, suspensions, bars):
+    """
+    应有行情: 上市区间 [list_date, delisted_date) 内、不在停牌区间的交易日。
+    info: {symbol: stock_info 文档}；suspensions: {symbol: [{start, end}, ...]}；bars: presence("bar_daily")
+    """
+    first_bar = pd.Series(np.where(bars.any(axis=0), dates.to_numpy()[bars.argmax(axis=0)], np.datetime64("NaT")),
+                          index=symbols)
+    listed_iv = {}
+    for s in symbols:
+        doc = info.get(s, {})
+        start = pd.to_datetime(doc.get("list_date"), errors="coerce")
+        end = pd.to_datetime(doc.get("delisted_date"), errors="coerce")
+        if pd.isna(start):
+            start = first_bar[s]
+        if pd.isna(start):
+            continue
+        listed_iv[s] = [(start, None if pd.isna(end) else end - pd.Timedelta(days=1))]
+    susp_iv = {s: [(iv["start"], iv.get("end")) for iv in ivs if iv.get("start")] for s, ivs in suspensions.items()}
+    return _interval_mask(dates, symbols, listed_iv) & ~_interval_mask(dates, symbols, susp_iv)
+
+
+def build_matrix(db, symbols, dates, info, suspensions):
+    """uint8 DataFrame(index=dates, columns=symbols)，按位见 BITS"""
+    symbols = list(symbols)
+    out = np.zeros((len(dates), len(symbols)), dtype=np.uint8)
+    panels = {source: presence(db, source, symbols, dates) for source in SOURCES}
+    for source, (_, bit, _) in SOURCES.items():
+        out |= panels[source].astype(np.uint8) * np.uint8(bit)
+    out |= expected(dates, symbols, info, suspensions, panels["bar_daily"]).astype(np.uint8) * np.uint8(EXPECTED)
+    return pd.DataFrame(out, index=dates, columns=symbols)
+
+
+def missing_runs(mask, dates, symbols):
+    """bool ndarray(dates × symbols) -> 连续缺失区间 DataFrame[symbol, start, end, days] (起止均为交易日，含端点)"""
+    m = np.asarray(mask, dtype=np.int8)
+    pad = np.zeros((1, m.shape[1]), dtype=np.int8)
+    d = np.diff(np.vstack([pad, m, pad]), axis=0).T  # 按列 (股票) 优先，nonzero 结果按股票、日期有序
+    s_col, s_row = np.nonzero(d == 1)
+    _, e_row = np.nonzero(d == -1)
+    return pd.DataFrame({
+        "symbol": np.asarray(symbols, dtype=object)[s_col],
+        "start": dates[s_row],
+        "end": dates[e_row - 1],
+        "days": (e_row - s_row).astype(np.int64),
+    })
+
+
+def find_gaps(frame):
+    """build_matrix() 的结果 -> 全部缺口 DataFrame[symbol, source, start, end, days]"""
+    bits = frame.to_numpy()
+    parts = []
+    for source, (base, need) in RULES.items():
+        mask = ((bits & base) != 0) & ((bits & need) == 0)
+        parts.append(missing_runs(mask, frame.index, frame.columns).assign(source=source))
+    out = pd.concat(parts, ignore_index=True)
+    return out[["symbol", "source", "start", "end", "days"]]
+
+
+# ---------------------------------------------------------------
+# 工作清单
+# ---------------------------------------------------------------
+def save_worklist(db, gaps, symbols):
+    """
+    用本次审计结果替换 symbols 的缺口；同一 (symbol, source, start) 保留已领取次数。
+    不按 end 匹配: 延伸到最新交易日的缺口 (如 08 始终估不出值的股票) 每天 end 都会后移，
+    按 end 匹配会让 attempts 每天归零，MAX_ATTEMPTS 永远不生效。
+    """
+    col = db[COL_WORKLIST]
+    symbols = list(symbols)
+    old = {}
+    for d in col.find({"symbol": {"$in": symbols}}, {"_id": 0, "symbol": 1, "source": 1, "start": 1, "attempts": 1}):
+        key = (d["symbol"], d["source"], d["start"])
+        old[key] = max(old.get(key, 0), d.get("attempts", 0))
+    now = datetime.now()
+    docs = []
+    for r in gaps.itertuples(index=False):
+        start, end = r.start.to_pydatetime(), r.end.to_pydatetime()
+        docs.append({"symbol": r.symbol, "source": r.source, "start": start, "end": end, "days": int(r.days),
+                     "attempts": old.get((r.symbol, r.source, start), 0), "detected_at": now})
+    col.delete_many({"symbol": {"$in": symbols}})
+    if docs:
+        col.insert_many(docs, ordered=False)
+    return len(docs)
+
+
+def claim(db, source, symbols=None, max_attempts=MAX_ATTEMPTS, limit=None):
+    """
+    领取 source 的待修复缺口 (attempts < max_attempts)，领取即 attempts + 1。
+    返回 DataFrame[symbol, start, end, days]，按 symbol、start 排序
+    """
+    col = db[COL_WORKLIST]
+    q = {"source": source, "attempts": {"$lt": max_attempts}}
+    if symbols is not None:
+        q["symbol"] = {"$in": list(symbols)}
+    cursor = col.find(q, {"symbol": 1, "start": 1, "end": 1, "days": 1}).sort([("symbol", 1), ("start", 1)])
+    docs = list(cursor.limit(limit) if limit else cursor)
+    if docs:
+        col.update_many({"_id": {"$in": [d["_id"] for d in docs]}}, {"$inc": {"attempts": 1}})
+    return pd.DataFrame(docs, columns=["symbol", "start", "end", "days"])
@@ -0,0 +1,598 @@
+"""
+Module: factor_engine.py
+Description: 截面因子计算引擎 (写入 vnpy_factor)
+Features:
+    1. [Graph] 数据加载、中间面板、因子统一注册为节点，各自声明 inputs 与自身回看窗口:
+         @loader        从 Mongo 读取原始面板 (行情 / 复权因子 / 估值 / 财报 PIT / 市场指数)
+         @intermediate  共享中间量 (前复权价、日收益、EMA、真实波幅 ...)
+         @register      因子 (写入 vnpy_factor 的某个集合)
+       引擎据此构建 DAG: 只计算所选因子真正依赖的节点，有效回看 = 自身窗口 + 上游最大有效回看。
+    2. [Memo] PanelContext 对每个节点只计算一次并缓存；按引用计数在最后一个消费者用完后释放，
+       超过 MAX_CACHE_MB 时把仍被需要的面板按 LRU 溢写到 data/cache/factor_panels/。
+       新增因子只会增加它独有的中间量，不会重算其他因子的输入。
+    3. [Write] 同一集合的多个因子合并为一行宽表 {symbol, date, f1, f2, ...}，unordered bulk upsert。
+    4. [Master] factor_master 记录每个因子的 公式说明 / inputs / 有效回看 / last_date / enabled，
+       18 据此决定增量范围与启用哪些因子。
+
+说明:
+    - 价格类因子使用前复权价 (收盘价 / qfq 因子，见 verify_adjustment.py)。
+    - 价值/质量因子直接取 08 估值表中已按公告日对齐 (PIT) 的字段，避免重复实现 TTM 逻辑。
+    - 成长因子经 utils/financial_pit.py 做截面 as-of 查询 (最新报告期 vs 当时已知的上年同期)。
+    - 因子只写入当日有 K 线的 (date, symbol)，停牌 / 未上市的单元不落库。
+    - 除 beta 需要市场收益外，所有因子都只依赖单只股票的时间序列，因此可按股票分批计算以控制内存。
+"""
+
+import os
+import pickle
+import shutil
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+from pymongo import UpdateOne
+
+from . import limit_rules
+from .financial_pit import FinancialPIT, shift_report
+
+FACTOR_DB = "vnpy_factor"
+MARKET_INDEX = "sh000300"
+TRADING_DAYS_PER_YEAR = 252
+MAX_CACHE_MB = 2048
+SPILL_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "cache", "factor_panels")
+
+NODES = {}      # name -> Node (loader / intermediate / factor)
+REGISTRY = {}   # 因子子集: name -> Node
+
+
+class Node:
+    __slots__ = ("name", "kind", "func", "inputs", "lookback", "collection", "description")
+
+    def __init__(self, name, kind, func, inputs, lookback, collection=None, description=""):
+        self.name = name
+        self.kind = kind
+        self.func = func
+        self.inputs = tuple(inputs)
+        self.lookback = lookback
+        self.collection = collection
+        self.description = description or (func.__doc__ or "").strip()
+
+
+def _add(node):
+    if node.name in NODES:
+        raise ValueError(f"节点重复注册: {node.name}")
+    NODES[node.name] = node
+    if node.kind == "factor":
+        REGISTRY[node.name] = node
+    return node.func
+
+
+def loader(name, inputs=()):
+    """原始面板加载节点。func(ctx) -> DataFrame / dict"""
+    return lambda func: _add(Node(name, "loader", func, inputs, 0))
+
+
+def intermediate(name, inputs, lookback=0):
+    """共享中间量节点。func(ctx) -> DataFrame"""
+    return lambda func: _add(Node(name, "intermediate", func, inputs, lookback))
+
+
+def register(name, collection, inputs, lookback=0, description=""):
+    """因子节点。func(ctx) -> DataFrame (日期 × 股票)"""
+    return lambda func: _add(Node(name, "factor", func, inputs, lookback, collection, description))
+
+
+# =========================================================================
+# DAG
+# =========================================================================
+def closure(targets):
+    """targets 依赖的全部节点 (拓扑序: 上游在前)"""
+    order, seen = [], set()
+
+    def visit(name, path):
+        if name in seen:
+            return
+        if name in path:
+            raise ValueError(f"因子依赖存在环: {' -> '.join(path + (name,))}")
+        if name not in NODES:
+            raise KeyError(f"未注册的节点: {name}")
+        for inp in NODES[name].inputs:
+            visit(inp, path + (name,))
+        seen.add(name)
+        order.append(name)
+
+    for t in targets:
+        visit(t, ())
+    return order
+
+
+def effective_lookback(name, _memo=None):
+    """自身窗口 + 上游最大有效回看 (交易日)"""
+    memo = {} if _memo is None else _memo
+    if name not in memo:
+        node = NODES[name]
+        memo[name] = node.lookback + max((effective_lookback(i, memo) for i in node.inputs), default=0)
+    return memo[name]
+
+
+class PanelContext:
+    """
+    一批股票的面板缓存。ctx[name] 按需计算节点并记忆化；
+    消费者全部用完后释放，超出内存上限时把仍需要的面板溢写到磁盘。
+    """
+
+    def __init__(self, db, symbols, start, end=None, targets=(), max_cache_mb=MAX_CACHE_MB, spill_dir=SPILL_DIR):
+        self.db = db
+        self.symbols = list(symbols)
+        self.start = start
+        self.end = end
+        self.max_bytes = max_cache_mb * 1024 * 1024
+        self.spill_dir = os.path.join(spill_dir, f"{os.getpid()}_{id(self)}")
+        self._mem = OrderedDict()
+        self._bytes = {}
+        self._spilled = {}
+        self._computing = set()
+        self.timings = OrderedDict()
+        self.spills = 0
+
+        # 引用计数: 每个节点被多少个 (所选闭包内的) 下游节点使用
+        self._refs = {n: 0 for n in closure(targets)}
+        for n in self._refs:
+            for inp in NODES[n].inputs:
+                self._refs[inp] += 1
+
+    # ---------------------------------------------------------------
+    def __getitem__(self, name):
+        if name in self._mem:
+            self._mem.move_to_end(name)
+            return self._mem[name]
+        if name in self._spilled:
+            with open(self._spilled.pop(name), "rb") as f:
+                value = pickle.load(f)
+            self._store(name, value)
+            return value
+
+        node = NODES[name]
+        self._computing.add(name)
+        t0 = time.perf_counter()
+        with np.errstate(divide="ignore", invalid="ignore"):
+            value = node.func(self)
+        self.timings[name] = time.perf_counter() - t0
+        self._computing.discard(name)
+        self._store(name, value)
+        for inp in node.inputs:
+            self.release(inp)
+        return value
+
+    def __contains__(self, name):
+        return name in self._mem or name in self._spilled
+
+    @property
+    def index(self):
+        return self["close"].index
+
+    @property
+    def columns(self):
+        return self["close"].columns
+
+    def release(self, name):
+        """一个消费者用完了该节点；计数归零即释放"""
+        if name not in self._refs:
+            return
+        self._refs[name] -= 1
+        if self._refs[name] <= 0:
+            self._drop(name)
+
+    # ---------------------------------------------------------------
+    @staticmethod
+    def _sizeof(value):
+        if isinstance(value, pd.DataFrame):
+            return int(value.memory_usage(deep=False).sum())
+        if isinstance(value, pd.Series):
+            return int(value.memory_usage(deep=False))
+        if isinstance(value, dict):
+            return sum(PanelContext._sizeof(v) for v in value.values())
+        return 0
+
+    def _store(self, name, value):
+        self._mem[name] = value
+        self._bytes[name] = self._sizeof(value)
+        self._evict()
+
+    def _drop(self, name):
+        self._mem.pop(name, None)
+        self._bytes.pop(name, None)
+        path = self._spilled.pop(name, None)
+        if path and os.path.exists(path):
+            os.remove(path)
+
+    def _evict(self):
+        """超出上限时从最久未用的面板开始淘汰 (刚存入的与正在计算的节点除外)"""
+        newest = next(reversed(self._mem), None)
+        while sum(self._bytes.values()) > self.max_bytes:
+            victim = next((n for n in self._mem if n != newest and n not in self._computing), None)
+            if victim is None:
+                return
+            value = self._mem.pop(victim)
+            self._bytes.pop(victim)
+            if self._refs.get(victim, 0) > 0:
+                os.makedirs(self.spill_dir, exist_ok=True)
+                path = os.path.join(self.spill_dir, f"{victim}.pkl")
+                with open(path, "wb") as f:
+                    pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+                self._spilled[victim] = path
+                self.spills += 1
+
+    def close(self):
+        self._mem.clear()
+        self._bytes.clear()
+        self._spilled.clear()
+        shutil.rmtree(self.spill_dir, ignore_errors=True)
+
+
+# =========================================================================
+# 加载节点
+# =========================================================================
+def _pivot(docs, date_field, fields):
+    df = pd.DataFrame(docs)
+    if df.empty:
+        return {f: pd.DataFrame() for f in fields}
+    df[date_field] = pd.to_datetime(df[date_field])
+    df = df.drop_duplicates(["symbol", date_field], keep="last")
+    return {f: df.pivot(index=date_field, columns="symbol", values=f).sort_index()
+            for f in fields if f in df.columns}
+
+
+def _date_q(ctx):
+    q = {"$gte": ctx.start}
+    if ctx.end is not None:
+        q["$lte"] = ctx.end
+    return q
+
+
+BAR_FIELDS = {"close": "close_price", "high": "high_price", "low": "low_price",
+              "volume": "volume", "turnover_rate": "turnover_rate"}
+VALUATION_FIELDS = ["net_profit_ttm", "total_equity_latest", "total_mv", "roe_ttm"]
+FINANCIAL_FIELDS = ["revenue", "net_profit"]
+
+
+@loader("bars")
+def load_bars(ctx):
+    """bar_daily 原始行情 (close/high/low/volume/turnover_rate)"""
+    q = {"symbol": {"$in": ctx.symbols}, "datetime": _date_q(ctx)}
+    proj = {"_id": 0, "symbol": 1, "datetime": 1, **{f: 1 for f in BAR_FIELDS.values()}}
+    raw = _pivot(list(ctx.db["bar_daily"].find(q, proj)), "datetime", list(BAR_FIELDS.values()))
+    close = raw.get("close_price", pd.DataFrame())
+    return {k: raw.get(f, pd.DataFrame()).reindex(index=close.index, columns=close.columns)
+            for k, f in BAR_FIELDS.items()}
+
+
+def _bar_field(key):
+    return lambda ctx: ctx["bars"][key]
+
+
+for _key in BAR_FIELDS:
+    intermediate(_key, ["bars"])(_bar_field(_key))
+
+
+@loader("adj_factor", inputs=["close"])
+def load_adj_factor(ctx):
+    """前复权因子 (阶梯序列，包含 start 之前最近的一条后前向填充)"""
+    close = ctx["close"]
+    q = {"symbol": {"$in": ctx.symbols}}
+    if ctx.end is not None:
+        q["date"] = {"$lte": ctx.end}
+    adj = _pivot(list(ctx.db["adjust_factor"].find(q, {"_id": 0, "symbol": 1, "date": 1, "factor": 1})),
+                 "date", ["factor"]).get("factor", pd.DataFrame())
+    if adj.empty:
+        return pd.DataFrame(1.0, index=close.index, columns=close.columns)
+    return adj.reindex(close.index.union(adj.index)).ffill().reindex(
+        index=close.index, columns=close.columns).fillna(1.0)
+
+
+@loader("valuation", inputs=["close"])
+def load_valuation(ctx):
+    """valuation_daily 中已 PIT 对齐的财务字段"""
+    close = ctx["close"]
+    q = {"symbol": {"$in": ctx.symbols}, "date": _date_q(ctx)}
+    proj = {"_id": 0, "symbol": 1, "date": 1, **{f: 1 for f in VALUATION_FIELDS}}
+    val = _pivot(list(ctx.db["valuation_daily"].find(q, proj)), "date", VALUATION_FIELDS)
+    return {f: val.get(f, pd.DataFrame()).reindex(index=close.index, columns=close.columns)
+            for f in VALUATION_FIELDS}
+
+
+def _val_field(key):
+    return lambda ctx: ctx["valuation"][key]
+
+
+for _key in VALUATION_FIELDS:
+    intermediate(f"val_{_key}", ["valuation"])(_val_field(_key))
+
+
+@loader("financials", inputs=["close"])
+def load_financials(ctx):
+    """财报 PIT: 各交易日已公告的最新报告期累计值 ({f}) 与该报告期上年同期的当时已知值 ({f}_ly)"""
+    close = ctx["close"]
+    pit = FinancialPIT.load(ctx.db, FINANCIAL_FIELDS, symbols=ctx.symbols)
+    out = {}
+    for f in FINANCIAL_FIELDS:
+        cur, rep = pit.asof(f, close.index, symbols=close.columns, with_report=True)
+        out[f] = cur
+        out[f"{f}_ly"] = pit.period(f, shift_report(rep, years=1), close.index)
+    return out
+
+
+def _fin_field(key):
+    return lambda ctx: ctx["financials"][key]
+
+
+for _key in FINANCIAL_FIELDS:
+    intermediate(f"fin_{_key}", ["financials"])(_fin_field(_key))
+    intermediate(f"fin_{_key}_ly", ["financials"])(_fin_field(f"{_key}_ly"))
+
+
+@loader("mkt_ret", inputs=["close"])
+def load_mkt_ret(ctx):
+    """市场 (沪深300) 日收益，对齐到股票交易日"""
+    index = ctx["close"].index
+    q = {"symbol": MARKET_INDEX, "datetime": {"$gte": ctx.start.strftime("%Y-%m-%d")}}
+    mkt = pd.DataFrame(list(ctx.db["index_daily"].find(q, {"_id": 0, "datetime": 1, "close": 1})))
+    if mkt.empty:
+        return pd.Series(np.nan, index=index)
+    mkt = mkt.assign(datetime=pd.to_datetime(mkt["datetime"])).set_index("datetime")["close"].sort_index()
+    return mkt.pct_change().reindex(index)
+
+
+# =========================================================================
+# 共享中间量
+# =========================================================================
+def _ema(df, span):
+    return df.ewm(span=span, adjust=False, min_periods=span).mean()
+
+
+@intermediate("adj_close", ["close", "adj_factor"])
+def adj_close(ctx):
+    return ctx["close"] / ctx["adj_factor"]
+
+
+@intermediate("adj_high", ["high", "adj_factor"])
+def adj_high(ctx):
+    return ctx["high"] / ctx["adj_factor"]
+
+
+@intermediate("adj_low", ["low", "adj_factor"])
+def adj_low(ctx):
+    return ctx["low"] / ctx["adj_factor"]
+
+
+@intermediate("ret", ["adj_close"], lookback=1)
+def ret(ctx):
+    """前复权日收益"""
+    return ctx["adj_close"].pct_change(fill_method=None)
+
+
+@intermediate("raw_pct", ["close"], lookback=1)
+def raw_pct(ctx):
+    """原始收盘价涨跌幅 (用于涨跌停判断)"""
+    return ctx["close"] / ctx["close"].shift(1) - 1
+
+
+@intermediate("ema_12", ["adj_close"], lookback=60)
+def ema_12(ctx):
+    return _ema(ctx["adj_close"], 12)
+
+
+@intermediate("ema_26", ["adj_close"], lookback=100)
+def ema_26(ctx):
+    return _ema(ctx["adj_close"], 26)
+
+
+@intermediate("macd_dif_panel", ["ema_12", "ema_26"])
+def macd_dif_panel(ctx):
+    return ctx["ema_12"] - ctx["ema_26"]
+
+
+@intermediate("macd_dea_panel", ["macd_dif_panel"], lookback=20)
+def macd_dea_panel(ctx):
+    return _ema(ctx["macd_dif_panel"], 9)
+
+
+@intermediate("true_range", ["adj_high", "adj_low", "adj_close"], lookback=1)
+def true_range(ctx):
+    prev = ctx["adj_close"].shift(1)
+    high, low = ctx["adj_high"], ctx["adj_low"]
+    return np.maximum(high - low, np.maximum((high - prev).abs(), (low - prev).abs()))
+
+
+@intermediate("limit_ratio", ["close"])
+def limit_ratio(ctx):
+    """涨跌停幅度矩阵 (按板块，见 utils/limit_rules.py)"""
+    return limit_rules.board_ratio(ctx.index, ctx.columns)
+
+
+# =========================================================================
+# 因子库
+# =========================================================================
+@register("rsi_14", "factor_technical", ["adj_close"], lookback=60)
+def rsi_14(ctx):
+    """RSI(14)，Wilder 平滑"""
+    diff = ctx["adj_close"].diff()
+    gain = diff.clip(lower=0).ewm(alpha=1 / 14, adjust=False, min_periods=14).mean()
+    loss = (-diff.clip(upper=0)).ewm(alpha=1 / 14, adjust=False, min_periods=14).mean()
+    return 100 - 100 / (1 + gain / loss.replace(0, np.nan))
+
+
+@register("macd_dif", "factor_technical", ["macd_dif_panel"])
+def macd_dif(ctx):
+    """MACD 快线 DIF = EMA12 - EMA26"""
+    return ctx["macd_dif_panel"]
+
+
+@register("macd_dea", "factor_technical", ["macd_dea_panel"])
+def macd_dea(ctx):
+    """MACD 慢线 DEA = EMA9(DIF)"""
+    return ctx["macd_dea_panel"]
+
+
+@register("macd", "factor_technical", ["macd_dif_panel", "macd_dea_panel"])
+def macd(ctx):
+    """MACD 柱 = 2 × (DIF - DEA)"""
+    return 2 * (ctx["macd_dif_panel"] - ctx["macd_dea_panel"])
+
+
+@register("mom_1m", "factor_momentum", ["adj_close"], lookback=21)
+def mom_1m(ctx):
+    """近 21 个交易日收益率"""
+    return ctx["adj_close"] / ctx["adj_close"].shift(21) - 1
+
+
+@register("mom_12m", "factor_momentum", ["adj_close"], lookback=TRADING_DAYS_PER_YEAR)
+def mom_12m(ctx):
+    """12-1 动量: t-252 到 t-21 的收益率 (剔除最近一个月反转效应)"""
+    return ctx["adj_close"].shift(21) / ctx["adj_close"].shift(TRADING_DAYS_PER_YEAR) - 1
+
+
+@register("ep_ttm", "factor_value", ["val_net_profit_ttm", "val_total_mv"])
+def ep_ttm(ctx):
+    """盈利收益率 = 归母净利润TTM / 总市值 (可为负，避免 PE 在亏损时失真)"""
+    mv = ctx["val_total_mv"]
+    return ctx["val_net_profit_ttm"] / mv.where(mv > 0)
+
+
+@register("bp", "factor_value", ["val_total_equity_latest", "val_total_mv"])
+def bp(ctx):
+    """账面市值比 = 归母净资产 / 总市值"""
+    mv = ctx["val_total_mv"]
+    return ctx["val_total_equity_latest"] / mv.where(mv > 0)
+
+
+@register("roe_ttm", "factor_quality", ["val_roe_ttm"])
+def roe_ttm(ctx):
+    """ROE(TTM)，取自估值表"""
+    return ctx["val_roe_ttm"]
+
+
+@register("rev_yoy", "factor_quality", ["fin_revenue", "fin_revenue_ly"])
+def rev_yoy(ctx):
+    """营业收入同比 = 最新报告期累计营收 / 上年同期 - 1 (均为当日已公告版本)"""
+    ly = ctx["fin_revenue_ly"]
+    return ctx["fin_revenue"] / ly.where(ly > 0) - 1
+
+
+@register("np_yoy", "factor_quality", ["fin_net_profit", "fin_net_profit_ly"])
+def np_yoy(ctx):
+    """归母净利润同比 = (本期 - 上年同期) / |上年同期| (分母取绝对值，亏损转盈为正)"""
+    ly = ctx["fin_net_profit_ly"]
+    return (ctx["fin_net_profit"] - ly) / ly.abs().replace(0, np.nan)
+
+
+@register("atr_14", "factor_volatility", ["true_range", "adj_close"], lookback=60)
+def atr_14(ctx):
+    """ATR(14) / 收盘价，前复权口径 (归一化后可跨股票比较)"""
+    return ctx["true_range"].ewm(alpha=1 / 14, adjust=False, min_periods=14).mean() / ctx["adj_close"]
+
+
+@register("std_20", "factor_volatility", ["ret"], lookback=20)
+def std_20(ctx):
+    """20 日收益率标准差"""
+    return ctx["ret"].rolling(20, min_periods=15).std()
+
+
+@register("beta_60", "factor_volatility", ["ret", "mkt_ret"], lookback=60)
+def beta_60(ctx):
+    """对沪深300 的 60 日 beta = cov(r, m) / var(m)"""
+    r = ctx["ret"]
+    m = pd.DataFrame(np.repeat(ctx["mkt_ret"].values[:, None], r.shape[1], axis=1), index=r.index, columns=r.columns)
+    valid = r.notna() & m.notna()
+    r, m = r.where(valid), m.where(valid)
+    roll = dict(window=60, min_periods=40)
+    cov = (r * m).rolling(**roll).mean() - r.rolling(**roll).mean() * m.rolling(**roll).mean()
+    var = (m ** 2).rolling(**roll).mean() - m.rolling(**roll).mean() ** 2
+    return cov / var.replace(0, np.nan)
+
+
+@register("limit_up_count_20", "factor_sentiment", ["raw_pct", "limit_ratio"], lookback=20)
+def limit_up_count_20(ctx):
+    """近 20 个交易日涨停次数 (原始收盘价涨幅 >= 涨停幅度 - 0.5%)"""
+    pct = ctx["raw_pct"]
+    hit = (pct >= ctx["limit_ratio"] - 0.005).astype(float).where(pct.notna())
+    return hit.rolling(20, min_periods=1).sum()
+
+
+@register("turnover_std_20", "factor_sentiment", ["turnover_rate"], lookback=20)
+def turnover_std_20(ctx):
+    """20 日换手率标准差"""
+    return ctx["turnover_rate"].rolling(20, min_periods=15).std()
+
+
+# =========================================================================
+# 计算与写入
+# =========================================================================
+def compute(ctx, names):
+    """
+    按 DAG 计算所选因子，返回 {collection: DataFrame(long: date, symbol, f1, f2, ...)}。
+    只保留当日有 K 线的 (date, symbol): ewm / rolling(min_periods) 会把值带过停牌日，不能写成停牌日的因子。
+    """
+    traded = ctx["close"].notna()
+    by_col = {}
+    for name in names:
+        wide = ctx[name].replace([np.inf, -np.inf], np.nan)
+        wide = wide.where(traded.reindex(index=wide.index, columns=wide.columns, fill_value=False))
+        by_col.setdefault(REGISTRY[name].collection, []).append(wide.stack(future_stack=True).rename(name))
+        ctx.release(name)
+
+    out = {}
+    for col, series in by_col.items():
+        df = pd.concat(series, axis=1)
+        df.index.names = ["date", "symbol"]
+        out[col] = df.dropna(how="all").reset_index()
+    return out
+
+
+def to_ops(df):
+    ops = []
+    fields = [c for c in df.columns if c not in ("symbol", "date")]
+    for rec in df.to_dict("records"):
+        doc = {f: float(rec[f]) for f in fields if pd.notna(rec[f])}
+        dt = rec["date"].to_pydatetime()
+        ops.append(UpdateOne({"symbol": rec["symbol"], "date": dt}, {"$set": doc}, upsert=True))
+    return ops
+
+
+def lookback_start(db_master, first_date, lookback):
+    """first_date 之前第 lookback 个交易日 (日历缺失时按 1.5 倍自然日估算)"""
+    if lookback <= 0:
+        return first_date
+    docs = list(db_master["trading_calendar"].find(
+        {"exchange": "SSE", "date": {"$lt": first_date.strftime("%Y-%m-%d")}}, {"date": 1}
+    ).sort("date", -1).limit(lookback))
+    if len(docs) == lookback:
+        return datetime.strptime(docs[-1]["date"], "%Y-%m-%d")
+    return first_date - timedelta(days=int(lookback * 1.5) + 10)
+
+
+def load_master(db_factor):
+    return {d["factor_name"]: d for d in db_factor["factor_master"].find({}, {"_id": 0})}
+
+
+def enabled_factors(master):
+    """已注册且未在 factor_master 中被停用 (enabled=False) 的因子"""
+    return [n for n in REGISTRY if master.get(n, {}).get("enabled", True)]
+
+
+def update_master(db_factor, names, last_date=None):
+    ops = []
+    for name in names:
+        node = REGISTRY[name]
+        doc = {
+            "factor_name": name, "collection": node.collection, "formula": node.description,
+            "inputs": list(node.inputs), "lookback": effective_lookback(name),
+            "depends_on": [n for n in closure([name]) if NODES[n].kind == "loader"],
+            "updated_at": datetime.now(),
+        }
+        if last_date is not None:
+            doc["last_date"] = last_date
+        ops.append(UpdateOne({"factor_name": name}, {"$set": doc, "$setOnInsert": {"enabled": True}}, upsert=True))
+    if ops:
+        db_factor["factor_master"].bulk_write(ops, ordered=False)
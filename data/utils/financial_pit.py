@@ -0,0 +1,192 @@
+"""
+Module: financial_pit.py
+Description: 财务报表 Point-in-Time 查询引擎 (全市场常驻内存)
+Features:
+    1. [Load] 一次读入全市场规范化财报快照 (finance_std，字段名见 utils/financial_schema.CANONICAL)，
+       每个字段整理为 symbol / report_date / publish_date / value 四个 NumPy 数组；
+       快照中没有的股票 (21 尚未运行，或 06 只同步了部分股票) 从原始三表现场规范化补上。
+    2. [As-of] asof(field, dates) -> 日期 × 股票 面板: 各日期已公告的最新报告期的值。
+       查询键为复合整数 (symbol, publish_date)，几千个日期 × 全市场是一次向量化 searchsorted。
+    3. [Period] period(field, report_dates, dates) -> 指定报告期在各日期已知的值 (同比 / TTM 的上年同期)，
+       查询键为 (symbol, report_date, publish_date)。
+    4. [Restatement] 同一报告期的多次公告按 publish_date 区分版本，查询只看得到当时已公告的版本:
+         history(field, symbol, as_of)  某日视角下的完整报告期历史
+         versions(field, symbol)        全部公告版本轨迹
+       "最新报告期" 只前进不后退: 年报之后才补发的旧季报更正不会把 asof 拉回旧报告期，
+       但该更正在 period / history 中可见。
+
+用法:
+    pit = FinancialPIT.load(db, ["revenue", "net_profit"])
+    rev, rep = pit.asof("revenue", trade_days, with_report=True)
+    rev_ly = pit.period("revenue", shift_report(rep, years=1), trade_days)
+
+说明: 06 目前按 (symbol, report_date) upsert，库中每个报告期只保留最后抓取的一版；
+      引擎按多版本设计，数据源保留版本后无需修改即可得到完整的更正视角。
+"""
+
+import numpy as np
+import pandas as pd
+
+from . import financial_schema
+from .mongo_loader import DATETIME_DTYPE
+
+# --- 配置 ---
+DAY_BITS = 16           # 日期编码为 1970-01-01 起的天数，16 位可到 2149 年
+QUERY_CELLS = 4_000_000  # asof / period 每批查询的单元格数 (控制临时数组内存)
+
+
+def _days(values):
+    """日期序列 / 面板 -> int64 天数 (NaT -> -1)"""
+    arr = np.asarray(values, dtype="datetime64[D]")
+    out = arr.astype(np.int64)
+    out[np.isnat(arr)] = -1
+    return out
+
+
+def shift_report(report_dates, years=1):
+    """报告期 (季末) 平移 years 年，保持月末: 2024-03-31 -> 2023-03-31；面板进面板出"""
+    arr = np.asarray(report_dates, dtype="datetime64[D]")
+    month_end = (arr.astype("datetime64[M]") - 12 * years + 1).astype("datetime64[D]") - 1
+    if isinstance(report_dates, pd.DataFrame):
+        return pd.DataFrame(month_end, index=report_dates.index, columns=report_dates.columns)
+    return month_end
+
+
+class FinancialPIT:
+    def __init__(self):
+        self.symbols = []
+        self._code = {}
+        self._fields = {}  # field -> dict(arrays)
+
+    @classmethod
+    def load(cls, db, fields=("net_profit", "revenue", "equity"), symbols=None):
+        fields = list(fields)
+        df = financial_schema.load_std(db[financial_schema.COL_STD], symbols, fields)
+        raw = {k: db[v] for k, v in financial_schema.SHEETS.items()}
+        wanted = set(symbols) if symbols is not None else {s for col in raw.values() for s in col.distinct("symbol")}
+        missing = sorted(wanted - set(df["symbol"]))
+        if missing:
+            extra = financial_schema.normalize(raw, missing)[["symbol", "report_date", "publish_date", *fields]]
+            df = extra if df.empty else pd.concat([df, extra], ignore_index=True)
+        keys = df[["symbol", "report_date", "publish_date"]]
+        return cls.from_frames({f: keys.assign(value=df[f]) for f in fields})
+
+    @classmethod
+    def from_frames(cls, frames):
+        """frames: {field: DataFrame[symbol, report_date, publish_date, value]}，每行一个公告版本"""
+        obj = cls()
+        obj.symbols = sorted({s for df in frames.values() for s in df["symbol"].dropna().unique()})
+        obj._code = {s: i for i, s in enumerate(obj.symbols)}
+        for field, df in frames.items():
+            obj._fields[field] = obj._index(df)
+        return obj
+
+    def _index(self, df):
+        sym = df["symbol"].map(self._code).to_numpy()
+        rep, pub = _days(df["report_date"]), _days(df["publish_date"])
+        val = pd.to_numeric(df["value"], errors="coerce").to_numpy(np.float64)
+        # 没有公告日的记录无法确定何时可见；值缺失的版本不参与 as-of
+        ok = ~pd.isna(sym) & (rep >= 0) & (pub >= 0) & ~np.isnan(val)
+        sym, rep, pub, val = sym[ok].astype(np.int64), rep[ok], pub[ok], val[ok]
+
+        # 报告期索引: (symbol, report_date, publish_date)
+        pkey = (sym << (2 * DAY_BITS)) | (rep << DAY_BITS) | pub
+        order = np.argsort(pkey, kind="stable")
+
+        # 最新报告期索引: 按 (symbol, publish_date, report_date) 排序后，只保留报告期不倒退的版本
+        lorder = np.lexsort((rep, pub, sym))
+        s, r = sym[lorder], rep[lorder]
+        sr = (s << DAY_BITS) | r
+        effective = sr >= np.maximum.accumulate(sr)
+        lorder = lorder[effective]
+
+        return {
+            "sym": sym, "rep": rep, "pub": pub, "val": val,
+            "pkey": pkey[order], "pval": val[order],
+            "lkey": (sym[lorder] << DAY_BITS) | pub[lorder], "lrep": rep[lorder], "lval": val[lorder],
+        }
+
+    # ---------------------------------------------------------------
+    # 查询
+    # ---------------------------------------------------------------
+    def fields(self):
+        return list(self._fields)
+
+    def _columns(self, symbols):
+        cols = list(self.symbols) if symbols is None else list(symbols)
+        codes = np.array([self._code.get(s, -1) for s in cols], dtype=np.int64)
+        return cols, codes
+
+    def asof(self, field, dates, symbols=None, with_report=False):
+        """
+        每个日期 (收盘后视角，当日公告可见) 已知的最新报告期的值。
+        返回 DataFrame(index=dates, columns=symbols)；with_report=True 时另返回报告期面板 (datetime64)。
+        """
+        idx = self._fields[field]
+        index = pd.DatetimeIndex(dates)
+        cols, codes = self._columns(symbols)
+        d = _days(index)
+        values = np.full((len(d), len(cols)), np.nan)
+        reports = np.full((len(d), len(cols)), -1, dtype=np.int64)
+        step = max(1, QUERY_CELLS // max(len(cols), 1))
+        for lo in range(0, len(d), step):
+            q = (codes[None, :] << DAY_BITS) | d[lo:lo + step, None]
+            pos = np.searchsorted(idx["lkey"], q, side="right") - 1
+            hit = (pos >= 0) & (codes[None, :] >= 0)
+            hit[hit] &= (idx["lkey"][pos[hit]] >> DAY_BITS) == np.broadcast_to(codes, q.shape)[hit]
+            values[lo:lo + step][hit] = idx["lval"][pos[hit]]
+            reports[lo:lo + step][hit] = idx["lrep"][pos[hit]]
+        out = pd.DataFrame(values, index=index, columns=cols)
+        if not with_report:
+            return out
+        rep = reports.astype("datetime64[D]")
+        rep[reports < 0] = np.datetime64("NaT")
+        return out, pd.DataFrame(rep.astype(DATETIME_DTYPE), index=index, columns=cols)
+
+    def period(self, field, report_dates, dates, symbols=None):
+        """
+        指定报告期在各日期已知的值 (该报告期截至当日的最新公告版本)。
+        report_dates: 单个报告期，或与 (dates × symbols) 对齐的报告期面板 (如 asof 返回的 rep 经 shift_report)
+        """
+        idx = self._fields[field]
+        index = pd.DatetimeIndex(dates)
+        if isinstance(report_dates, pd.DataFrame):
+            symbols = report_dates.columns if symbols is None else symbols
+            rep_all = _days(report_dates.reindex(index=index, columns=symbols))
+        else:
+            rep_all = None
+        cols, codes = self._columns(symbols)
+        d = _days(index)
+        if rep_all is None:
+            rep_all = np.full((len(d), len(cols)), _days([report_dates])[0], dtype=np.int64)
+
+        values = np.full((len(d), len(cols)), np.nan)
+        step = max(1, QUERY_CELLS // max(len(cols), 1))
+        for lo in range(0, len(d), step):
+            rep = rep_all[lo:lo + step]
+            q = (codes[None, :] << (2 * DAY_BITS)) | (rep.clip(0) << DAY_BITS) | d[lo:lo + step, None]
+            pos = np.searchsorted(idx["pkey"], q, side="right") - 1
+            hit = (pos >= 0) & (codes[None, :] >= 0) & (rep >= 0)
+            hit[hit] &= (idx["pkey"][pos[hit]] >> DAY_BITS) == (q[hit] >> DAY_BITS)
+            values[lo:lo + step][hit] = idx["pval"][pos[hit]]
+        return pd.DataFrame(values, index=index, columns=cols)
+
+    def _records(self, field, symbol):
+        idx = self._fields[field]
+        code = self._code.get(symbol, -1)
+        m = idx["sym"] == code
+        df = pd.DataFrame({"report_date": idx["rep"][m].astype("datetime64[D]").astype(DATETIME_DTYPE),
+                           "publish_date": idx["pub"][m].astype("datetime64[D]").astype(DATETIME_DTYPE),
+                           "value": idx["val"][m]})
+        return df.sort_values(["report_date", "publish_date"], kind="mergesort", ignore_index=True)
+
+    def versions(self, field, symbol):
+        """某股票该字段的全部公告版本 DataFrame[report_date, publish_date, value]"""
+        return self._records(field, symbol)
+
+    def history(self, field, symbol, as_of=None):
+        """as_of 当日视角的报告期历史: 每个报告期取截至当日最后一次公告的值；as_of=None 为最新视角"""
+        df = self._records(field, symbol)
+        if as_of is not None:
+            df = df[df["publish_date"] <= pd.Timestamp(as_of)]
+        return df.drop_duplicates("report_date", keep="last").reset_index(drop=True)
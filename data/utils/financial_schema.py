@@ -0,0 +1,161 @@
+"""
+Module: financial_schema.py
+Description: 新浪三大报表的规范化字段与列式快照 (finance_std)
+Features:
+    1. [Canonical] CANONICAL 把每个英文规范字段映射到 (报表, 中文候选列 按优先级)；
+       别名探测与 pd.to_numeric 只在入库 / 同步时做一次，下游直接读 float64。
+    2. [Columnar] finance_std 每只股票一个文档，按列存储 (报告期升序):
+         {symbol, report_date: [...], publish_date: [...], net_profit: [...], revenue: [...], ..., schema_version}
+       缺失值存 NaN；publish_date 取 利润表 -> 资产负债表 -> 现金流量表 的第一个非空公告日 (与 08 一致)。
+       全市场批量读取约 5000 个文档，而不是三张宽表的几十万行、数百个中文字段。
+    3. [Sync] sync(db, symbols) 从原始三表重建指定股票的快照 (06 下载后即时调用，21 全量 / 增量补齐)。
+    4. [Read] load_std(col, symbols, fields) 返回长表 [symbol, report_date, publish_date, fields...]；
+       doc_to_frame(doc) 给单只股票使用 (08)。
+
+注意: 新增 / 修改规范字段后需提升 SCHEMA_VERSION 并运行 21 重建 (21 会自动重建旧版本文档)。
+"""
+
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from pymongo import UpdateOne
+
+from .mongo_loader import DATETIME_DTYPE, load_frame
+
+# --- 配置 ---
+COL_STD = "finance_std"
+SCHEMA_VERSION = 1
+
+SHEETS = {"income": "finance_income", "balance": "finance_balance", "cashflow": "finance_cashflow"}
+
+# 规范字段 -> (报表, 候选列)
+CANONICAL = {
+    # 利润表
+    "revenue": ("income", ["营业总收入", "营业收入"]),
+    "operating_revenue": ("income", ["营业收入"]),
+    "operating_profit": ("income", ["营业利润"]),
+    "total_profit": ("income", ["利润总额"]),
+    "net_profit": ("income", ["归属于母公司所有者的净利润", "归属于母公司股东的净利润", "归属于母公司的净利润", "净利润"]),
+    "net_profit_total": ("income", ["净利润"]),
+    "eps_basic": ("income", ["基本每股收益"]),
+    # 资产负债表
+    "total_assets": ("balance", ["资产总计"]),
+    "total_liabilities": ("balance", ["负债合计"]),
+    "cash": ("balance", ["货币资金"]),
+    "equity": ("balance", ["归属于母公司股东权益合计", "归属于母公司股东的权益", "归属于上市公司股东的权益",
+                           "所有者权益合计", "股东权益合计"]),
+    "other_equity": ("balance", ["其他权益工具"]),
+    # 现金流量表
+    "operating_cashflow": ("cashflow", ["经营活动产生的现金流量净额"]),
+    "investing_cashflow": ("cashflow", ["投资活动产生的现金流量净额"]),
+    "financing_cashflow": ("cashflow", ["筹资活动产生的现金流量净额"]),
+    "capex": ("cashflow", ["购建固定资产、无形资产和其他长期资产支付的现金"]),
+}
+PUBLISH_ORDER = ["income", "balance", "cashflow"]
+
+
+def fields_of(sheet):
+    return [f for f, (s, _) in CANONICAL.items() if s == sheet]
+
+
+# ---------------------------------------------------------------
+# 原始宽表 -> 规范长表
+# ---------------------------------------------------------------
+def read_sheet(col, sheet, symbols=None):
+    """读取一张原始报表，返回 [symbol, report_date, publish_date, 规范字段...] (float64)"""
+    raw_cols = list(dict.fromkeys(c for f in fields_of(sheet) for c in CANONICAL[f][1]))
+    query = {"symbol": {"$in": list(symbols)}} if symbols is not None else {}
+    df = load_frame(col, query, {"symbol": "str", "report_date": "datetime", "publish_date": "datetime",
+                                 **{c: "float" for c in raw_cols}})
+    out = df[["symbol", "report_date", "publish_date"]].copy()
+    for f in fields_of(sheet):
+        value = pd.Series(np.nan, index=df.index)
+        for c in CANONICAL[f][1]:
+            value = value.fillna(df[c])
+        out[f] = value
+    out = out.dropna(subset=["symbol", "report_date"])
+    return out.drop_duplicates(["symbol", "report_date"], keep="last")
+
+
+def normalize(collections, symbols=None):
+    """
+    collections: {"income": Collection, "balance": ..., "cashflow": ...} (缺少的报表跳过)
+    返回规范长表，每个 (symbol, report_date) 一行
+    """
+    merged = None
+    for sheet in PUBLISH_ORDER:
+        if sheet not in collections:
+            continue
+        df = read_sheet(collections[sheet], sheet, symbols).rename(columns={"publish_date": f"publish_{sheet}"})
+        merged = df if merged is None else merged.merge(df, on=["symbol", "report_date"], how="outer")
+    if merged is None or merged.empty:
+        return pd.DataFrame(columns=["symbol", "report_date", "publish_date", *CANONICAL])
+
+    publish = pd.Series(pd.NaT, index=merged.index, dtype=DATETIME_DTYPE)
+    for sheet in PUBLISH_ORDER:
+        if f"publish_{sheet}" in merged:
+            publish = publish.fillna(merged.pop(f"publish_{sheet}"))
+    merged.insert(2, "publish_date", publish)
+    for f in CANONICAL:
+        if f not in merged:
+            merged[f] = np.nan
+    return merged.sort_values(["symbol", "report_date"], ignore_index=True)
+
+
+# ---------------------------------------------------------------
+# 列式快照
+# ---------------------------------------------------------------
+def _dates(values):
+    return [None if pd.isna(v) else v.to_pydatetime() for v in pd.DatetimeIndex(values)]
+
+
+def to_docs(df):
+    now = datetime.now()
+    docs = []
+    for symbol, grp in df.groupby("symbol", sort=False):
+        doc = {"symbol": symbol, "report_date": _dates(grp["report_date"]),
+               "publish_date": _dates(grp["publish_date"]), "schema_version": SCHEMA_VERSION, "updated_at": now}
+        for f in CANONICAL:
+            doc[f] = grp[f].to_numpy(np.float64).tolist()
+        docs.append(doc)
+    return docs
+
+
+def write_docs(col, docs):
+    if not docs:
+        return 0
+    ops = [UpdateOne({"symbol": d["symbol"]}, {"$set": d}, upsert=True) for d in docs]
+    col.bulk_write(ops, ordered=False)
+    return len(ops)
+
+
+def sync(db, symbols=None):
+    """从原始三表重建快照，返回写入的股票数"""
+    df = normalize({k: db[v] for k, v in SHEETS.items()}, symbols)
+    return write_docs(db[COL_STD], to_docs(df))
+
+
+def doc_to_frame(doc, fields=None):
+    """单个快照文档 -> DataFrame[report_date, publish_date, fields...]"""
+    fields = list(CANONICAL) if fields is None else fields
+    df = pd.DataFrame({
+        "report_date": pd.to_datetime(pd.Series(doc.get("report_date", []), dtype=object)),
+        "publish_date": pd.to_datetime(pd.Series(doc.get("publish_date", []), dtype=object)),
+    })
+    for f in fields:
+        values = doc.get(f)
+        df[f] = np.asarray(values, dtype=np.float64) if values is not None else np.nan
+    return df
+
+
+def load_std(col, symbols=None, fields=None):
+    """批量读取快照 -> 长表 [symbol, report_date, publish_date, fields...]"""
+    fields = list(CANONICAL) if fields is None else fields
+    query = {"symbol": {"$in": list(symbols)}} if symbols is not None else {}
+    proj = {"_id": 0, "symbol": 1, "report_date": 1, "publish_date": 1, **{f: 1 for f in fields}}
+    frames = [doc_to_frame(d, fields).assign(symbol=d["symbol"]) for d in col.find(query, proj)]
+    if not frames:
+        return pd.DataFrame(columns=["symbol", "report_date", "publish_date", *fields])
+    df = pd.concat(frames, ignore_index=True)
+    return df[["symbol", "report_date", "publish_date", *fields]]
@@ -0,0 +1,157 @@
+"""
+Module: hashed_upsert.py
+Description: 变更检测写入 —— 内容未变的文档不再重复 upsert
+Features:
+    1. [Hash] 每个文档按内容 (键排序后的 BSON) 计算 64 位 blake2b 摘要，随文档存入 HASH_FIELD。
+    2. [Bulk Compare] 写入前按批次一次性取回库中已有文档的 (主键, 摘要)：
+       主键按 range_key 以外的字段分组，每组一个 range_key 的 [min, max] 区间，合并为一个 $or 查询，走唯一索引。
+    3. [Skip] 只对 新文档 / 摘要不同 的文档生成 UpdateOne；内容相同的直接跳过，
+       避免重复下载 (03 回溯两年) 与全量重算 (08 FORCE_UPDATE) 产生大量无效写入、oplog 与 journal。
+    4. [Stats] 返回并累计 new / changed / unchanged 计数，脚本结束时打印 summary()。
+    5. [Stamp] stamp="updated_at" 时只给真正写入的文档打时间戳 (不参与摘要)，
+       下游可据此做增量 (utils/change_tracker) 或判断输入是否变化 (utils/pipeline_dag 的集合指纹)：
+       重复下载不会刷新时间戳。首次写入时自动建立 stamp 字段的索引。
+
+用法:
+    writer = HashedUpsert(col, keys=("symbol", "date"))
+    stats = writer.upsert(docs)      # {"new": 3, "changed": 1, "unchanged": 2497}
+    print(writer.summary())
+
+注意:
+    - 没有摘要字段的旧文档视为 changed，首次运行会整体重写一遍 (补上摘要)，之后才开始跳过。
+      补摘要时对库中旧文档现场计算摘要: 内容没变的只补摘要、不打 stamp，否则部署后首次运行会把全部旧文档
+      标成 "刚变化"，下游 (08 经 change_tracker) 会把全市场当作脏数据做一次全历史重算；内容确实变了的照常打 stamp。
+    - 仍是 $set 语义: 文档中去掉的字段不会从库中删除 (与原来的 upsert 一致)。
+    - 绕过本模块直接修改过的文档，摘要与内容不再一致；需要时用 force=True 强制重写。
+"""
+
+import hashlib
+from datetime import datetime
+
+import bson
+import numpy as np
+from pymongo import ASCENDING, UpdateOne
+
+# --- 配置 ---
+HASH_FIELD = "_hash"
+COMPARE_BATCH = 2000  # 每次比对 / 写入的文档数
+
+
+def _canon(value):
+    """NumPy / pandas 标量转为 BSON 可编码的 Python 原生类型"""
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, datetime) and hasattr(value, "to_pydatetime"):  # pd.Timestamp
+        return value.to_pydatetime()
+    if isinstance(value, dict):
+        return {k: _canon(value[k]) for k in sorted(value)}
+    if isinstance(value, (list, tuple)):
+        return [_canon(v) for v in value]
+    return value
+
+
+def content_hash(doc, exclude=()):
+    """文档内容摘要 (有符号 int64，可直接存入 Mongo)"""
+    body = {k: _canon(doc[k]) for k in sorted(doc) if k != HASH_FIELD and k != "_id" and k not in exclude}
+    digest = hashlib.blake2b(bson.encode(body), digest_size=8).digest()
+    return int.from_bytes(digest, "little", signed=True)
+
+
+class HashedUpsert:
+    def __init__(self, col, keys, range_key=None, exclude=(), stamp=None, batch_size=COMPARE_BATCH, ordered=False):
+        """
+        keys:      唯一键字段 (与 upsert 的 filter 一致)
+        range_key: 在分组内按区间查询的键 (默认最后一个键，通常是日期)
+        exclude:   不参与摘要的字段 (如 updated_at 之类每次都变的时间戳)
+        stamp:     写入时设置为当前时间的字段名 (自动排除在摘要之外)
+        """
+        self.col = col
+        self.keys = tuple(keys)
+        self.range_key = range_key or self.keys[-1]
+        self.group_keys = tuple(k for k in self.keys if k != self.range_key)
+        self.stamp = stamp
+        self.exclude = tuple(exclude) + ((stamp,) if stamp else ())
+        self.batch_size = batch_size
+        self.ordered = ordered
+        self.stats = {"new": 0, "changed": 0, "unchanged": 0}
+        self._stamp_indexed = False
+
+    def _key(self, doc):
+        return tuple(_canon(doc[k]) for k in self.keys)
+
+    def _query(self, docs):
+        groups = {}
+        for d in docs:
+            g = tuple(_canon(d[k]) for k in self.group_keys)
+            v = _canon(d[self.range_key])
+            lo, hi = groups.get(g, (v, v))
+            groups[g] = (min(lo, v), max(hi, v))
+        clauses = [{**dict(zip(self.group_keys, g)), self.range_key: {"$gte": lo, "$lte": hi}}
+                   for g, (lo, hi) in groups.items()]
+        if not clauses:
+            return None
+        return clauses[0] if len(clauses) == 1 else {"$or": clauses}
+
+    def stored_hashes(self, docs):
+        """批量取回已有文档的摘要: 主键 -> 摘要 (无摘要字段时为 None)"""
+        query = self._query(docs)
+        if query is None:
+            return {}
+        proj = {"_id": 0, HASH_FIELD: 1, **{k: 1 for k in self.keys}}
+        return {self._key(d): d.get(HASH_FIELD) for d in self.col.find(query, proj)}
+
+    def legacy_hashes(self, docs):
+        """没有摘要字段的旧文档: 取回全文现场计算摘要 (只在补摘要的那次运行中发生)"""
+        query = self._query(docs)
+        if query is None:
+            return {}
+        return {self._key(d): content_hash(d, self.exclude) for d in self.col.find(query)}
+
+    def plan(self, docs, force=False):
+        """返回 (需要写入的 UpdateOne 列表, 本批计数)"""
+        stored = {} if force else self.stored_hashes(docs)
+        legacy = self.legacy_hashes([d for d in docs if self._key(d) in stored and stored[self._key(d)] is None])
+        ops, stats = [], {"new": 0, "changed": 0, "unchanged": 0}
+        extra = {self.stamp: datetime.now()} if self.stamp else {}
+        for d in docs:
+            h = content_hash(d, self.exclude)
+            key = self._key(d)
+            if key not in stored:
+                stats["changed" if force else "new"] += 1
+            elif stored[key] == h:
+                stats["unchanged"] += 1
+                continue
+            else:
+                stats["changed"] += 1
+                if legacy.get(key) == h:  # 旧文档补摘要，内容没变: 不刷新时间戳
+                    ops.append(UpdateOne({k: d[k] for k in self.keys}, {"$set": {**d, HASH_FIELD: h}}, upsert=True))
+                    continue
+            ops.append(UpdateOne({k: d[k] for k in self.keys}, {"$set": {**d, **extra, HASH_FIELD: h}}, upsert=True))
+        return ops, stats
+
+    def upsert(self, docs, force=False):
+        """比对并写入，返回本次调用的计数 (同时累加到 self.stats)"""
+        docs = list(docs)
+        total = {"new": 0, "changed": 0, "unchanged": 0}
+        if self.stamp and docs and not self._stamp_indexed:
+            self.col.create_index([(self.stamp, ASCENDING)])
+            self._stamp_indexed = True
+        for i in range(0, len(docs), self.batch_size):
+            ops, stats = self.plan(docs[i:i + self.batch_size], force)
+            if ops:
+                self.col.bulk_write(ops, ordered=self.ordered)
+            for k, v in stats.items():
+                total[k] += v
+                self.stats[k] += v
+        return total
+
+    @property
+    def written(self):
+        return self.stats["new"] + self.stats["changed"]
+
+    def summary(self):
+        s = self.stats
+        total = sum(s.values())
+        ratio = s["unchanged"] / total if total else 0.0
+        return (f"{self.col.name}: 新增 {s['new']} | 变更 {s['changed']} | "
+                f"未变跳过 {s['unchanged']} ({ratio:.0%})")
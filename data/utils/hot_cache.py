@@ -0,0 +1,272 @@
+"""
+Module: hot_cache.py
+Description: 全市场最新截面热缓存 (Redis Hash)，供选股器 / UI 毫秒级读取
+Features:
+    1. [Snapshot] build_snapshot(db) 从 Mongo 组装每只股票的最新状态:
+         最新日线 (bar_daily)、最新估值行 (valuation_daily)、ST / 停牌标记 (stock_status_history + 行情断档)、
+         行业 (utils/sector_map)。最新一条按各集合唯一索引的完整键序倒序 $group，不扫全表。
+    2. [Layout] 每只股票一个 Hash: {PREFIX}:s:{symbol}；全部代码在 Set {PREFIX}:symbols；
+       {PREFIX}:meta 记录 as_of / published_at / count。缺失值 (NaN) 不写入字段。
+    3. [Atomic Publish] publish() 在一个 MULTI/EXEC 事务里删旧写新，读者不会看到半新半旧的截面；
+       已退市 / 不再出现的代码一并删除。
+    4. [Pipelined Read] snapshot() 一次 pipeline 取回全部 HGETALL，返回按字段转好类型的 DataFrame。
+    5. [Fallback] redis 未安装、连不上或缓存缺失的代码，自动回退到 Mongo 现场组装 (HotCache 需传入 db)。
+
+用法:
+    cache = HotCache(db)
+    cache.publish(build_snapshot(db))      # 24 在每日管道末尾调用
+    df = cache.snapshot()                  # index=symbol 的全市场截面
+    row = cache.get("600519")
+
+环境变量: VNPY_REDIS_URL (默认 redis://localhost:6379/0，见 docker-compose.yaml 的 redis 服务)
+"""
+
+import os
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from . import limit_rules, sector_map
+
+try:
+    import redis
+    HAVE_REDIS = True
+    REDIS_ERRORS = (redis.RedisError,)
+except ImportError:
+    redis = None
+    HAVE_REDIS = False
+    REDIS_ERRORS = ()
+
+# --- 配置 ---
+REDIS_URL = os.environ.get("VNPY_REDIS_URL", "redis://localhost:6379/0")
+PREFIX = "vnpy:hot"
+SOCKET_TIMEOUT = 0.5  # 秒；连不上时尽快回退到 Mongo
+
+BAR_FIELDS = ["open_price", "high_price", "low_price", "close_price", "volume", "turnover",
+              "turnover_rate", "outstanding_share"]
+VALUATION_FIELDS = ["pe_ttm", "pe_lf", "pb_lf", "ps_ttm", "dv_ratio", "total_mv", "circ_mv",
+                    "total_shares", "float_shares", "eps_ttm", "bps", "roe_ttm"]
+FLAG_FIELDS = ["st", "suspended"]
+DATE_FIELDS = ["bar_date", "valuation_date"]
+TEXT_FIELDS = ["industry"]
+FIELDS = DATE_FIELDS + BAR_FIELDS + VALUATION_FIELDS + FLAG_FIELDS + TEXT_FIELDS
+
+# 集合 -> (唯一索引键序 (01_init_db_architecture)，末位为日期字段, 固定过滤条件)
+# $sort 必须覆盖完整键序，MongoDB 才会按索引顺序读取而不是整表排序
+LATEST_INDEX = {
+    "bar_daily": (["symbol", "exchange", "interval", "datetime"], {"interval": "d"}),
+    "valuation_daily": (["symbol", "date"], {}),
+}
+
+
+def _key(symbol):
+    return f"{PREFIX}:s:{symbol}"
+
+
+KEY_SYMBOLS = f"{PREFIX}:symbols"
+KEY_META = f"{PREFIX}:meta"
+
+
+# ---------------------------------------------------------------
+# Mongo -> 截面
+# ---------------------------------------------------------------
+def _latest(col, fields, symbols=None):
+    """每只股票最新一条: 按该集合唯一索引的完整键序 (LATEST_INDEX) 倒序后 $group $first，由索引给出顺序"""
+    keys, match = LATEST_INDEX[col.name]
+    date_field = keys[-1]
+    match = dict(match)
+    if symbols is not None:
+        match["symbol"] = {"$in": list(symbols)}
+    pipeline = [{"$match": match}] if match else []
+    pipeline += [
+        {"$sort": {k: -1 for k in keys}},
+        {"$group": {"_id": "$symbol", "date": {"$first": f"${date_field}"},
+                    **{f: {"$first": f"${f}"} for f in fields}}},
+    ]
+    df = pd.DataFrame(list(col.aggregate(pipeline, allowDiskUse=True)), columns=["_id", "date", *fields])
+    df = df.rename(columns={"_id": "symbol"}).set_index("symbol")
+    df["date"] = pd.to_datetime(df["date"])
+    for f in fields:
+        df[f] = pd.to_numeric(df[f], errors="coerce")
+    return df
+
+
+def _suspended_on(docs, date):
+    """stock_status_history 的停牌区间 (14_fuse) 覆盖 date 的股票"""
+    out = set()
+    for doc in docs:
+        for iv in doc.get("suspensions") or ():
+            start, end = iv.get("start"), iv.get("end")
+            if start is not None and pd.Timestamp(start) <= date and (end is None or date <= pd.Timestamp(end)):
+                out.add(doc["symbol"])
+                break
+    return out
+
+
+def build_snapshot(db, symbols=None, industries=None):
+    """
+    全市场 (或指定股票) 最新截面 DataFrame(index=symbol, columns=FIELDS)
+    industries: {symbol: 行业名}，None 时用 sector_map 本地快照
+    """
+    bars = _latest(db["bar_daily"], BAR_FIELDS, symbols).rename(columns={"date": "bar_date"})
+    vals = _latest(db["valuation_daily"], VALUATION_FIELDS, symbols).rename(columns={"date": "valuation_date"})
+    df = bars.join(vals, how="outer")
+    if symbols is not None:
+        df = df.reindex([s for s in symbols if s in df.index])
+    if df.empty:
+        return pd.DataFrame(columns=FIELDS)
+
+    # 市场最新交易日: 行情断档 (当日无 K 线) 或处于停牌区间即视为停牌
+    market_date = bars["bar_date"].max() if len(bars) else pd.NaT
+    q = {"symbol": {"$in": list(df.index)}}
+    status = list(db["stock_status_history"].find(q, {"_id": 0, "symbol": 1, "st_history": 1, "suspensions": 1}))
+    if pd.isna(market_date):
+        df["st"], df["suspended"] = False, False
+    else:
+        day = pd.DatetimeIndex([market_date])
+        df["st"] = limit_rules.st_mask([d for d in status if d.get("st_history")], day, df.index).iloc[0]
+        stale = ~(df["bar_date"] >= market_date)
+        df["suspended"] = stale | df.index.isin(list(_suspended_on(status, market_date)))
+
+    if industries is None:
+        industries = sector_map.load_or_build(db).snapshot()["industry_name"].to_dict()
+    df["industry"] = [industries.get(s, sector_map.UNKNOWN) for s in df.index]
+    return df.reindex(columns=FIELDS)
+
+
+# ---------------------------------------------------------------
+# 编码 / 解码
+# ---------------------------------------------------------------
+def _encode(row):
+    out = {}
+    for f, v in row.items():
+        if v is None or (isinstance(v, float) and np.isnan(v)) or v is pd.NaT:
+            continue
+        if f in DATE_FIELDS:
+            out[f] = pd.Timestamp(v).strftime("%Y-%m-%d")
+        elif f in FLAG_FIELDS:
+            out[f] = int(bool(v))
+        elif f in TEXT_FIELDS:
+            out[f] = str(v)
+        else:
+            out[f] = repr(float(v))
+    return out
+
+
+def _decode(records):
+    """records: [(symbol, {field: str})] -> DataFrame"""
+    df = pd.DataFrame([r for _, r in records], index=pd.Index([s for s, _ in records], name="symbol"))
+    df = df.reindex(columns=FIELDS)
+    for f in DATE_FIELDS:
+        df[f] = pd.to_datetime(df[f])
+    for f in BAR_FIELDS + VALUATION_FIELDS:
+        df[f] = df[f].astype(np.float64)  # Python float 解析，repr 往返无精度损失
+    for f in FLAG_FIELDS:
+        df[f] = df[f].fillna("0").astype(int).astype(bool)
+    return df
+
+
+# ---------------------------------------------------------------
+# 缓存客户端
+# ---------------------------------------------------------------
+class HotCache:
+    def __init__(self, db=None, url=None, client=None):
+        """
+        db:     vnpy_stock Database，缓存未命中时回退读取
+        url:    Redis 地址 (默认 REDIS_URL)
+        client: 已有的 Redis 客户端 (需 decode_responses=True)，给定时忽略 url
+        """
+        self.db = db
+        self.url = url or REDIS_URL
+        self._client = client
+        self._down = client is None and not HAVE_REDIS
+
+    @property
+    def client(self):
+        """Redis 客户端；未安装或连不上时为 None (连接失败后本实例不再重试)"""
+        if self._client is None and not self._down:
+            try:
+                c = redis.Redis.from_url(self.url, decode_responses=True,
+                                         socket_timeout=SOCKET_TIMEOUT, socket_connect_timeout=SOCKET_TIMEOUT)
+                c.ping()
+                self._client = c
+            except REDIS_ERRORS:
+                self._down = True
+        return self._client
+
+    def available(self):
+        return self.client is not None
+
+    def publish(self, frame, as_of=None):
+        """原子替换整个截面，返回写入的股票数"""
+        r = self.client
+        if r is None:
+            raise ConnectionError(f"Redis 不可用: {self.url}" + ("" if HAVE_REDIS else " (未安装 redis 包)"))
+        old = r.smembers(KEY_SYMBOLS)
+        symbols = [str(s) for s in frame.index]
+        as_of = as_of or frame["bar_date"].max()
+        with r.pipeline(transaction=True) as p:
+            stale = old - set(symbols)
+            if stale:
+                p.delete(*[_key(s) for s in stale])
+            p.delete(KEY_SYMBOLS)
+            for s, row in zip(symbols, frame.to_dict("records")):
+                p.delete(_key(s))
+                mapping = _encode(row)
+                if mapping:
+                    p.hset(_key(s), mapping=mapping)
+            if symbols:
+                p.sadd(KEY_SYMBOLS, *symbols)
+            p.hset(KEY_META, mapping={
+                "as_of": "" if pd.isna(as_of) else pd.Timestamp(as_of).strftime("%Y-%m-%d"),
+                "published_at": datetime.now().isoformat(timespec="seconds"),
+                "count": len(symbols),
+            })
+            p.execute()
+        return len(symbols)
+
+    def meta(self):
+        r = self.client
+        return r.hgetall(KEY_META) if r is not None else {}
+
+    def _read(self, symbols):
+        r = self.client
+        if r is None:
+            return None
+        if symbols is None:
+            symbols = sorted(r.smembers(KEY_SYMBOLS))
+        with r.pipeline(transaction=False) as p:
+            for s in symbols:
+                p.hgetall(_key(s))
+            rows = p.execute()
+        return [(s, row) for s, row in zip(symbols, rows) if row]
+
+    def snapshot(self, symbols=None, fields=None):
+        """
+        全市场 (symbols=None) 或指定股票的最新截面。
+        缓存缺失的股票 / Redis 不可用时从 Mongo 组装 (需要 db)；都没有时返回空表。
+        """
+        symbols = None if symbols is None else [str(s) for s in symbols]
+        try:
+            records = self._read(symbols)
+        except REDIS_ERRORS:
+            self._client, self._down, records = None, True, None
+
+        if records:
+            df = _decode(records)
+            missing = [] if symbols is None else [s for s in symbols if s not in df.index]
+        else:
+            df, missing = pd.DataFrame(columns=FIELDS), symbols
+
+        if (missing or missing is None) and self.db is not None:
+            extra = build_snapshot(self.db, missing)
+            df = extra if df.empty else pd.concat([df, extra])
+        if symbols is not None:
+            df = df.reindex([s for s in symbols if s in df.index])
+        return df if fields is None else df[list(fields)]
+
+    def get(self, symbol):
+        """单只股票 dict；不存在时 None"""
+        df = self.snapshot([symbol])
+        return None if df.empty else df.iloc[0].to_dict()
@@ -0,0 +1,142 @@
+"""
+Module: limit_rules.py
+Description: A 股涨跌停规则 (整块面板向量化)
+Features:
+    1. [Board] 按板块给出每日涨跌幅比例: 主板 10%，创业板 20% (2020-08-24 注册制起)，科创板 20%，北交所 30%；
+       1996-12-16 之前无涨跌幅限制 (NaN)。
+    2. [ST] stock_status_history.st_history 事件流 (ST / *ST / 摘帽 / 摘* ...) 展开为 日期 × 股票 布尔面板；
+       主板 (及注册制前创业板) 风险警示股 5%，2025-07-07 起主板调整为 10%。
+    3. [Price] 涨跌停价 = 前收盘 × (1 ± 比例)，按交易所规则四舍五入到分。
+    4. [IPO] 新股上市首日 (注册制: 前 5 个交易日) 不设涨跌幅，标记后剔除。
+    5. [Streak] run-length: 对整个面板一次性计算连续 True 的长度，停牌 (NaN) 不打断连板。
+"""
+
+import numpy as np
+import pandas as pd
+
+from . import symbol_master
+
+LIMIT_START = pd.Timestamp("1996-12-16")
+CHINEXT_REFORM = pd.Timestamp("2020-08-24")
+MAIN_REGISTRATION = pd.Timestamp("2023-04-10")
+IPO_FREE_DAYS = 5  # 注册制新股上市前 5 个交易日不设涨跌幅
+MAIN_ST_10PCT_FROM = pd.Timestamp("2025-07-07")
+
+ST_OFF = ("摘帽", "撤销", "去ST")  # "摘*" 只是 *ST -> ST，仍属风险警示
+
+
+def _codes(columns):
+    return pd.Index(symbol_master.to_code(columns))
+
+
+def board_ratio(index, columns):
+    """日期 × 股票 的涨跌幅比例 (不含 ST)"""
+    codes = _codes(columns)
+    ratio = pd.DataFrame(0.10, index=index, columns=columns)
+    ratio.loc[:, codes.str.startswith("688")] = 0.20
+    ratio.loc[:, codes.str.startswith(("4", "8", "92"))] = 0.30
+    ratio.loc[index >= CHINEXT_REFORM, codes.str.startswith(("300", "301"))] = 0.20
+    ratio.loc[index < LIMIT_START] = np.nan
+    return ratio
+
+
+def _is_st(status):
+    status = str(status).strip()
+    if status.startswith("摘*"):
+        return True
+    return "ST" in status.upper() and not status.startswith(ST_OFF)
+
+
+def st_mask(status_docs, index, columns):
+    """
+    status_docs: stock_status_history 文档 ({symbol, st_history: [{date, status}]})
+    返回 bool DataFrame: 当日是否处于风险警示
+    """
+    codes = _codes(columns)
+    pos = {c: i for i, c in enumerate(codes)}
+    # 事件落到面板上: 1 进入 / 0 退出，再按列前向填充 (与 pit_membership 的事件流同一思路)。
+    # 早于面板起点的事件都落在首行，按时间排序后最后一个生效，即为起点时的状态。
+    events = np.full((len(index), len(codes)), np.nan)
+    for doc in status_docs:
+        col = pos.get(str(doc.get("symbol", "")).split(".")[0])
+        if col is None:
+            continue
+        for ev in sorted(doc.get("st_history") or [], key=lambda e: e["date"]):
+            row = index.searchsorted(pd.Timestamp(ev["date"]))
+            if row < len(index):
+                events[row, col] = 1.0 if _is_st(ev["status"]) else 0.0
+    events = pd.DataFrame(events, index=index, columns=columns)
+    return events.ffill().fillna(0.0).astype(bool)
+
+
+def limit_ratio(index, columns, st=None):
+    """板块比例叠加 ST 规则"""
+    ratio = board_ratio(index, columns)
+    if st is not None:
+        main_like = ratio == 0.10
+        st_ratio = np.where(index >= MAIN_ST_10PCT_FROM, 0.10, 0.05)[:, None]
+        ratio = ratio.mask(st & main_like, np.broadcast_to(st_ratio, ratio.shape))
+    return ratio
+
+
+def ipo_free_mask(index, columns, list_dates):
+    """
+    list_dates: {symbol: 上市日}
+    返回 bool DataFrame: 当日因新股规则不设涨跌幅
+    """
+    codes = _codes(columns)
+    mask = np.zeros((len(index), len(codes)), dtype=bool)
+    for col, code in enumerate(codes):
+        listed = pd.to_datetime(list_dates.get(code), errors="coerce")
+        if pd.isna(listed):
+            continue
+        registered = (code.startswith("688")
+                      or (code.startswith(("300", "301")) and listed >= CHINEXT_REFORM)
+                      or (code.startswith(("60", "00")) and listed >= MAIN_REGISTRATION))
+        row = index.searchsorted(listed)
+        mask[row:row + (IPO_FREE_DAYS if registered else 1), col] = True
+    return pd.DataFrame(mask, index=index, columns=columns)
+
+
+def round_price(x):
+    """四舍五入到分 (加微小偏移避免 9.995 之类的二进制误差)"""
+    return np.floor(x * 100 + 0.5 + 1e-6) / 100
+
+
+def limit_prices(prev_close, ratio):
+    """返回 (涨停价, 跌停价)"""
+    return round_price(prev_close * (1 + ratio)), round_price(prev_close * (1 - ratio))
+
+
+def reference_limits(close, adj, traded, st=None, ipo_free=None):
+    """
+    整块面板的涨跌停价。
+    前收盘取该股上一个成交日的收盘价，除权日按复权因子 (qfq: 原始价 / factor) 换算为除权参考价。
+    返回 (涨停价, 跌停价, valid)，valid = 当日有成交且适用涨跌幅限制。
+    """
+    last_close = close.where(traded).ffill().shift(1)
+    last_adj = adj.where(traded).ffill().shift(1)
+    prev_ref = last_close * adj / last_adj
+    ratio = limit_ratio(close.index, close.columns, st=st)
+    up, down = limit_prices(prev_ref, ratio)
+    valid = traded & prev_ref.notna() & ratio.notna()
+    if ipo_free is not None:
+        valid &= ~ipo_free
+    return up, down, valid
+
+
+def streak(flag, seed=None):
+    """
+    连续 True 的长度 (run-length)，整块面板一次完成。
+    flag: 1.0 / 0.0 / NaN (NaN = 当日无交易，既不计数也不打断)
+    seed: 每列在面板首行之前已累积的长度 (增量计算时接续历史连板)
+    返回: flag == 1 处为连续天数，其余为 NaN
+    """
+    hit = flag.fillna(0.0)
+    total = hit.cumsum()
+    # 每次出现 0 时记下当时的累计值，之后的连续段长度 = 累计值 - 最近一次 0 处的累计值
+    reset = total.where(flag == 0).ffill()
+    run = total - reset.fillna(0.0)
+    if seed is not None:
+        run = run + reset.isna().mul(seed.reindex(flag.columns).fillna(0.0), axis=1)
+    return run.where(flag == 1)
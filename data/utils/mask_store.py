@@ -0,0 +1,181 @@
+"""
+Module: mask_store.py
+Description: 可交易性掩码面板 (日期 × 股票，uint8 位图，磁盘 memmap)
+Features:
+    1. [Bits] 每个单元 1 字节，按位记录: 上市中 / 停牌 / ST / 涨停 / 跌停 / 新股无涨跌幅。
+    2. [Layout] 行 = 交易日，列 = 股票，行优先连续存储；追加新交易日只在文件尾部写入新行。
+       列预留 SYMBOL_SLACK 个空位给新上市股票，用完后整体扩容重写一次。
+    3. [Memmap] 读取时 np.memmap 映射，按日期区间切片几乎零拷贝；回测 / 因子中性化直接做位运算过滤。
+    4. [Atomic] 先写数据再原子替换 meta.json，中途失败时旧的 meta 仍描述一致的旧数据:
+       扩容写到以新容量命名的新文件 (masks.{capacity}.u8)，由同一次 meta 替换切换过去，之后才删除旧文件；
+       追加前把数据文件截断到 meta 登记的行数，丢弃上次中断留下的未登记行。
+
+文件:
+    data/cache/masks/masks.{capacity}.u8   uint8[rows, capacity]
+    data/cache/masks/meta.json             {"dates": [...], "symbols": [...], "capacity": N, "data_file": ..., "bits": {...}}
+
+用法:
+    store = MaskStore.open()
+    ok = store.select(require=LISTED, exclude=SUSPENDED | ST | LIMIT_UP, start="2020-01-01")
+"""
+
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+MASK_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "cache", "masks")
+SYMBOL_SLACK = 512
+
+LISTED = 1 << 0
+SUSPENDED = 1 << 1
+ST = 1 << 2
+LIMIT_UP = 1 << 3
+LIMIT_DOWN = 1 << 4
+IPO_FREE = 1 << 5
+BITS = {"listed": LISTED, "suspended": SUSPENDED, "st": ST,
+        "limit_up": LIMIT_UP, "limit_down": LIMIT_DOWN, "ipo_free": IPO_FREE}
+
+
+def pack(flags, index, columns):
+    """flags: {bit_name: bool DataFrame/ndarray} -> uint8 DataFrame"""
+    out = np.zeros((len(index), len(columns)), dtype=np.uint8)
+    for name, panel in flags.items():
+        arr = panel.to_numpy(bool) if isinstance(panel, pd.DataFrame) else np.asarray(panel, dtype=bool)
+        out |= arr.astype(np.uint8) * np.uint8(BITS[name])
+    return pd.DataFrame(out, index=index, columns=columns)
+
+
+class MaskStore:
+    def __init__(self, path=MASK_DIR):
+        self.path = path
+        self.data_file = "masks.u8"
+        self.meta_path = os.path.join(path, "meta.json")
+        self.dates = pd.DatetimeIndex([])
+        self.symbols = []
+        self.capacity = 0
+        self._col = {}
+        self._stale = []  # 扩容后待 meta 切换完成再删除的旧数据文件
+
+    @classmethod
+    def open(cls, path=MASK_DIR):
+        obj = cls(path)
+        if os.path.exists(obj.meta_path):
+            with open(obj.meta_path, encoding="utf-8") as f:
+                meta = json.load(f)
+            if meta.get("bits") != BITS:
+                raise ValueError(f"掩码位定义已变化，请用 FORCE_FULL 重建: {obj.path}")
+            obj.dates = pd.DatetimeIndex(meta["dates"])
+            obj.symbols = meta["symbols"]
+            obj.capacity = meta["capacity"]
+            obj.data_file = meta.get("data_file", "masks.u8")
+            obj._col = {s: i for i, s in enumerate(obj.symbols)}
+        return obj
+
+    @property
+    def data_path(self):
+        return os.path.join(self.path, self.data_file)
+
+    @property
+    def last_date(self):
+        return self.dates[-1] if len(self.dates) else None
+
+    def _map(self, mode="r"):
+        if not len(self.dates):
+            return np.zeros((0, self.capacity), dtype=np.uint8)
+        return np.memmap(self.data_path, dtype=np.uint8, mode=mode, shape=(len(self.dates), self.capacity))
+
+    def _save_meta(self):
+        tmp = self.meta_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"dates": [d.strftime("%Y-%m-%d") for d in self.dates], "symbols": self.symbols,
+                       "capacity": self.capacity, "data_file": self.data_file, "bits": BITS}, f)
+        os.replace(tmp, self.meta_path)
+        for path in self._stale:
+            if os.path.exists(path):
+                os.remove(path)
+        self._stale = []
+
+    def _grow(self, n_symbols):
+        """列容量不足: 以新容量重写到新文件；旧文件与旧 meta 保持不动，直到 _save_meta() 切换"""
+        new_cap = n_symbols + SYMBOL_SLACK
+        old = self._map()
+        new_file = f"masks.{new_cap}.u8"
+        if len(self.dates):
+            grown = np.memmap(os.path.join(self.path, new_file), dtype=np.uint8, mode="w+",
+                              shape=(len(self.dates), new_cap))
+            grown[:, :self.capacity] = old
+            grown.flush()
+            del grown
+        del old
+        if os.path.exists(self.data_path):
+            self._stale.append(self.data_path)
+        self.data_file = new_file
+        self.capacity = new_cap
+
+    # ---------------------------------------------------------------
+    # 写入
+    # ---------------------------------------------------------------
+    def write(self, frame):
+        """
+        frame: uint8 DataFrame (日期 × 股票)。
+        已存在的日期原地覆盖，晚于 last_date 的日期追加；不允许在已有日期之间插入新日期。
+        返回 (覆盖行数, 追加行数)
+        """
+        frame = frame.sort_index()
+        os.makedirs(self.path, exist_ok=True)
+        new_symbols = [s for s in frame.columns if s not in self._col]
+        if len(self.symbols) + len(new_symbols) > self.capacity:
+            self._grow(len(self.symbols) + len(new_symbols))
+        for s in new_symbols:
+            self._col[s] = len(self.symbols)
+            self.symbols.append(s)
+
+        last = self.last_date
+        old = frame[frame.index <= last] if last is not None else frame.iloc[:0]
+        new = frame[frame.index > last] if last is not None else frame
+        missing = old.index.difference(self.dates)
+        if len(missing):
+            raise ValueError(f"不能在已有日期之间插入: {missing[0]:%Y-%m-%d}")
+
+        cols = np.array([self._col[s] for s in frame.columns])
+        if len(old):
+            mm = self._map("r+")
+            rows = self.dates.get_indexer(old.index)
+            block = mm[rows[0]:rows[-1] + 1]
+            block[np.ix_(rows - rows[0], cols)] = old.to_numpy(np.uint8)
+            mm.flush()
+            del mm
+        if len(new):
+            buf = np.zeros((len(new), self.capacity), dtype=np.uint8)
+            buf[:, cols] = new.to_numpy(np.uint8)
+            with open(self.data_path, "ab") as f:
+                f.truncate(len(self.dates) * self.capacity)  # 丢弃上次中断时写入但未登记到 meta 的行
+                f.write(buf.tobytes())
+            self.dates = self.dates.append(pd.DatetimeIndex(new.index))
+        self._save_meta()
+        return len(old), len(new)
+
+    # ---------------------------------------------------------------
+    # 读取
+    # ---------------------------------------------------------------
+    def raw(self, start=None, end=None, symbols=None):
+        """uint8 ndarray 视图 + (dates, symbols)；symbols=None 时不做列拷贝"""
+        lo = 0 if start is None else self.dates.searchsorted(pd.Timestamp(start))
+        hi = len(self.dates) if end is None else self.dates.searchsorted(pd.Timestamp(end), side="right")
+        block = self._map()[lo:hi, :len(self.symbols)]
+        if symbols is None:
+            return block, self.dates[lo:hi], list(self.symbols)
+        cols = [self._col[s] for s in symbols if s in self._col]
+        return block[:, cols], self.dates[lo:hi], [self.symbols[c] for c in cols]
+
+    def panel(self, start=None, end=None, symbols=None):
+        block, dates, cols = self.raw(start, end, symbols)
+        return pd.DataFrame(np.asarray(block), index=dates, columns=cols)
+
+    def select(self, require=LISTED, exclude=0, start=None, end=None, symbols=None):
+        """bool DataFrame: require 位全部为 1 且 exclude 位全部为 0"""
+        block, dates, cols = self.raw(start, end, symbols)
+        ok = ((block & np.uint8(require)) == require) & ((block & np.uint8(exclude)) == 0)
+        return pd.DataFrame(ok, index=dates, columns=cols)
@@ -0,0 +1,127 @@
+"""
+Module: mongo_client.py
+Description: 全管道共享的 MongoClient 工厂 (连接池 / 压缩 / 写关注)
+Features:
+    1. [Shared] 每个进程只创建一个 MongoClient (按连接参数缓存)，所有脚本与 utils 共用同一个连接池；
+       首次调用时才创建，因此 StageProfiler 的 CommandListener 只要在此之前实例化即可生效。
+    2. [Pool] maxPoolSize / minPoolSize / maxIdleTimeMS 集中配置，可用环境变量覆盖。
+    3. [Compression] 按 COMPRESSORS 顺序协商网络压缩 (zstd / snappy / zlib)，未安装的压缩库自动跳过。
+    4. [Write Mode] get_db(name, write=...) 按作业选择写关注:
+         acked    w=1 (默认)
+         fast     w=0 不确认 —— 只用于可整体重算的派生表；bulk_write 的返回值不再有计数，写入错误也不会抛出
+         majority w="majority", j=True —— 主数据 / 不可重下的原始数据
+       管道节点可通过 "write_mode" 指定 (pipeline_dag 经环境变量 VNPY_MONGO_WRITE 传给子进程)。
+       可重试写 (retryWrites) 对 acked / majority 生效。
+    5. [Thread / Fork Safe] 创建过程加锁；缓存按 pid 区分，fork 后的子进程丢弃继承来的客户端并重建
+       (pymongo 客户端不能跨 fork 使用)。
+
+用法:
+    from utils.mongo_client import get_client, get_db
+    CLIENT = get_client()
+    DB = get_db("vnpy_stock")
+    DB_FACTOR = get_db("vnpy_factor", write="fast")
+
+环境变量:
+    VNPY_MONGO_URI / VNPY_MONGO_POOL / VNPY_MONGO_COMPRESSORS ("none" 关闭) / VNPY_MONGO_WRITE
+"""
+
+import importlib.util
+import os
+import threading
+
+from pymongo import MongoClient
+from pymongo.write_concern import WriteConcern
+
+# --- 配置 ---
+MONGO_URI = os.environ.get("VNPY_MONGO_URI", "mongodb://localhost:27017/")
+MAX_POOL_SIZE = int(os.environ.get("VNPY_MONGO_POOL", 50))
+MIN_POOL_SIZE = 0
+MAX_IDLE_MS = 60_000
+COMPRESSORS = os.environ.get("VNPY_MONGO_COMPRESSORS", "zstd,snappy,zlib")
+RETRY_WRITES = True
+WRITE_MODE = os.environ.get("VNPY_MONGO_WRITE", "acked")
+
+WRITE_MODES = {
+    "fast": WriteConcern(w=0),
+    "acked": WriteConcern(w=1),
+    "majority": WriteConcern(w="majority", j=True),
+}
+
+# 压缩算法 -> 所需的 Python 模块
+COMPRESSOR_MODULES = {"zstd": "zstandard", "snappy": "snappy", "zlib": "zlib"}
+
+_LOCK = threading.Lock()
+_CLIENTS = {}  # (pid, 参数) -> MongoClient
+
+
+def _reset_after_fork():
+    global _LOCK
+    _LOCK = threading.Lock()
+    _CLIENTS.clear()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _check_mode(mode):
+    if mode not in WRITE_MODES:
+        raise ValueError(f"未知写模式 {mode!r}，可选: {', '.join(WRITE_MODES)}")
+    return WRITE_MODES[mode]
+
+
+def _write_options(mode):
+    """写模式 -> MongoClient 参数 (客户端级默认写关注，CLIENT[db] 直接继承)"""
+    doc = _check_mode(mode).document
+    return {"w": doc["w"], **({"journal": True} if doc.get("j") else {})}
+
+
+def available_compressors(spec=COMPRESSORS):
+    if not spec or spec.lower() == "none":
+        return []
+    names = [c.strip() for c in spec.split(",") if c.strip()]
+    return [c for c in names if c in COMPRESSOR_MODULES and importlib.util.find_spec(COMPRESSOR_MODULES[c])]
+
+
+def client_options(**overrides):
+    opts = {
+        "maxPoolSize": MAX_POOL_SIZE,
+        "minPoolSize": MIN_POOL_SIZE,
+        "maxIdleTimeMS": MAX_IDLE_MS,
+        "retryWrites": RETRY_WRITES,
+        **_write_options(WRITE_MODE),
+    }
+    compressors = available_compressors()
+    if compressors:
+        opts["compressors"] = ",".join(compressors)
+    opts.update(overrides)
+    return opts
+
+
+def get_client(uri=None, **overrides):
+    """
+    进程内共享的 MongoClient。相同 (uri, overrides) 返回同一个实例。
+    overrides: 传给 MongoClient 的额外参数 (如 maxPoolSize=64, serverSelectionTimeoutMS=5000)
+    """
+    uri = uri or MONGO_URI
+    key = (os.getpid(), uri, tuple(sorted(overrides.items())))
+    client = _CLIENTS.get(key)
+    if client is not None:
+        return client
+    with _LOCK:
+        client = _CLIENTS.get(key)
+        if client is None:
+            client = MongoClient(uri, **client_options(**overrides))
+            _CLIENTS[key] = client
+    return client
+
+
+def get_db(name, write=None, client=None):
+    """
+    write: "acked" / "fast" / "majority"，None 时沿用客户端默认 (VNPY_MONGO_WRITE，默认 acked)。
+    不同写模式共享同一个连接池，只是 Database 句柄的写关注不同。
+    """
+    client = client or get_client()
+    if write is None:
+        return client[name]
+    return client.get_database(name, write_concern=_check_mode(write))
@@ -0,0 +1,145 @@
+"""
+Module: mongo_loader.py
+Description: Mongo 游标 -> NumPy 列的流式加载器 (取代 pd.DataFrame(list(cursor)))
+Features:
+    1. [Projection] 只取声明的字段 (自动排除 _id)，游标使用大 batch_size 减少往返。
+    2. [Streaming] 文档逐条读出后立即拆到各列的标量缓冲区，每 CHUNK_ROWS 行转换为一段定型 ndarray；
+       全程不保留 dict 列表，峰值内存约为最终列数据的 2 倍，而不是 "全部 dict + DataFrame"。
+    3. [Typed] 字段类型声明: float / int / datetime / bool / str / category。
+       float 对 None 与非数字字符串 ("--") 置 NaN (等价 pd.to_numeric(errors="coerce"))；
+       datetime 同时接受 datetime 与 "YYYY-MM-DD" 字符串。
+    4. [Arrow] 可选 pymongoarrow: USE_ARROW=True 且已安装时按 schema 直接解码原始 BSON，
+       跳过 Python 对象。注意 pymongoarrow 对类型不符的值直接置空，开启前确认库中字段类型一致。
+    5. [Output] 返回 DataFrame，或 as_array=True 时返回 NumPy 结构化数组。
+
+用法:
+    df = load_frame(db["bar_daily"], {"symbol": "000001"},
+                    {"datetime": "datetime", "close_price": "float", "volume": "float"}, sort=[("datetime", 1)])
+"""
+
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+try:
+    import pyarrow
+    from pymongoarrow.api import Schema, find_pandas_all
+    HAVE_ARROW = True
+except ImportError:
+    HAVE_ARROW = False
+
+# --- 配置 ---
+BATCH_SIZE = 20000
+CHUNK_ROWS = 65536
+USE_ARROW = False
+
+# 与 pandas 从 Python datetime 推断的精度一致 (pandas 2: ns, pandas 3: us)，
+# 否则与其他 DataFrame 做 merge_asof / join 时会因精度不同报错
+DATETIME_DTYPE = str(pd.Series([datetime(2000, 1, 1)]).dtype)
+
+NUMPY_TYPES = {
+    "float": np.float64,
+    "int": np.float64,  # 可能缺失，先按 float 读入，结束时无缺失再转 int64
+    "datetime": DATETIME_DTYPE,
+    "bool": object,
+    "str": object,
+    "category": object,
+}
+
+
+def _arrow_type(kind):
+    return {"float": pyarrow.float64(), "int": pyarrow.int64(), "datetime": pyarrow.timestamp("ms"),
+            "bool": pyarrow.bool_(), "str": pyarrow.string(), "category": pyarrow.string()}[kind]
+
+
+def _to_array(values, kind):
+    """一段标量列表 -> 定型 ndarray"""
+    if kind in ("float", "int"):
+        try:
+            return np.array(values, dtype=np.float64)
+        except (TypeError, ValueError):
+            return pd.to_numeric(pd.Series(values, dtype=object), errors="coerce").to_numpy(np.float64)
+    if kind == "datetime":
+        try:
+            return np.array(values, dtype=DATETIME_DTYPE)
+        except (TypeError, ValueError):
+            return pd.to_datetime(pd.Series(values, dtype=object), errors="coerce").to_numpy(DATETIME_DTYPE)
+    arr = np.empty(len(values), dtype=object)
+    arr[:] = values
+    return arr
+
+
+def _finish(chunks, kind):
+    arr = np.concatenate(chunks) if chunks else np.empty(0, dtype=NUMPY_TYPES[kind])
+    if kind == "int" and not np.isnan(arr).any():
+        return arr.astype(np.int64)
+    if kind == "bool":
+        return pd.array(arr, dtype="boolean")
+    if kind == "category":
+        return pd.Categorical(arr)
+    return arr
+
+
+def _load_arrow(collection, query, fields, sort, hint):
+    kwargs = {"sort": sort} if sort else {}
+    if hint is not None:
+        kwargs["hint"] = hint
+    schema = Schema({name: _arrow_type(kind) for name, kind in fields.items()})
+    df = find_pandas_all(collection, query, schema=schema, **kwargs)
+    for name, kind in fields.items():
+        if kind == "category":
+            df[name] = df[name].astype("category")
+        elif kind == "datetime":
+            df[name] = pd.to_datetime(df[name])
+    return df
+
+
+def load_frame(collection, query, fields, sort=None, hint=None, batch_size=BATCH_SIZE, as_array=False):
+    """
+    collection: pymongo Collection
+    query: find 条件
+    fields: {字段名: 类型}，类型见 NUMPY_TYPES；字段名可用点路径读取嵌套标量 (如 "stats.close")
+    返回 DataFrame (列顺序同 fields)，as_array=True 时返回结构化数组
+    """
+    if USE_ARROW and HAVE_ARROW and not as_array:
+        return _load_arrow(collection, query, fields, sort, hint)
+
+    names = list(fields)
+    kinds = [fields[n] for n in names]
+    paths = [n.split(".") for n in names]
+    projection = {"_id": 0, **{n: 1 for n in names}}
+    cursor = collection.find(query, projection, batch_size=batch_size)
+    if sort:
+        cursor = cursor.sort(sort)
+    if hint is not None:
+        cursor = cursor.hint(hint)
+
+    chunks = [[] for _ in names]
+    buffers = [[] for _ in names]
+    appends = [b.append for b in buffers]
+    rows = 0
+    for doc in cursor:
+        for append, path in zip(appends, paths):
+            value = doc.get(path[0])
+            for key in path[1:]:
+                value = value.get(key) if isinstance(value, dict) else None
+            append(value)
+        rows += 1
+        if rows % CHUNK_ROWS == 0:
+            for i, kind in enumerate(kinds):
+                chunks[i].append(_to_array(buffers[i], kind))
+                buffers[i].clear()
+    for i, kind in enumerate(kinds):
+        if buffers[i]:
+            chunks[i].append(_to_array(buffers[i], kind))
+            buffers[i].clear()
+
+    columns = {n: _finish(c, k) for n, c, k in zip(names, chunks, kinds)}
+    if as_array:
+        dtype = [(n, np.asarray(col).dtype) for n, col in columns.items()]
+        out = np.empty(rows, dtype=dtype)
+        for n, col in columns.items():
+            out[n] = np.asarray(col)
+        return out
+    return pd.DataFrame(columns)
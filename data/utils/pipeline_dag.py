@@ -0,0 +1,265 @@
+"""
+Module: pipeline_dag.py
+Description: 数据管道 DAG 调度器
+Features:
+    1. [Declarative] 每个脚本声明 inputs / outputs 集合，依赖关系由 "A 的输出 = B 的输入" 自动推导。
+    2. [Parallel] 依赖满足即提交到线程池，互不相关的分支并发执行 (脚本以子进程运行)。
+    3. [Skip] 派生节点 (非外部数据源) 在所有输入集合指纹与上次成功时一致时跳过。
+    4. [Resume] 运行状态持久化到 JSON，中断后重跑会跳过本轮已成功的节点。
+    5. [Report] 结束时给出各节点耗时与关键路径 (理论最短墙钟时间)。
+
+节点定义 (dict):
+    {
+        "script": "08_calculate_valuation_daily.py",
+        "inputs": ["bar_daily", "vnpy_master.trading_calendar"],   # 不带库名默认 vnpy_stock
+        "outputs": ["valuation_daily"],
+        "external": False,      # True: 外部数据源 (下载器)，每次都运行
+        "enabled": True,
+        "write_mode": "fast",   # 可选: acked / fast / majority，经 VNPY_MONGO_WRITE 传给子进程 (utils/mongo_client.py)
+    }
+"""
+
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from datetime import datetime
+
+DEFAULT_DB = "vnpy_stock"
+# 写入方打的时间戳字段 (updated_at: utils/hashed_upsert 的 stamp 等；suspension_updated_at: 14_fuse)
+STAMP_FIELDS = ("updated_at", "suspension_updated_at")
+STAMP_SCAN_LIMIT = 200_000  # 没有时间戳索引时，只对不超过这么多文档的集合排序取最大值
+
+
+def split_ns(name):
+    return name.split(".", 1) if "." in name else (DEFAULT_DB, name)
+
+
+def _max_stamp(col, field, count):
+    """field 的最大值: 有以它开头的索引时走索引取一条；没有索引的小集合直接排序；大集合无索引返回 None"""
+    indexed = any(next(iter(info["key"]))[0] == field for info in col.index_information().values())
+    if not indexed and count > STAMP_SCAN_LIMIT:
+        return None
+    doc = col.find_one({field: {"$ne": None}}, {field: 1, "_id": 0}, sort=[(field, -1)])
+    return str(doc[field]) if doc else None
+
+
+def collection_fingerprint(client, name):
+    """
+    集合指纹: (文档数, 数据大小, 最大 _id, 各写入时间戳字段的最大值)。
+    文档数 / 大小 / _id 只能感知插入与删除；原地 $set 更新 (03 因子替换、08 重算、14_fuse、HashedUpsert 的变更)
+    靠写入方打的 updated_at (utils/hashed_upsert 的 stamp) 等时间戳感知。全部走元数据或索引，开销可忽略。
+    """
+    db_name, col_name = split_ns(name)
+    db = client[db_name]
+    try:
+        stats = db.command("collStats", col_name)
+    except Exception:
+        return None
+    col = db[col_name]
+    count = stats.get("count", 0)
+    last = col.find_one({}, {"_id": 1}, sort=[("_id", -1)])
+    return [count, stats.get("size", 0), str(last["_id"]) if last else None,
+            *(_max_stamp(col, f, count) for f in STAMP_FIELDS)]
+
+
+class PipelineRunner:
+    def __init__(self, nodes, client, script_dir, state_path, log_dir, max_parallel=4, resume=True, force=()):
+        self.nodes = {k: v for k, v in nodes.items() if v.get("enabled", True)}
+        self.client = client
+        self.script_dir = script_dir
+        self.state_path = state_path
+        self.log_dir = log_dir
+        self.max_parallel = max_parallel
+        self.resume = resume
+        self.force = set(force)
+        self._lock = threading.Lock()
+        self.state = self._load_state()
+        self.deps = self._build_deps()
+
+    # ---------------------------------------------------------------
+    # DAG
+    # ---------------------------------------------------------------
+    def _build_deps(self):
+        producers = {}
+        for name, node in self.nodes.items():
+            for out in node.get("outputs", []):
+                producers.setdefault(out, set()).add(name)
+        deps = {}
+        for name, node in self.nodes.items():
+            deps[name] = set()
+            for inp in node.get("inputs", []):
+                deps[name] |= producers.get(inp, set()) - {name}
+        self._check_cycles(deps)
+        return deps
+
+    @staticmethod
+    def _check_cycles(deps):
+        visiting, done = set(), set()
+
+        def visit(n, path):
+            if n in done:
+                return
+            if n in visiting:
+                raise ValueError(f"管道存在循环依赖: {' -> '.join(path + [n])}")
+            visiting.add(n)
+            for d in deps[n]:
+                visit(d, path + [n])
+            visiting.discard(n)
+            done.add(n)
+
+        for n in deps:
+            visit(n, [])
+
+    def critical_path(self, durations):
+        """按实际耗时求关键路径 (最长路径)"""
+        memo = {}
+
+        def longest(n):
+            if n not in memo:
+                best = max(self.deps[n], key=longest, default=None)
+                memo[n] = (durations.get(n, 0.0) + (longest(best)[0] if best else 0.0),
+                           (longest(best)[1] if best else []) + [n])
+            return memo[n]
+
+        if not self.nodes:
+            return 0.0, []
+        return max((longest(n) for n in self.nodes), key=lambda x: x[0])
+
+    # ---------------------------------------------------------------
+    # 状态持久化
+    # ---------------------------------------------------------------
+    def _load_state(self):
+        if os.path.exists(self.state_path):
+            with open(self.state_path, encoding="utf-8") as f:
+                return json.load(f)
+        return {"nodes": {}, "current_run": None}
+
+    def _save_state(self):
+        os.makedirs(os.path.dirname(self.state_path), exist_ok=True)
+        tmp = self.state_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.state, f, ensure_ascii=False, indent=2, default=str)
+        os.replace(tmp, self.state_path)
+
+    # ---------------------------------------------------------------
+    # 执行
+    # ---------------------------------------------------------------
+    def _fingerprints(self, names):
+        return {n: collection_fingerprint(self.client, n) for n in names}
+
+    def should_skip(self, name):
+        """返回 (是否跳过, 原因)"""
+        node = self.nodes[name]
+        run = self.state["current_run"]
+        if name in run["succeeded"]:
+            return True, "resume"
+        if name in self.force or node.get("external"):
+            return False, None
+        last = self.state["nodes"].get(name)
+        if not last or last.get("status") != "ok":
+            return False, None
+        current = self._fingerprints(node.get("inputs", []))
+        if current == last.get("input_fingerprints"):
+            return True, "inputs unchanged"
+        return False, None
+
+    def _run_node(self, name):
+        node = self.nodes[name]
+        inputs_before = self._fingerprints(node.get("inputs", []))
+        log_path = os.path.join(self.log_dir, self.state["current_run"]["run_id"], f"{name}.log")
+        os.makedirs(os.path.dirname(log_path), exist_ok=True)
+
+        env = dict(os.environ)
+        if node.get("write_mode"):
+            env["VNPY_MONGO_WRITE"] = node["write_mode"]
+
+        t0 = time.perf_counter()
+        with open(log_path, "w", encoding="utf-8") as log:
+            proc = subprocess.run(
+                [sys.executable, os.path.join(self.script_dir, node["script"])],
+                cwd=self.script_dir, stdout=log, stderr=subprocess.STDOUT, env=env,
+            )
+        elapsed = time.perf_counter() - t0
+        return proc.returncode, elapsed, inputs_before, log_path
+
+    def run(self):
+        run = self.state.get("current_run")
+        if not (self.resume and run and not run.get("finished_at")):
+            run = {"run_id": datetime.now().strftime("%Y%m%d_%H%M%S"), "started_at": datetime.now().isoformat(),
+                   "succeeded": [], "failed": [], "skipped": [], "finished_at": None}
+        else:
+            print(f"♻️  续跑未完成的运行 {run['run_id']} (已完成 {len(run['succeeded'])} 个节点)")
+            run["failed"], run["skipped"] = [], []
+        self.state["current_run"] = run
+        self._save_state()
+
+        pending = set(self.nodes)
+        finished = {}  # name -> "ok" | "failed" | "skipped" | "blocked"
+        durations = {}
+        wall0 = time.perf_counter()
+
+        with ThreadPoolExecutor(max_workers=self.max_parallel) as pool:
+            running = {}
+            while pending or running:
+                # 1. 依赖失败的节点直接阻断
+                for name in sorted(pending):
+                    if any(finished.get(d) in ("failed", "blocked") for d in self.deps[name]):
+                        pending.discard(name)
+                        finished[name] = "blocked"
+                        print(f"⛔ {name}: 上游失败，跳过")
+
+                # 2. 提交所有依赖已满足的节点
+                ready = [n for n in sorted(pending) if all(d in finished for d in self.deps[n])]
+                for name in ready:
+                    pending.discard(name)
+                    skip, reason = self.should_skip(name)
+                    if skip:
+                        finished[name] = "skipped"
+                        run["skipped"].append(name)
+                        print(f"⏭  {name}: {reason}")
+                        continue
+                    print(f"▶️  {name} ({self.nodes[name]['script']})")
+                    running[pool.submit(self._run_node, name)] = name
+
+                if not running:
+                    continue
+
+                done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+                for fut in done:
+                    name = running.pop(fut)
+                    try:
+                        code, elapsed, inputs_before, log_path = fut.result()
+                    except Exception as e:
+                        code, elapsed, inputs_before, log_path = -1, 0.0, {}, str(e)
+                    durations[name] = elapsed
+                    with self._lock:
+                        if code == 0:
+                            finished[name] = "ok"
+                            run["succeeded"].append(name)
+                            self.state["nodes"][name] = {
+                                "status": "ok", "last_success": datetime.now().isoformat(),
+                                "duration_s": round(elapsed, 2), "input_fingerprints": inputs_before,
+                                "output_fingerprints": self._fingerprints(self.nodes[name].get("outputs", [])),
+                            }
+                            print(f"✅ {name}: {elapsed:.1f}s")
+                        else:
+                            finished[name] = "failed"
+                            run["failed"].append(name)
+                            prev = self.state["nodes"].get(name, {})
+                            self.state["nodes"][name] = dict(prev, status="failed", last_error_log=log_path)
+                            print(f"❌ {name}: exit={code}, 日志: {log_path}")
+                        self._save_state()
+
+        wall = time.perf_counter() - wall0
+        if not run["failed"] and not any(v == "blocked" for v in finished.values()):
+            run["finished_at"] = datetime.now().isoformat()
+        self._save_state()
+
+        cp_len, cp_nodes = self.critical_path(durations)
+        return {"wall_s": wall, "finished": finished, "durations": durations,
+                "critical_path_s": cp_len, "critical_path": cp_nodes,
+                "serial_s": sum(durations.values())}
@@ -0,0 +1,242 @@
+"""
+Module: pit_membership.py
+Description: 指数/板块成分股 Point-in-Time 存储 (增量编码)
+Features:
+    1. [Delta] 只记录 调入(ADD)/调出(REMOVE) 事件，不再每天存一份完整成分股列表。
+    2. [Checkpoint] 每隔 CHECKPOINT_DAYS 天写一份完整快照 (含权重)，用于校验与按日期快速重建。
+    3. [State] 每个指数维护一份当前状态 (最新成分、最后观测日)，写入时据此求差集，也用于断点续传。
+    4. [Query] MembershipIndex 把事件加载为内存区间索引:
+         - members(index, date)       某日成分股 (亚毫秒)
+         - history(symbol)            某股票的全部成分区间
+         - indices_of(symbol, date)   某日所属的全部指数/板块
+         - universe(index, dates)     回测用批量接口，返回 日期 × 股票 的布尔矩阵
+
+集合 (vnpy_stock):
+    index_membership_events:      {index_symbol, symbol, date, action: ADD|REMOVE, weight, seq}
+    index_membership_checkpoints: {index_symbol, date, components, weights, count}
+    index_membership_state:       {index_symbol, index_name, category, components, weights,
+                                   first_seen, last_seen, last_checkpoint, seq}
+
+seq: 每个指数的写入序号 (每次 record_snapshot 加 1)。同一天多次写入可能对同一只股票先后落下 ADD 与 REMOVE，
+     重放时同一 (指数, 股票, 日期) 以 seq 最大的动作为准；旧事件没有 seq，视为最早。
+
+注意: 日期统一使用 "YYYY-MM-DD" 字符串 (与 index_components 一致)。
+      首次观测日之前的成分未知，查询返回空集。
+"""
+
+from collections import defaultdict
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from pymongo import ASCENDING, UpdateOne
+
+# --- 配置 ---
+COL_EVENTS = "index_membership_events"
+COL_CHECKPOINTS = "index_membership_checkpoints"
+COL_STATE = "index_membership_state"
+CHECKPOINT_DAYS = 30
+
+ADD = "ADD"
+REMOVE = "REMOVE"
+OPEN_END = np.datetime64("9999-12-31", "D")
+
+
+def ensure_indexes(db):
+    db[COL_EVENTS].create_index(
+        [("index_symbol", ASCENDING), ("date", ASCENDING), ("symbol", ASCENDING), ("action", ASCENDING)],
+        unique=True)
+    db[COL_EVENTS].create_index([("symbol", ASCENDING), ("date", ASCENDING)])
+    db[COL_CHECKPOINTS].create_index([("index_symbol", ASCENDING), ("date", ASCENDING)], unique=True)
+    db[COL_STATE].create_index([("index_symbol", ASCENDING)], unique=True)
+
+
+def _days_between(d1, d2):
+    return (datetime.strptime(d2, "%Y-%m-%d") - datetime.strptime(d1, "%Y-%m-%d")).days
+
+
+# =========================================================================
+# 写入
+# =========================================================================
+def record_snapshot(db, index_symbol, date, components, weights=None, index_name=None, category=None):
+    """
+    写入一次成分股观测。与当前状态求差集，只落地变化的成分。
+    返回 (调入数, 调出数)；早于最后观测日的快照会被忽略并返回 None。
+    """
+    weights = weights or {}
+    current = set(components)
+    state = db[COL_STATE].find_one({"index_symbol": index_symbol})
+
+    if state and date < state["last_seen"]:
+        return None
+
+    previous = set(state["components"]) if state else set()
+    added, removed = current - previous, previous - current
+    seq = (state.get("seq") or 0) + 1 if state else 1
+
+    ops = [UpdateOne({"index_symbol": index_symbol, "date": date, "symbol": s, "action": ADD},
+                     {"$set": {"weight": weights.get(s), "seq": seq}}, upsert=True) for s in added]
+    ops += [UpdateOne({"index_symbol": index_symbol, "date": date, "symbol": s, "action": REMOVE},
+                      {"$set": {"weight": None, "seq": seq}}, upsert=True) for s in removed]
+    if ops:
+        db[COL_EVENTS].bulk_write(ops, ordered=False)
+
+    last_cp = state.get("last_checkpoint") if state else None
+    # 当天已有 checkpoint 时同日重跑也要覆盖它，否则 members_asof_db 会停在当天第一次的成分上
+    if last_cp is None or last_cp == date or _days_between(last_cp, date) >= CHECKPOINT_DAYS:
+        db[COL_CHECKPOINTS].update_one(
+            {"index_symbol": index_symbol, "date": date},
+            {"$set": {"components": sorted(current), "weights": weights, "count": len(current)}},
+            upsert=True)
+        last_cp = date
+
+    state_doc = {
+        "components": sorted(current), "weights": weights, "last_seen": date,
+        "last_checkpoint": last_cp, "count": len(current), "seq": seq,
+    }
+    if index_name:
+        state_doc["index_name"] = index_name
+    if category:
+        state_doc["category"] = category
+    db[COL_STATE].update_one(
+        {"index_symbol": index_symbol},
+        {"$set": state_doc, "$setOnInsert": {"first_seen": date}},
+        upsert=True)
+    return len(added), len(removed)
+
+
+def observed_on(db, date):
+    """某日已写入观测的指数集合 (断点续传用)"""
+    return {d["index_symbol"] for d in db[COL_STATE].find({"last_seen": date}, {"index_symbol": 1})}
+
+
+# =========================================================================
+# 单点查询 (直接查库，不需要加载内存索引)
+# =========================================================================
+def members_asof_db(db, index_symbol, date):
+    """最近一个 checkpoint + 其后的事件重放。返回 (成分集合, 权重字典)"""
+    cp = db[COL_CHECKPOINTS].find_one({"index_symbol": index_symbol, "date": {"$lte": date}},
+                                      sort=[("date", -1)])
+    if not cp:
+        return set(), {}
+    members, weights = set(cp["components"]), dict(cp.get("weights") or {})
+    cursor = db[COL_EVENTS].find({"index_symbol": index_symbol, "date": {"$gt": cp["date"], "$lte": date}},
+                                 sort=[("date", ASCENDING), ("seq", ASCENDING)])
+    for ev in cursor:
+        if ev["action"] == ADD:
+            members.add(ev["symbol"])
+            if ev.get("weight") is not None:
+                weights[ev["symbol"]] = ev["weight"]
+        else:
+            members.discard(ev["symbol"])
+            weights.pop(ev["symbol"], None)
+    return members, weights
+
+
+# =========================================================================
+# 内存区间索引
+# =========================================================================
+class MembershipIndex:
+    """
+    把事件流转换为 (指数, 股票, [start, end)) 区间，按指数存为 numpy 数组。
+    查询某日成分 = 一次向量化比较，几百个成分的指数耗时在微秒级。
+    """
+
+    def __init__(self):
+        self._by_index = {}                 # index -> (symbols ndarray, starts, ends)
+        self._by_symbol = defaultdict(list)  # symbol -> [(index, start, end)]
+
+    @classmethod
+    def load(cls, db, index_symbols=None):
+        query = {"index_symbol": {"$in": list(index_symbols)}} if index_symbols else {}
+        events = db[COL_EVENTS].find(query, {"_id": 0, "index_symbol": 1, "symbol": 1, "date": 1, "action": 1,
+                                             "seq": 1})
+        return cls.from_events(events)
+
+    @classmethod
+    def from_events(cls, events):
+        df = pd.DataFrame(list(events), columns=["index_symbol", "symbol", "date", "action", "seq"])
+        obj = cls()
+        if df.empty:
+            return obj
+        # 同一天多次 record_snapshot 可能对同一 (指数, 股票, 日期) 先后写入 ADD 与 REMOVE: 按 seq 保留最后一次
+        df["seq"] = pd.to_numeric(df["seq"], errors="coerce").fillna(-1)
+        df = df.sort_values(["index_symbol", "symbol", "date", "seq"], kind="mergesort")
+        df = df.drop_duplicates(["index_symbol", "symbol", "date"], keep="last")
+
+        rows = []
+        for (index_symbol, symbol), grp in df.groupby(["index_symbol", "symbol"], sort=False):
+            start = None
+            for date, action in zip(grp["date"].values, grp["action"].values):
+                d = np.datetime64(date, "D")
+                if action == ADD and start is None:
+                    start = d
+                elif action == REMOVE and start is not None:
+                    rows.append((index_symbol, symbol, start, d))
+                    start = None
+            if start is not None:
+                rows.append((index_symbol, symbol, start, OPEN_END))
+
+        for index_symbol, symbol, start, end in rows:
+            obj._by_symbol[symbol].append((index_symbol, start, end))
+        iv = pd.DataFrame(rows, columns=["index_symbol", "symbol", "start", "end"])
+        for index_symbol, grp in iv.groupby("index_symbol", sort=False):
+            obj._by_index[index_symbol] = (grp["symbol"].to_numpy(),
+                                           grp["start"].to_numpy().astype("datetime64[D]"),
+                                           grp["end"].to_numpy().astype("datetime64[D]"))
+        return obj
+
+    # ---------------------------------------------------------------
+    @staticmethod
+    def _day(date):
+        return np.datetime64(pd.Timestamp(date).date(), "D")
+
+    def indices(self):
+        return list(self._by_index)
+
+    def members(self, index_symbol, date):
+        """某日成分股集合 (区间为左闭右开: 调出日当天已不在指数内)"""
+        entry = self._by_index.get(index_symbol)
+        if entry is None:
+            return set()
+        symbols, starts, ends = entry
+        d = self._day(date)
+        return set(symbols[(starts <= d) & (ends > d)])
+
+    def history(self, symbol):
+        """某股票的全部成分区间 DataFrame[index_symbol, start, end]，end 为 NaT 表示至今"""
+        rows = [(i, pd.Timestamp(s), pd.NaT if e == OPEN_END else pd.Timestamp(e))
+                for i, s, e in self._by_symbol.get(symbol, [])]
+        return pd.DataFrame(rows, columns=["index_symbol", "start", "end"]).sort_values("start", ignore_index=True)
+
+    def indices_of(self, symbol, date):
+        d = self._day(date)
+        return {i for i, s, e in self._by_symbol.get(symbol, []) if s <= d < e}
+
+    def universe(self, index_symbols, dates):
+        """
+        回测股票池批量接口。
+        index_symbols: 单个指数或列表 (多个指数取并集)
+        dates: 交易日序列
+        返回: DataFrame(index=dates, columns=曾入选的股票, values=bool)
+        """
+        if isinstance(index_symbols, str):
+            index_symbols = [index_symbols]
+        days = pd.DatetimeIndex(dates).values.astype("datetime64[D]")
+        parts = [self._by_index[i] for i in index_symbols if i in self._by_index]
+        if not parts:
+            return pd.DataFrame(index=pd.DatetimeIndex(dates), dtype=bool)
+
+        symbols = np.concatenate([p[0] for p in parts])
+        starts = np.concatenate([p[1] for p in parts])
+        ends = np.concatenate([p[2] for p in parts])
+        columns, col_idx = np.unique(symbols, return_inverse=True)
+
+        # 差分数组: 区间 [start, end) 映射到日期下标 [lo, hi)，+1/-1 后累加
+        lo = np.searchsorted(days, starts, side="left")
+        hi = np.searchsorted(days, ends, side="left")
+        delta = np.zeros((len(days) + 1, len(columns)), dtype=np.int32)
+        np.add.at(delta, (lo, col_idx), 1)
+        np.add.at(delta, (hi, col_idx), -1)
+        mask = np.cumsum(delta[:-1], axis=0) > 0
+        return pd.DataFrame(mask, index=pd.DatetimeIndex(dates), columns=columns)
@@ -0,0 +1,269 @@
+"""
+Module: portfolio_backtest.py
+Description: A 股日频截面组合回测引擎 (NumPy 面板)
+Features:
+    1. [Input] 目标权重面板 target (日期 × 股票)：某行全为 NaN 表示当日不调仓，可直接表达月度/周度调仓。
+    2. [Tradability] 停牌 (无成交) 不能买卖；涨停封板不能买入、跌停封板不能卖出 (按成交时点判断)。
+       受限的那一部分调仓被跳过，其余照常执行；被阻挡的股票在之后每个交易日重试，直到成交或出现新的调仓信号。
+    3. [T+1] 收盘信号最早在下一交易日成交 (lag >= 1)；每日只有一个成交时点，当日买入的仓位不会在当日卖出。
+    4. [Cost] 双边佣金 + 卖出印花税 (按日期分段) + 滑点；买入资金不足时按比例缩减买单。
+    5. [Return] 使用前复权价计算持仓收益 (含分红送转)；成交时点可选 open / close，
+       开盘成交时把收益拆成 隔夜 + 日内 两段。
+    6. [Report] 净值、日收益、换手、成本、被阻挡金额、个股 / 分组收益归因、年化指标。
+
+性能: 日期维度循环，股票维度全向量化；20 年 × 5000+ 只股票约 5000 次迭代，秒级完成。
+用法:
+    market = load_market(db, start, end)
+    bt = PortfolioBacktester(market, exec_at="close")
+    result = bt.run(target, groups=industry_of_symbol)
+    print(format_report(result))
+"""
+
+import numpy as np
+import pandas as pd
+
+from . import limit_rules, symbol_master
+from .mongo_loader import load_frame
+
+# --- 配置 ---
+COMMISSION = 0.00025        # 佣金 (双边)
+SLIPPAGE = 0.0005           # 滑点 (双边，按成交额)
+# 卖出印花税: (生效日, 税率)。2008-09-19 起单边征收 0.1%，2023-08-28 起减半；更早的双边征收按 0.1% 近似
+STAMP_DUTY = [("1990-01-01", 0.001), ("2023-08-28", 0.0005)]
+PRICE_EPS = 0.001
+TRADING_DAYS_PER_YEAR = 252
+
+
+# =========================================================================
+# 行情面板
+# =========================================================================
+def _pivot(df, date_field, value):
+    return symbol_master.dense_pivot(df, date_field, "symbol", value)
+
+
+def load_market(db, start, end=None, symbols=None):
+    """
+    从 vnpy_stock 读取回测所需面板 (全部对齐到 日期 × 股票):
+        close / open (原始价)、adj (qfq 因子)、traded (当日有成交)、up / down (涨跌停价)、valid (适用涨跌幅)、
+        st (风险警示)、ipo_free (新股无涨跌幅)
+    """
+    q = {"datetime": {"$gte": start}}
+    if end is not None:
+        q["datetime"]["$lte"] = end
+    if symbols is not None:
+        q["symbol"] = {"$in": list(symbols)}
+    bars = load_frame(db["bar_daily"], q, {"symbol": "str", "datetime": "datetime", "open_price": "float",
+                                           "close_price": "float", "volume": "float"})
+    if bars.empty:
+        raise ValueError("bar_daily 在指定区间没有数据")
+    bars = bars.drop_duplicates(["symbol", "datetime"], keep="last")
+    close = _pivot(bars, "datetime", "close_price")
+    index, columns = close.index, close.columns
+    open_ = _pivot(bars, "datetime", "open_price").reindex(index=index, columns=columns)
+    volume = _pivot(bars, "datetime", "volume").reindex(index=index, columns=columns)
+    traded = close.notna() & (volume > 0)
+
+    sym_q = {"symbol": {"$in": list(columns)}}
+    adj = pd.DataFrame(list(db["adjust_factor"].find(sym_q, {"_id": 0, "symbol": 1, "date": 1, "factor": 1})))
+    if adj.empty:
+        adj = pd.DataFrame(1.0, index=index, columns=columns)
+    else:
+        adj = _pivot(adj.assign(date=pd.to_datetime(adj["date"])).drop_duplicates(["symbol", "date"], keep="last"),
+                     "date", "factor")
+        adj = adj.reindex(index.union(adj.index)).ffill().reindex(index=index, columns=columns).fillna(1.0)
+
+    status = db["stock_status_history"].find({**sym_q, "st_history": {"$exists": True}},
+                                             {"_id": 0, "symbol": 1, "st_history": 1})
+    st = limit_rules.st_mask(status, index, columns)
+    listed = {d["symbol"]: d.get("list_date") for d in db["stock_info"].find(sym_q, {"_id": 0, "symbol": 1, "list_date": 1})}
+    ipo_free = limit_rules.ipo_free_mask(index, columns, listed)
+    up, down, valid = limit_rules.reference_limits(close, adj, traded, st=st, ipo_free=ipo_free)
+    return {"close": close, "open": open_, "adj": adj, "traded": traded,
+            "up": up, "down": down, "valid": valid, "st": st, "ipo_free": ipo_free}
+
+
+# =========================================================================
+# 回测引擎
+# =========================================================================
+class PortfolioBacktester:
+    def __init__(self, market, exec_at="close", lag=1, capital=1e8,
+                 commission=COMMISSION, slippage=SLIPPAGE, stamp_duty=STAMP_DUTY):
+        if exec_at not in ("open", "close"):
+            raise ValueError(f"exec_at 只能是 open / close: {exec_at}")
+        if lag < 1:
+            raise ValueError("信号至少滞后 1 个交易日执行 (收盘信号无法在当日成交)")
+        self.exec_at = exec_at
+        self.lag = lag
+        self.capital = float(capital)
+        self.commission = commission
+        self.slippage = slippage
+
+        close = market["close"]
+        self.index, self.columns = close.index, close.columns
+        self._prepare(market, stamp_duty)
+
+    def _prepare(self, m, stamp_duty):
+        """把行情面板预处理为 float64 / bool 的 ndarray，循环内只做向量运算"""
+        adj = m["adj"].to_numpy(float)
+        close = m["close"].to_numpy(float)
+        open_ = m["open"].reindex_like(m["close"]).to_numpy(float)
+        traded = m["traded"].to_numpy(bool)
+        valid = m["valid"].to_numpy(bool)
+        up, down = m["up"].to_numpy(float), m["down"].to_numpy(float)
+
+        # 前复权价 (停牌日沿用上一成交价，收益为 0)
+        adj_close = pd.DataFrame(np.where(traded, close / adj, np.nan)).ffill().to_numpy()
+        prev_close = np.vstack([np.full((1, close.shape[1]), np.nan), adj_close[:-1]])
+        with np.errstate(divide="ignore", invalid="ignore"):
+            if self.exec_at == "close":
+                px = close
+                self._r_pre = np.nan_to_num(adj_close / prev_close - 1)
+                self._r_post = np.zeros_like(adj_close)
+            else:
+                px = open_
+                adj_open = np.where(traded, open_ / adj, np.nan)
+                self._r_pre = np.nan_to_num(np.where(traded, adj_open / prev_close - 1, 0.0))
+                self._r_post = np.nan_to_num(np.where(traded, adj_close / adj_open - 1, 0.0))
+
+        limited_up = valid & (px >= up - PRICE_EPS)
+        limited_down = valid & (px <= down + PRICE_EPS)
+        self._can_buy = traded & ~limited_up
+        self._can_sell = traded & ~limited_down
+
+        stamp = pd.Series(np.nan, index=self.index)
+        for start, rate in stamp_duty:
+            stamp[self.index >= pd.Timestamp(start)] = rate
+        self._stamp = stamp.fillna(stamp_duty[0][1]).to_numpy()
+
+    # ---------------------------------------------------------------
+    def run(self, target, groups=None):
+        """
+        target: DataFrame(日期 × 股票) 目标权重，行和 <= 1 (其余为现金)；全 NaN 行 = 不调仓
+        groups: {symbol: 分组} 或 Series，用于分组归因 (例如申万一级行业)
+        """
+        target = target.reindex(columns=self.columns)
+        w = target.reindex(self.index).to_numpy(float)
+        rebalance = ~np.isnan(w).all(axis=1)
+        w = np.nan_to_num(w)
+        if (w < -1e-12).any():
+            raise ValueError("A 股现货组合不支持负权重")
+
+        T, N = w.shape
+        if groups is not None:
+            labels = pd.Series(groups).reindex(self.columns).fillna("Unknown").astype(str)
+            group_names, group_idx = np.unique(labels.to_numpy(), return_inverse=True)
+            group_pnl = np.zeros((T, len(group_names)))
+
+        hold = np.zeros(N)
+        cash = self.capital
+        pending_w, pending = None, np.zeros(N, dtype=bool)
+        symbol_pnl = np.zeros(N)
+        nav = np.empty(T)
+        turnover = np.zeros(T)
+        cost = np.zeros(T)
+        blocked_buy = np.zeros(T)
+        blocked_sell = np.zeros(T)
+        n_holdings = np.zeros(T, dtype=int)
+        cb = self.commission + self.slippage
+
+        for t in range(T):
+            pnl = hold * self._r_pre[t]
+            hold = hold + pnl
+            s = t - self.lag
+            fresh = s >= 0 and rebalance[s]
+            if fresh:
+                pending_w, pending = w[s], np.ones(N, dtype=bool)
+            if pending.any():
+                value = hold.sum() + cash
+                delta = np.where(pending, pending_w * value - hold, 0.0)
+                buy = delta > 0
+                sell = delta < 0
+                stuck_buy = buy & ~self._can_buy[t]
+                stuck_sell = sell & ~self._can_sell[t]
+                if fresh:
+                    # 只在调仓当日统计被阻挡金额，之后的重试不重复计入
+                    blocked_buy[t] = delta[stuck_buy].sum()
+                    blocked_sell[t] = -delta[stuck_sell].sum()
+                delta[stuck_buy | stuck_sell] = 0.0
+                pending = stuck_buy | stuck_sell
+
+                sells = -delta[sell].sum()
+                cs = cb + self._stamp[t]
+                cash += sells * (1 - cs)
+                buys = delta[buy].sum()
+                if buys * (1 + cb) > cash:
+                    # 卖单被阻挡或成本导致资金不足: 按比例缩减买单
+                    scale = max(cash, 0.0) / (buys * (1 + cb))
+                    delta[buy] *= scale
+                    buys *= scale
+                cash -= buys * (1 + cb)
+                hold = hold + delta
+                hold[np.abs(hold) < 1e-8] = 0.0
+                cost[t] = sells * cs + buys * cb
+                turnover[t] = (buys + sells) / value if value > 0 else 0.0
+
+            post = hold * self._r_post[t]
+            hold = hold + post
+            pnl = pnl + post
+            symbol_pnl += pnl
+            if groups is not None:
+                group_pnl[t] = np.bincount(group_idx, weights=pnl, minlength=len(group_names))
+            nav[t] = hold.sum() + cash
+            n_holdings[t] = int((hold > 0).sum())
+
+        daily = pd.DataFrame({
+            "nav": nav, "turnover": turnover, "cost": cost,
+            "blocked_buy": blocked_buy, "blocked_sell": blocked_sell, "n_holdings": n_holdings,
+        }, index=self.index)
+        daily["ret"] = daily["nav"].pct_change().fillna(daily["nav"].iloc[0] / self.capital - 1)
+        result = {
+            "daily": daily,
+            "symbol_pnl": pd.Series(symbol_pnl, index=self.columns).sort_values(),
+            "final_holdings": pd.Series(hold, index=self.columns)[hold > 0],
+            "stats": stats(daily, self.capital),
+        }
+        if groups is not None:
+            result["group_pnl"] = pd.DataFrame(group_pnl, index=self.index, columns=group_names)
+        return result
+
+
+# =========================================================================
+# 统计与报告
+# =========================================================================
+def stats(daily, capital):
+    nav = daily["nav"]
+    years = len(nav) / TRADING_DAYS_PER_YEAR
+    ret = daily["ret"]
+    drawdown = nav / nav.cummax() - 1
+    vol = ret.std() * np.sqrt(TRADING_DAYS_PER_YEAR)
+    annual = (nav.iloc[-1] / capital) ** (1 / years) - 1 if years > 0 else np.nan
+    return {
+        "total_return": nav.iloc[-1] / capital - 1,
+        "annual_return": annual,
+        "annual_vol": vol,
+        "sharpe": annual / vol if vol > 0 else np.nan,
+        "max_drawdown": drawdown.min(),
+        "annual_turnover": daily["turnover"].sum() / years if years > 0 else np.nan,
+        "total_cost": daily["cost"].sum(),
+        "blocked_buy": daily["blocked_buy"].sum(),
+        "blocked_sell": daily["blocked_sell"].sum(),
+        "avg_holdings": daily["n_holdings"].mean(),
+    }
+
+
+def format_report(result, top=5):
+    s = result["stats"]
+    lines = [
+        f"总收益率: {s['total_return']:.2%} | 年化: {s['annual_return']:.2%} | 波动: {s['annual_vol']:.2%}",
+        f"夏普比率: {s['sharpe']:.2f} | 最大回撤: {s['max_drawdown']:.2%} | 平均持仓: {s['avg_holdings']:.0f} 只",
+        f"年化换手: {s['annual_turnover']:.1f} 倍 | 交易成本: {s['total_cost']:,.0f} | "
+        f"调仓被阻挡 买入 {s['blocked_buy']:,.0f} / 卖出 {s['blocked_sell']:,.0f}",
+    ]
+    if "group_pnl" in result:
+        g = result["group_pnl"].sum().sort_values(ascending=False)
+        fmt = lambda part: ", ".join(f"{k} {v:,.0f}" for k, v in part.items())
+        lines.append("分组贡献: " + (fmt(g) if len(g) <= 2 * top else f"{fmt(g.head(top))} ... {fmt(g.tail(top))}"))
+    sp = result["symbol_pnl"]
+    lines.append("个股贡献 (前): " + ", ".join(f"{k} {v:,.0f}" for k, v in sp.tail(top)[::-1].items()))
+    lines.append("个股贡献 (后): " + ", ".join(f"{k} {v:,.0f}" for k, v in sp.head(top).items()))
+    return "\n".join(lines)
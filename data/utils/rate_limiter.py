@@ -0,0 +1,54 @@
+"""
+Module: rate_limiter.py
+Description: 按数据源的限速器 (线程安全)
+Features:
+    1. 令牌桶: 平均 rate 次/秒，允许 burst 次突发；取代各脚本里固定的 random sleep。
+    2. 并发上限: 同一数据源同时在途的请求数不超过 max_concurrency。
+    3. 随机抖动: 每次放行附加少量随机延迟，避免请求节奏过于规律。
+
+用法:
+    limits = {"EM": SourceLimit(rate=2.0, max_concurrency=2), "SW": SourceLimit(rate=0.5)}
+    with limits["EM"]:
+        df = ak.stock_board_concept_hist_em(...)
+"""
+
+import random
+import threading
+import time
+
+
+class SourceLimit:
+    def __init__(self, rate, burst=1, max_concurrency=1, jitter=(0.0, 0.3)):
+        self.rate = float(rate)
+        self.burst = max(int(burst), 1)
+        self.jitter = jitter
+        self._tokens = float(self.burst)
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max(int(max_concurrency), 1))
+
+    def acquire(self):
+        self._slots.acquire()
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= 1.0:
+                    self._tokens -= 1.0
+                    break
+                wait = (1.0 - self._tokens) / self.rate
+            time.sleep(wait)
+        if self.jitter and self.jitter[1] > 0:
+            time.sleep(random.uniform(*self.jitter))
+
+    def release(self):
+        self._slots.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+        return False
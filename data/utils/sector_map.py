@@ -0,0 +1,179 @@
+"""
+Module: sector_map.py
+Description: 股票 -> 行业 (申万 L1/L2/L3) / 概念 反向索引
+Features:
+    1. [One Scan] 一次扫描 industry_history + stock_concepts 构建全市场映射，取代逐只股票 find_one。
+    2. [Compact] 概念快照按股票去重，只保留概念集合发生变化的日期 (变更点编码)。
+    3. [Snapshot] 持久化到 data/cache/sector_map.pkl，下次启动直接加载。
+    4. [Incremental] refresh() 只拉取水位线当天及之后的概念快照 (当天可能被 11 追加)；行业表被 10 重建时自动全量重载。
+    5. [Query] snapshot(date) 一次返回全市场某日的 行业 + 概念；industry_of / concepts_of 单只查询。
+
+代码格式: 统一为 6 位纯代码 (stock_concepts 中的 000001.SZ 会去掉后缀)。
+"""
+
+import os
+import pickle
+
+import numpy as np
+import pandas as pd
+
+from . import symbol_master
+
+# --- 配置 ---
+CACHE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "cache", "sector_map.pkl")
+COL_INDUSTRY = "industry_history"
+COL_CONCEPTS = "stock_concepts"
+
+INDUSTRY_FIELDS = ["level1_code", "level1_name", "level2_code", "level2_name",
+                   "level3_code", "level3_name", "industry_name"]
+UNKNOWN = "Unknown"
+
+
+def _bare(symbol):
+    return symbol_master.to_code([symbol])[0]
+
+
+def _asof(df, date):
+    """df 已按 (symbol, date) 排序: 取每只股票在 date 当日或之前的最后一条"""
+    if date is not None:
+        df = df[df["date"] <= pd.Timestamp(date).strftime("%Y-%m-%d")]
+    return df.drop_duplicates("symbol", keep="last").set_index("symbol")
+
+
+class SectorMap:
+    def __init__(self):
+        self.industry = pd.DataFrame(columns=["symbol", "date"] + INDUSTRY_FIELDS)
+        self.concepts = pd.DataFrame(columns=["symbol", "date", "concepts"])  # concepts: tuple(code)
+        self.concept_names = {}
+        self.watermarks = {"industry_count": 0, "industry_updated_at": None, "concepts_date": ""}
+
+    # ---------------------------------------------------------------
+    # 构建 / 刷新
+    # ---------------------------------------------------------------
+    def _industry_watermark(self, db):
+        col = db[COL_INDUSTRY]
+        last = col.find_one({}, {"updated_at": 1}, sort=[("updated_at", -1)])
+        return col.estimated_document_count(), (last or {}).get("updated_at")
+
+    def _load_industry(self, db):
+        proj = {"_id": 0, "symbol": 1, "date": 1}
+        proj.update({f: 1 for f in INDUSTRY_FIELDS})
+        df = pd.DataFrame(list(db[COL_INDUSTRY].find({}, proj)), columns=["symbol", "date"] + INDUSTRY_FIELDS)
+        if not df.empty:
+            df["symbol"] = symbol_master.to_code(df["symbol"])
+            df["date"] = df["date"].astype(str).str[:10]
+            df = df.sort_values(["symbol", "date"], kind="mergesort", ignore_index=True)
+            # 重复字符串转为 category，全市场几万行只占几 MB
+            for f in INDUSTRY_FIELDS:
+                df[f] = df[f].astype("category")
+        self.industry = df
+        count, updated_at = self._industry_watermark(db)
+        self.watermarks["industry_count"], self.watermarks["industry_updated_at"] = count, updated_at
+
+    def _load_concepts(self, db, since=""):
+        # $gte: 11 会用 $addToSet 往当天的文档里继续追加概念，水位当天要重读；重复由下面的去重消化
+        query = {"date": {"$gte": since}} if since else {}
+        rows = []
+        for doc in db[COL_CONCEPTS].find(query, {"_id": 0, "symbol": 1, "date": 1, "concepts": 1}):
+            tags = doc.get("concepts") or []
+            for t in tags:
+                self.concept_names[t["code"]] = t.get("name", t["code"])
+            rows.append((doc["symbol"], str(doc["date"])[:10], tuple(sorted(t["code"] for t in tags))))
+        if not rows:
+            return 0
+        new = pd.DataFrame(rows, columns=["symbol", "date", "concepts"])
+        new["symbol"] = symbol_master.to_code(new["symbol"])
+        df = pd.concat([self.concepts, new], ignore_index=True)
+        df = df.sort_values(["symbol", "date"], kind="mergesort", ignore_index=True)
+        df = df.drop_duplicates(["symbol", "date"], keep="last")  # 同日重读: 以最新读到的概念集合为准
+        # 变更点编码: 同一只股票相邻两天概念集合相同则只保留前一条
+        same = (df["symbol"] == df["symbol"].shift()) & (df["concepts"] == df["concepts"].shift())
+        df = df[~same].reset_index(drop=True)
+        self.watermarks["concepts_date"] = max(self.watermarks["concepts_date"], new["date"].max())
+        if df.equals(self.concepts):
+            return 0  # 只是重读了水位当天，没有新内容
+        self.concepts = df
+        return len(rows)
+
+    @classmethod
+    def build(cls, db):
+        obj = cls()
+        obj._load_industry(db)
+        obj._load_concepts(db)
+        return obj
+
+    def refresh(self, db):
+        """增量刷新。返回 (行业是否重载, 新增概念快照数)"""
+        count, updated_at = self._industry_watermark(db)
+        reload_industry = (count != self.watermarks["industry_count"]
+                           or updated_at != self.watermarks["industry_updated_at"])
+        if reload_industry:
+            self._load_industry(db)
+        return reload_industry, self._load_concepts(db, since=self.watermarks["concepts_date"])
+
+    # ---------------------------------------------------------------
+    # 持久化
+    # ---------------------------------------------------------------
+    def save(self, path=CACHE_PATH):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            pickle.dump(self.__dict__, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path=CACHE_PATH):
+        obj = cls()
+        with open(path, "rb") as f:
+            obj.__dict__.update(pickle.load(f))
+        return obj
+
+    # ---------------------------------------------------------------
+    # 查询
+    # ---------------------------------------------------------------
+    def snapshot(self, date=None, symbols=None):
+        """
+        全市场某日 (None = 最新) 的行业与概念。
+        返回 DataFrame(index=symbol, columns=INDUSTRY_FIELDS + ["concepts"])，concepts 为概念代码元组。
+        """
+        ind = _asof(self.industry, date)[INDUSTRY_FIELDS]
+        con = _asof(self.concepts, date)[["concepts"]]
+        out = ind.join(con, how="outer")
+        out["industry_name"] = out["industry_name"].astype(object).fillna(UNKNOWN)
+        out["concepts"] = out["concepts"].apply(lambda c: c if isinstance(c, tuple) else ())
+        if symbols is not None:
+            out = out.reindex(symbol_master.to_code(symbols))
+            out["industry_name"] = out["industry_name"].fillna(UNKNOWN)
+            out["concepts"] = out["concepts"].apply(lambda c: c if isinstance(c, tuple) else ())
+        return out
+
+    def industry_of(self, symbol, date=None, level="industry_name"):
+        rows = self.industry[self.industry["symbol"] == _bare(symbol)]
+        if date is not None:
+            rows = rows[rows["date"] <= pd.Timestamp(date).strftime("%Y-%m-%d")]
+        return rows[level].iloc[-1] if len(rows) else UNKNOWN
+
+    def concepts_of(self, symbol, date=None, names=True):
+        rows = self.concepts[self.concepts["symbol"] == _bare(symbol)]
+        if date is not None:
+            rows = rows[rows["date"] <= pd.Timestamp(date).strftime("%Y-%m-%d")]
+        codes = rows["concepts"].iloc[-1] if len(rows) else ()
+        return tuple(self.concept_names.get(c, c) for c in codes) if names else codes
+
+    def members_of_concept(self, code, date=None):
+        """反查: 某日持有该概念的股票 (基于 stock_concepts 快照)"""
+        snap = _asof(self.concepts, date)
+        mask = np.fromiter((code in c for c in snap["concepts"]), dtype=bool, count=len(snap))
+        return set(snap.index[mask])
+
+
+def load_or_build(db, path=CACHE_PATH, save=True):
+    """优先加载本地快照并增量刷新；快照不存在或损坏时全量构建"""
+    try:
+        sm = SectorMap.load(path)
+        changed = any(sm.refresh(db))
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError):
+        sm, changed = SectorMap.build(db), True
+    if save and changed:
+        sm.save(path)
+    return sm
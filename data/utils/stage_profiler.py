@@ -0,0 +1,277 @@
+"""
+Module: stage_profiler.py
+Description: 数据管道阶段级性能记录器 (Stage Profiler)
+Features:
+    1. stage() 上下文管理器 / timed() 装饰器: 记录每个阶段的 墙钟时间、CPU 时间、处理行数、峰值内存。
+    2. [Mongo] 通过 pymongo CommandListener 自动统计读/写耗时与次数 (按阶段归集)。
+    3. [Network] 自动挂钩 requests.Session.send，统计 HTTP 等待时间 (akshare / NetworkGuard 均经过此处)。
+    4. [Record] 每次脚本运行写一份 JSON 记录到 data/logs/runs/<script>/，供 run_report.py 做跨运行对比。
+
+用法:
+    from utils.stage_profiler import StageProfiler
+    PROF = StageProfiler(__file__)          # 必须在创建 MongoClient 之前实例化
+
+    with PROF.stage("download"):
+        df = ak.stock_zh_a_daily(...)
+        PROF.add_rows(len(df))
+
+    if __name__ == "__main__":
+        with PROF:                          # 退出时写入运行记录
+            run()
+"""
+
+import json
+import os
+import socket
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from functools import wraps
+
+from pymongo import monitoring
+
+try:
+    import resource
+except ImportError:  # Windows 无 resource 模块，峰值内存记为 None
+    resource = None
+
+# --- 配置 ---
+LOG_ROOT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "logs", "runs")
+
+READ_COMMANDS = {"find", "getMore", "aggregate", "count", "distinct", "listIndexes", "collStats", "explain"}
+WRITE_COMMANDS = {"insert", "update", "delete", "findAndModify", "createIndexes", "drop"}
+
+ROOT_STAGE = "(root)"
+
+
+def peak_rss_mb():
+    """进程峰值常驻内存 (MB)。Linux 单位为 KB，macOS 为 Byte。"""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024, 1)
+
+
+class StageStats:
+    __slots__ = ("name", "calls", "wall_s", "cpu_s", "network_s", "network_calls",
+                 "mongo_read_s", "mongo_read_ops", "mongo_write_s", "mongo_write_ops",
+                 "rows", "peak_rss_mb")
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.wall_s = self.cpu_s = self.network_s = 0.0
+        self.mongo_read_s = self.mongo_write_s = 0.0
+        self.network_calls = self.mongo_read_ops = self.mongo_write_ops = 0
+        self.rows = 0
+        self.peak_rss_mb = None
+
+    def to_dict(self):
+        d = {k: getattr(self, k) for k in self.__slots__}
+        for k in ("wall_s", "cpu_s", "network_s", "mongo_read_s", "mongo_write_s"):
+            d[k] = round(d[k], 4)
+        # 剩余时间 = 本地计算 (pandas / Python)
+        d["compute_s"] = round(max(self.wall_s - self.network_s - self.mongo_read_s - self.mongo_write_s, 0.0), 4)
+        return d
+
+
+class _MongoTimer(monitoring.CommandListener):
+    """把 Mongo 命令耗时归集到当前线程所在的阶段"""
+
+    def __init__(self, profiler):
+        self.profiler = profiler
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self._record(event.command_name, event.duration_micros)
+
+    def failed(self, event):
+        self._record(event.command_name, event.duration_micros)
+
+    def _record(self, command_name, micros):
+        kind = "read" if command_name in READ_COMMANDS else ("write" if command_name in WRITE_COMMANDS else None)
+        if kind:
+            self.profiler._add_mongo(kind, micros / 1e6)
+
+
+class StageProfiler:
+    """单次脚本运行的阶段记录器"""
+
+    def __init__(self, script, track_http=True):
+        self.script = os.path.splitext(os.path.basename(script))[0]
+        self.stages = {}
+        self.order = []
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._started_at = None
+        self._t0 = None
+
+        self._stage(ROOT_STAGE)
+        monitoring.register(_MongoTimer(self))
+        if track_http:
+            self._patch_requests()
+
+    # ---------------------------------------------------------------
+    # 阶段管理
+    # ---------------------------------------------------------------
+    def _stage(self, name):
+        with self._lock:
+            if name not in self.stages:
+                self.stages[name] = StageStats(name)
+                self.order.append(name)
+            return self.stages[name]
+
+    def _active(self):
+        """当前线程所在的全部阶段 (由外到内)。网络/Mongo/行数按包含关系计入每一层。"""
+        stack = getattr(self._local, "stack", None)
+        return [self.stages[n] for n in stack] if stack else [self.stages[ROOT_STAGE]]
+
+    @contextmanager
+    def stage(self, name):
+        """记录一个阶段。嵌套阶段以 'outer/inner' 命名，父阶段的统计包含子阶段。"""
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = []
+        full_name = f"{stack[-1]}/{name}" if stack else name
+        st = self._stage(full_name)
+        stack.append(full_name)
+        w0, c0 = time.perf_counter(), time.process_time()
+        try:
+            yield st
+        finally:
+            stack.pop()
+            with self._lock:
+                st.calls += 1
+                st.wall_s += time.perf_counter() - w0
+                st.cpu_s += time.process_time() - c0
+                st.peak_rss_mb = peak_rss_mb()
+
+    def timed(self, name=None):
+        """装饰器版本的 stage()"""
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.stage(name or func.__name__):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def add_rows(self, n):
+        with self._lock:
+            for st in self._active():
+                st.rows += int(n or 0)
+
+    @contextmanager
+    def network(self):
+        """手动标记一段网络等待 (未走 requests 的接口可用)"""
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._add_network(time.perf_counter() - t0)
+
+    def _add_network(self, seconds):
+        with self._lock:
+            for st in self._active():
+                st.network_s += seconds
+                st.network_calls += 1
+
+    def _add_mongo(self, kind, seconds):
+        with self._lock:
+            for st in self._active():
+                if kind == "read":
+                    st.mongo_read_s += seconds
+                    st.mongo_read_ops += 1
+                else:
+                    st.mongo_write_s += seconds
+                    st.mongo_write_ops += 1
+
+    def _patch_requests(self):
+        try:
+            import requests
+        except ImportError:
+            return
+        original = requests.Session.send
+        if getattr(original, "_stage_profiler", False):
+            return
+        profiler = self
+
+        def timed_send(session, request, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                return original(session, request, **kwargs)
+            finally:
+                profiler._add_network(time.perf_counter() - t0)
+
+        timed_send._stage_profiler = True
+        requests.Session.send = timed_send
+
+    # ---------------------------------------------------------------
+    # 运行记录
+    # ---------------------------------------------------------------
+    def __enter__(self):
+        self._started_at = datetime.now()
+        self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.save(status="failed" if exc_type else "ok")
+        return False
+
+    def record(self, status="ok"):
+        wall = time.perf_counter() - self._t0 if self._t0 else None
+        stages = [self.stages[n].to_dict() for n in self.order]
+        # 嵌套阶段已包含在父阶段中，只汇总顶层阶段 + root
+        top = [s for s in stages if "/" not in s["name"]]
+        totals = {k: round(sum(s[k] for s in top), 4)
+                  for k in ("network_s", "mongo_read_s", "mongo_write_s", "compute_s", "rows")}
+        if wall is not None:
+            covered = sum(s["wall_s"] for s in top if s["name"] != ROOT_STAGE)
+            totals["compute_s"] = round(max(wall - totals["network_s"] - totals["mongo_read_s"]
+                                            - totals["mongo_write_s"], 0.0), 4)
+            totals["unstaged_s"] = round(max(wall - covered, 0.0), 4)
+        buckets = {"network": totals["network_s"],
+                   "mongo": totals["mongo_read_s"] + totals["mongo_write_s"],
+                   "compute": totals["compute_s"]}
+        return {
+            "script": self.script,
+            "status": status,
+            "started_at": self._started_at.isoformat() if self._started_at else None,
+            "finished_at": datetime.now().isoformat(),
+            "wall_s": round(wall, 4) if wall is not None else None,
+            "host": socket.gethostname(),
+            "argv": sys.argv,
+            "peak_rss_mb": peak_rss_mb(),
+            "bound": max(buckets, key=buckets.get),
+            "totals": totals,
+            "stages": stages,
+        }
+
+    def save(self, status="ok"):
+        rec = self.record(status)
+        out_dir = os.path.join(LOG_ROOT, self.script)
+        os.makedirs(out_dir, exist_ok=True)
+        path = os.path.join(out_dir, datetime.now().strftime("%Y%m%d_%H%M%S") + ".json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(rec, f, ensure_ascii=False, indent=2)
+        print(f"⏱  运行记录: {path} (耗时 {rec['wall_s']}s, 瓶颈: {rec['bound']})")
+        return path
+
+
+def load_runs(script, limit=None):
+    """按时间顺序读取某脚本的历史运行记录"""
+    out_dir = os.path.join(LOG_ROOT, os.path.splitext(os.path.basename(script))[0])
+    if not os.path.isdir(out_dir):
+        return []
+    files = sorted(f for f in os.listdir(out_dir) if f.endswith(".json"))
+    if limit:
+        files = files[-limit:]
+    runs = []
+    for name in files:
+        with open(os.path.join(out_dir, name), encoding="utf-8") as f:
+            runs.append(json.load(f))
+    return runs
@@ -0,0 +1,264 @@
+"""
+Module: symbol_master.py
+Description: 代码字典编码 —— 稳定整数 ID、向量化代码格式转换、int32 交易日索引
+Features:
+    1. [Formats] 库中同一只股票有多种写法: '600519' (bar_daily)、'600519.SH' (成分股 / VtSymbol)、
+       'sh600519' (新浪)；板块为 'BK0475'。parse() 统一解析为 (code, market)，
+       to_code / to_vt / to_sina / to_exchange 互相转换。
+       全部先 pd.factorize 去重，只对唯一值做一次向量化正则 + 前缀规则，再按编码 take 回原长度：
+       百万行的成分股 / 面板列转换只处理几千个唯一代码，取代逐行 Python 字符串拼接。
+    2. [Market Rules] 与 fix_stock_codes_unified 的统一标准一致: 6 -> SH；0 / 3 / 20 -> SZ；8 / 4 / 92 -> BJ；90 -> SH。
+       显式给出的交易所 (stock_info.exchange: SSE / SZSE / BSE) 或代码自带的后缀 / 前缀优先于推断
+       (指数与股票同号时，如上证指数 000001 与平安银行 000001，必须给交易所)。
+    3. [Stable IDs] SymbolMaster 在 vnpy_master.symbol_master 中为每个 VtSymbol 分配只增不改的 int32 ID
+       ({_id: id, symbol: '600519.SH', code, market})；面板 / 掩码 / 缓存可以用 int32 列键，
+       join / groupby 比字符串键更省内存、更快。
+    4. [Trading Days] TradingDays 把交易日映射为 int32 序号 (09 交易日历，首个交易日为 0)，
+       "前 N 个交易日" 即整数减法；非交易日可按 how="prev" 归到之前最近的交易日。
+    5. [Dense Pivot] dense_pivot() 用两列整数编码直接散射到 ndarray，取代 DataFrame.pivot 的 MultiIndex unstack。
+
+用法:
+    symbol_master.to_vt(["600519", "sz000001", "BK0475"])      # ['600519.SH', '000001.SZ', 'BK0475']
+    master = SymbolMaster.load(client["vnpy_master"])
+    ids = master.ids(df["symbol"], register=True)             # int32
+    days = TradingDays.load(client["vnpy_master"])
+    t = days.index(df["datetime"])                            # int32，非交易日 -1
+"""
+
+import numpy as np
+import pandas as pd
+from pymongo.errors import BulkWriteError
+
+# --- 配置 ---
+COL_MASTER = "symbol_master"  # vnpy_master
+MISSING = -1
+
+EXCHANGE_MARKET = {"SSE": "SH", "SZSE": "SZ", "BSE": "BJ"}
+MARKET_EXCHANGE = {v: k for k, v in EXCHANGE_MARKET.items()}
+# (前缀, 市场)，按顺序匹配
+MARKET_RULES = [("6", "SH"), ("0", "SZ"), ("3", "SZ"), ("20", "SZ"), ("8", "BJ"), ("4", "BJ"), ("92", "BJ"),
+                ("90", "SH")]
+_PATTERN = r"^(?P<pre>[A-Za-z]{2})?(?P<code>\d{6})(?:\.(?P<suf>[A-Za-z]{2}))?$"
+
+
+# ---------------------------------------------------------------
+# 代码格式
+# ---------------------------------------------------------------
+def _infer_market(codes):
+    """6 位数字代码按号段推断市场 (推断不出为空串)"""
+    codes = pd.Series(codes, dtype=object).astype(str)
+    out = np.full(len(codes), "", dtype=object)
+    for prefix, market in reversed(MARKET_RULES):  # 倒序赋值，先出现的规则最后覆盖
+        out[codes.str.startswith(prefix).to_numpy()] = market
+    return out
+
+
+def _parse_unique(values):
+    """唯一值 -> (code, market) 两个 object ndarray"""
+    s = pd.Series(values, dtype=object).fillna("").astype(str).str.strip()
+    m = s.str.extract(_PATTERN)
+    matched = m["code"].notna().to_numpy()
+    code = np.where(matched, m["code"].fillna(""), s).astype(object)
+    market = np.full(len(s), "", dtype=object)
+    explicit = m["suf"].fillna(m["pre"]).fillna("").str.upper().to_numpy(dtype=object)
+    market[matched] = np.where(explicit[matched] != "", explicit[matched], _infer_market(code[matched]))
+    return code, market
+
+
+def _factorize(values):
+    """(编码, 唯一值)；category 列直接复用其编码"""
+    s = pd.Series(values, dtype=values.dtype if isinstance(values, pd.Series) else object)
+    if isinstance(s.dtype, pd.CategoricalDtype):
+        idx = s.cat.codes.to_numpy()
+        uniques = np.append(s.cat.categories.to_numpy(dtype=object), None)
+        return np.where(idx < 0, len(uniques) - 1, idx), uniques
+    idx, uniques = pd.factorize(s.astype(object), use_na_sentinel=False)
+    return idx, np.asarray(uniques, dtype=object)
+
+
+def _apply(values, exchanges, fmt):
+    """在唯一值上解析并格式化 (fmt(code, market) -> ndarray)，再按编码展开为原长度"""
+    if exchanges is None:
+        idx, uniques = _factorize(values)
+        return fmt(*_parse_unique(uniques))[idx]
+    return fmt(*parse(values, exchanges))
+
+
+def parse(values, exchanges=None):
+    """
+    values:    代码序列 (任意上述写法)
+    exchanges: 可选，与 values 等长的交易所 (SSE / SZSE / BSE)，非空时覆盖推断的市场
+    返回 (code, market) 两个与输入等长的 object ndarray；无法识别的代码原样返回，market 为空串
+    """
+    idx, uniques = _factorize(values)
+    code, market = _parse_unique(uniques)
+    code, market = code[idx], market[idx]
+    if exchanges is not None:
+        given = pd.Series(exchanges, dtype=object).map(EXCHANGE_MARKET).to_numpy(dtype=object)
+        has = pd.notna(given)
+        market = np.where(has, given, market).astype(object)
+    return code, market
+
+
+def _vt(code, market):
+    out = code.copy()
+    has = market != ""
+    out[has] = pd.Series(code[has], dtype=object).str.cat(pd.Series(market[has], dtype=object), sep=".").to_numpy()
+    return out
+
+
+def _sina(code, market):
+    out = code.copy()
+    has = market != ""
+    out[has] = pd.Series(market[has], dtype=object).str.lower().str.cat(pd.Series(code[has], dtype=object)).to_numpy()
+    return out
+
+
+def to_code(values):
+    """-> 纯代码 ('600519' / 'BK0475')"""
+    return _apply(values, None, lambda code, market: code)
+
+
+def to_vt(values, exchanges=None):
+    """-> '600519.SH'；无市场的代码 (板块、未知号段) 原样"""
+    return _apply(values, exchanges, _vt)
+
+
+def to_sina(values, exchanges=None):
+    """-> 'sh600519' (新浪 / 东财接口前缀)；无市场的代码原样"""
+    return _apply(values, exchanges, _sina)
+
+
+def to_exchange(values):
+    """-> vnpy 交易所代码 (SSE / SZSE / BSE)，无法识别为空串"""
+    return _apply(values, None,
+                  lambda code, market: pd.Series(market, dtype=object).map(MARKET_EXCHANGE).fillna("").to_numpy(dtype=object))
+
+
+# ---------------------------------------------------------------
+# 稳定整数 ID
+# ---------------------------------------------------------------
+class SymbolMaster:
+    def __init__(self, db_master=None, mapping=None):
+        """mapping: {VtSymbol: id}；db_master 为 None 时只在内存中分配 (测试 / 临时面板)"""
+        self.db = db_master
+        self._id = dict(mapping or {})
+        self._symbols = None
+
+    @classmethod
+    def load(cls, db_master):
+        col = db_master[COL_MASTER]
+        col.create_index("symbol", unique=True)
+        return cls(db_master, {d["symbol"]: d["_id"] for d in col.find({}, {"symbol": 1})})
+
+    def __len__(self):
+        return len(self._id)
+
+    def _table(self):
+        """id -> VtSymbol 的 object ndarray (按需重建)"""
+        if self._symbols is None or len(self._symbols) < len(self._id):
+            n = max(self._id.values(), default=-1) + 1
+            table = np.full(n, None, dtype=object)
+            for s, i in self._id.items():
+                table[i] = s
+            self._symbols = table
+        return self._symbols
+
+    def register(self, values, exchanges=None):
+        """为尚未登记的代码分配新 ID (当前最大 ID 之后顺延)，返回新增个数"""
+        new = [s for s in pd.unique(to_vt(values, exchanges)) if s and s not in self._id]
+        if not new:
+            return 0
+        start = max(self._id.values(), default=-1) + 1
+        docs = [{"_id": start + k, "symbol": s} for k, s in enumerate(new)]
+        if self.db is not None:
+            code, market = parse([d["symbol"] for d in docs])
+            for d, c, m in zip(docs, code, market):
+                d.update(code=c, market=m)
+            try:
+                self.db[COL_MASTER].insert_many(docs, ordered=False)
+            except BulkWriteError:
+                # 其他进程同时登记: 以库中为准重新加载后再补
+                self._id = {d["symbol"]: d["_id"] for d in self.db[COL_MASTER].find({}, {"symbol": 1})}
+                self._symbols = None
+                return self.register(new)
+        self._id.update({d["symbol"]: d["_id"] for d in docs})
+        return len(docs)
+
+    def ids(self, values, exchanges=None, register=False):
+        """代码序列 -> int32 ndarray；未登记的为 MISSING (register=True 时先登记)"""
+        if register:
+            self.register(values, exchanges)
+        if exchanges is None:
+            idx, uniques = _factorize(values)
+            vt = to_vt(uniques)
+        else:
+            idx, vt = _factorize(to_vt(values, exchanges))
+        lookup = np.array([self._id.get(s, MISSING) for s in vt], dtype=np.int32)
+        return lookup[idx]
+
+    def symbols(self, ids, fmt="vt"):
+        """int ID -> 代码 (fmt: vt / code / sina)；MISSING 或未知 ID 为 None"""
+        ids = np.asarray(ids, dtype=np.int64)
+        table = self._table()
+        ok = (ids >= 0) & (ids < len(table))
+        out = np.full(len(ids), None, dtype=object)
+        out[ok] = table[ids[ok]]
+        if fmt == "vt":
+            return out
+        has = pd.notna(out)
+        out[has] = (to_code if fmt == "code" else to_sina)(out[has])
+        return out
+
+
+# ---------------------------------------------------------------
+# 交易日序号
+# ---------------------------------------------------------------
+class TradingDays:
+    def __init__(self, dates):
+        self.dates = pd.DatetimeIndex(pd.unique(pd.DatetimeIndex(dates).normalize())).sort_values()
+        self._days = self.dates.values.astype("datetime64[D]").astype(np.int64)
+
+    @classmethod
+    def load(cls, db_master, exchange="SSE"):
+        docs = db_master["trading_calendar"].find({"exchange": exchange}, {"_id": 0, "date": 1})
+        return cls(pd.to_datetime([d["date"] for d in docs]))
+
+    def __len__(self):
+        return len(self.dates)
+
+    def index(self, dates, how="exact"):
+        """
+        日期 -> int32 交易日序号。
+        how="exact": 非交易日 / 超出日历为 MISSING；how="prev": 归到当日或之前最近的交易日 (早于日历起点为 MISSING)
+        """
+        d = pd.DatetimeIndex(dates)
+        days = d.values.astype("datetime64[D]").astype(np.int64)
+        pos = np.searchsorted(self._days, days, side="right") - 1
+        valid = ~d.isna() & (pos >= 0)
+        if how == "exact":
+            valid &= self._days[np.clip(pos, 0, None)] == days if len(self._days) else False
+        return np.where(valid, pos, MISSING).astype(np.int32)
+
+    def to_dates(self, idx):
+        idx = np.asarray(idx)
+        ok = (idx >= 0) & (idx < len(self.dates))
+        out = np.full(len(idx), np.datetime64("NaT"), dtype=self.dates.values.dtype)
+        out[ok] = self.dates.values[idx[ok]]
+        return pd.DatetimeIndex(out)
+
+
+# ---------------------------------------------------------------
+# 面板
+# ---------------------------------------------------------------
+def dense_pivot(df, index, columns, values):
+    """
+    长表 -> 宽表 (与 df.pivot(index, columns, values).sort_index() 等价，重复键保留最后一条)。
+    行 / 列键各自 factorize 为整数后直接散射到 float64 ndarray。
+    """
+    r, rows = pd.factorize(df[index], sort=True)
+    c, cols = pd.factorize(df[columns], sort=True)
+    ok = (r >= 0) & (c >= 0)  # 键为空的行丢弃
+    out = np.full((len(rows), len(cols)), np.nan)
+    out[r[ok], c[ok]] = df[values].to_numpy(np.float64)[ok]
+    return pd.DataFrame(out, index=pd.Index(rows, name=index), columns=pd.Index(cols, name=columns))
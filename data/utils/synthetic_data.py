@@ -0,0 +1,176 @@
+"""
+Module: synthetic_data.py
+Description: 合成 A 股数据生成器 (用于离线基准测试)
+Features:
+    1. N 只股票 × M 年日线 (随机游走价格、随机停牌缺口、零成交日)。
+    2. 股本变动、季度财报 (利润表/资产负债表, 累计口径, 字段名与新浪源一致)、年度分红送转。
+    3. 交易日历、停牌注解、行业历史、stock_info。
+    4. 所有文档结构与 02/06/07/10/14/17 脚本写入的结构保持一致，可直接灌入 mongod 或 mongomock。
+    5. 固定随机种子，结果可复现。
+"""
+
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+# 与脚本 08 的字段别名保持一致
+NET_PROFIT_FIELD = "归属于母公司所有者的净利润"
+REVENUE_FIELD = "营业总收入"
+EQUITY_FIELD = "归属于母公司股东权益合计"
+OTHER_EQUITY_FIELD = "其他权益工具"
+
+BOARDS = [
+    # (代码起点, 交易所)
+    (600000, "SSE"),
+    (1, "SZSE"),
+    (300001, "SZSE"),
+    (688001, "SSE"),
+]
+
+INDUSTRIES = ["银行", "医药生物", "电子", "计算机", "食品饮料", "有色金属", "汽车", "电力设备"]
+
+
+def make_calendar(n_years, end=None):
+    """工作日近似交易日历 (datetime64[D])"""
+    end = pd.Timestamp(end or datetime.now().date())
+    start = end - pd.DateOffset(years=n_years)
+    return pd.bdate_range(start, end).values.astype("datetime64[D]")
+
+
+def make_symbols(n_symbols):
+    out = []
+    for i in range(n_symbols):
+        base, exchange = BOARDS[i % len(BOARDS)]
+        out.append((f"{base + i // len(BOARDS):06d}", exchange))
+    return out
+
+
+def _to_dt(d64):
+    return datetime.combine(pd.Timestamp(d64).date(), datetime.min.time())
+
+
+def generate(n_symbols=100, n_years=5, seed=42, suspend_prob=0.002, zero_vol_prob=0.001):
+    """
+    生成一套完整的合成数据集。
+    返回: {"vnpy_stock": {collection: [docs]}, "vnpy_master": {collection: [docs]}}
+    """
+    rng = np.random.default_rng(seed)
+    cal = make_calendar(n_years)
+    n_days = len(cal)
+    stock = {k: [] for k in ["stock_info", "bar_daily", "share_capital", "finance_income", "finance_balance",
+                             "finance_dividend", "suspension_daily_raw", "industry_history", "trading_calendar"]}
+
+    for symbol, exchange in make_symbols(n_symbols):
+        # 上市日: 部分股票在区间中途上市
+        list_idx = 0 if rng.random() < 0.7 else int(rng.integers(0, n_days // 2))
+        days = cal[list_idx:]
+
+        # --- 日线 ---
+        rets = rng.normal(0.0003, 0.02, len(days))
+        close = 10.0 * np.exp(np.cumsum(rets)) * rng.uniform(0.5, 5.0)
+        open_ = close * (1 + rng.normal(0, 0.005, len(days)))
+        high = np.maximum(open_, close) * (1 + np.abs(rng.normal(0, 0.01, len(days))))
+        low = np.minimum(open_, close) * (1 - np.abs(rng.normal(0, 0.01, len(days))))
+        outstanding = float(rng.integers(1, 50)) * 1e8
+        volume = rng.uniform(0.002, 0.05, len(days)) * outstanding
+
+        # 停牌: 以 suspend_prob 的概率开始一段 1~20 天的缺口
+        keep = np.ones(len(days), dtype=bool)
+        starts = np.flatnonzero(rng.random(len(days)) < suspend_prob)
+        for s in starts:
+            keep[s:s + int(rng.integers(1, 20))] = False
+        keep[0] = True
+        volume[rng.random(len(days)) < zero_vol_prob] = 0.0
+
+        for i in np.flatnonzero(keep):
+            dt = _to_dt(days[i])
+            stock["bar_daily"].append({
+                "symbol": symbol, "exchange": exchange, "interval": "d", "datetime": dt,
+                "open_price": float(open_[i]), "high_price": float(high[i]),
+                "low_price": float(low[i]), "close_price": float(close[i]),
+                "volume": float(volume[i]), "turnover": float(volume[i] * close[i]),
+                "turnover_rate": float(volume[i] / outstanding * 100),
+                "outstanding_share": outstanding, "gateway_name": "SYNTHETIC",
+            })
+        for i in np.flatnonzero(~keep)[::3]:
+            stock["suspension_daily_raw"].append({
+                "symbol": symbol, "date": _to_dt(days[i]), "reason": "重大事项",
+            })
+
+        # --- 元数据 / 行业 ---
+        stock["stock_info"].append({
+            "symbol": symbol, "name": f"合成{symbol}", "exchange": exchange,
+            "category": "STOCK_A", "list_date": str(days[0]),
+        })
+        stock["industry_history"].append({
+            "symbol": symbol, "date": str(days[0]), "source": "SYNTHETIC",
+            "industry_name": INDUSTRIES[int(rng.integers(0, len(INDUSTRIES)))],
+        })
+
+        # --- 股本变动: 上市一次 + 约每两年一次 ---
+        total = outstanding * rng.uniform(1.0, 1.6)
+        change_idx = [0] + sorted(rng.choice(np.arange(1, len(days)), size=max(len(days) // 500, 0),
+                                             replace=False).tolist())
+        for i in change_idx:
+            stock["share_capital"].append({
+                "symbol": symbol, "date": _to_dt(days[i]), "total_shares": float(total),
+                "float_shares": float(outstanding), "change_reason": "合成变动",
+            })
+            total *= rng.uniform(1.0, 1.1)
+
+        # --- 季度财报 (累计口径) ---
+        first = pd.Timestamp(days[0]) - pd.DateOffset(years=1)
+        q_ends = pd.date_range(first, pd.Timestamp(days[-1]), freq="QE")
+        annual_profit = total * rng.uniform(0.05, 1.0)
+        equity = total * rng.uniform(2.0, 8.0)
+        for q in q_ends:
+            frac = q.quarter / 4.0
+            profit = annual_profit * frac * rng.uniform(0.8, 1.2)
+            publish = q + timedelta(days=int(rng.integers(25, 110)))
+            base = {"symbol": symbol, "exchange": exchange, "report_date": q.to_pydatetime(),
+                    "publish_date": publish.to_pydatetime(), "gateway_name": "SYNTHETIC"}
+            stock["finance_income"].append(dict(base, **{
+                NET_PROFIT_FIELD: float(profit), REVENUE_FIELD: float(profit * rng.uniform(5, 12)),
+            }))
+            stock["finance_balance"].append(dict(base, **{
+                EQUITY_FIELD: float(equity), OTHER_EQUITY_FIELD: 0.0,
+            }))
+            if q.quarter == 4:
+                annual_profit *= rng.uniform(0.9, 1.25)
+                equity *= rng.uniform(1.0, 1.15)
+
+        # --- 年度分红 (部分年份送转) ---
+        for year in range(pd.Timestamp(days[0]).year, pd.Timestamp(days[-1]).year + 1):
+            ex = pd.Timestamp(year=year, month=6, day=15) + timedelta(days=int(rng.integers(0, 45)))
+            if ex < pd.Timestamp(days[0]) or ex > pd.Timestamp(days[-1]) or rng.random() < 0.3:
+                continue
+            cash = round(float(rng.uniform(0.05, 1.5)), 2)
+            bonus = 0.3 if rng.random() < 0.15 else 0.0
+            stock["finance_dividend"].append({
+                "symbol": symbol, "ex_date": ex.to_pydatetime(),
+                "cash_dividend_per_share": cash, "stock_dividend_per_share": bonus,
+                "plan_desc": f"10派{cash * 10:g}元" + (f"转{bonus * 10:g}股" if bonus else ""),
+            })
+
+    calendar_docs = [{"exchange": "SSE", "date": str(d), "is_trading": True} for d in cal]
+    stock["trading_calendar"] = calendar_docs
+    return {"vnpy_stock": stock, "vnpy_master": {"trading_calendar": calendar_docs}}
+
+
+def load_into(client, dataset, db_prefix="", batch_size=50000):
+    """把 generate() 的结果写入 client (mongod 或 mongomock)，返回 {db_name: Database}"""
+    dbs = {}
+    for db_name, collections in dataset.items():
+        db = client[f"{db_prefix}{db_name}"]
+        for col_name, docs in collections.items():
+            db[col_name].drop()
+            for i in range(0, len(docs), batch_size):
+                # 深拷贝: insert_many 会往文档里写 _id，避免污染原始数据集
+                db[col_name].insert_many([dict(d) for d in docs[i:i + batch_size]], ordered=False)
+        dbs[db_name] = db
+    return dbs
+
+
+def count_rows(dataset):
+    return {f"{db}.{col}": len(docs) for db, cols in dataset.items() for col, docs in cols.items()}
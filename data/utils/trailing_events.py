@@ -0,0 +1,72 @@
+"""
+Module: trailing_events.py
+Description: 稀疏事件的滚动窗口求和 (分红 TTM 等)
+Features:
+    1. [Prefix Sum] 不把事件铺到每个自然日再 rolling: 事件值按 (股票, 日期) 排序后做一次前缀和，
+       窗口 (t - window, t] 内的和 = C(t) - C(t - window)，只在需要的查询日期上做两次 searchsorted。
+    2. [Vectorized] 多只股票一次完成: 事件与查询都编码为 (股票, 日) 复合整数键，全市场一次 searchsorted；
+       单只股票时省略 symbols 参数即可。
+    3. [Day] 日期按自然日比较 (忽略时分秒)，同一天的多次事件 (如同日两笔分红) 自然合并。
+
+用法:
+    ttm = trailing_sum(div.index, div["cash_dividend_per_share"], bars.index, window_days=395)
+    panel = trailing_panel(div_long, trade_days, symbols, 395, date_col="ex_date", value_col="cash_dividend_per_share")
+"""
+
+import numpy as np
+import pandas as pd
+
+_DAY_OFFSET = 1 << 31  # 天数平移为非负，低 32 位存日期
+
+
+def _keys(codes, dates):
+    days = np.asarray(pd.DatetimeIndex(dates).values.astype("datetime64[D]").astype(np.int64))
+    return (np.asarray(codes, dtype=np.int64) << 32) | (days + _DAY_OFFSET)
+
+
+def trailing_sum(event_dates, values, query_dates, window_days, event_symbols=None, query_symbols=None):
+    """
+    每个查询日 t 返回 (t - window_days, t] 内事件值之和 (含 t 当日，与按自然日 rolling(window_days) 一致)。
+    event_symbols / query_symbols: 多只股票时给出，与日期等长；省略表示同一只股票。
+    返回 float64 ndarray (与 query_dates 等长)
+    """
+    event_dates = pd.DatetimeIndex(event_dates)
+    query_dates = pd.DatetimeIndex(query_dates)
+    values = np.asarray(values, dtype=np.float64)
+    n_ev, n_q = len(event_dates), len(query_dates)
+    if n_ev == 0 or n_q == 0:
+        return np.zeros(n_q)
+
+    if event_symbols is None and query_symbols is None:
+        ev_codes, q_codes = np.zeros(n_ev, dtype=np.int64), np.zeros(n_q, dtype=np.int64)
+    else:
+        codes, _ = pd.factorize(np.concatenate([np.asarray(event_symbols, dtype=object),
+                                                np.asarray(query_symbols, dtype=object)]))
+        ev_codes, q_codes = codes[:n_ev], codes[n_ev:]
+
+    ok = ~event_dates.isna() & ~np.isnan(values)
+    ev_keys = _keys(ev_codes[ok], event_dates[ok])
+    order = np.argsort(ev_keys, kind="stable")
+    ev_keys = ev_keys[order]
+    csum = np.concatenate([[0.0], np.cumsum(values[ok][order])])
+
+    valid = ~query_dates.isna()
+    out = np.zeros(n_q)
+    q_hi = _keys(q_codes[valid], query_dates[valid])
+    q_lo = q_hi - window_days
+    out[valid] = csum[np.searchsorted(ev_keys, q_hi, side="right")] - csum[np.searchsorted(ev_keys, q_lo, side="right")]
+    out[~valid] = np.nan
+    return out
+
+
+def trailing_panel(events, dates, symbols, window_days, date_col="date", value_col="value"):
+    """
+    events: 长表 [symbol, date_col, value_col]
+    返回 DataFrame(index=dates, columns=symbols)，每格为该股票截至当日的窗口和
+    """
+    dates, symbols = pd.DatetimeIndex(dates), list(symbols)
+    q_dates = np.repeat(dates.values, len(symbols))
+    q_syms = np.tile(np.asarray(symbols, dtype=object), len(dates))
+    values = trailing_sum(events[date_col], events[value_col], q_dates, window_days,
+                          event_symbols=events["symbol"], query_symbols=q_syms)
+    return pd.DataFrame(values.reshape(len(dates), len(symbols)), index=dates, columns=symbols)